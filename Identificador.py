@@ -3,13 +3,25 @@ import xmltodict
 import re
 import json
 from tkinter import Tk, filedialog
-from PyPDF2 import PdfReader
-import cv2
 from PIL import Image
 import pytesseract
-import easyocr
+import motor_ocr
+import metricas
 from tqdm import tqdm
-from pdf2image import convert_from_path
+import fitz
+import numpy as np
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from utils import format_cnpj, compute_prazo
+
+# Número de processos usados no OCR página a página dos PDFs digitalizados
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+# Resolução usada para rasterizar as páginas sem texto antes do OCR
+OCR_DPI = int(os.environ.get('OCR_DPI', 200))
+# Abaixo desse número de caracteres uma página com imagem é tratada como digitalizada
+MIN_CARACTERES_PAGINA_TEXTO = int(os.environ.get('MIN_CARACTERES_PAGINA_TEXTO', 20))
 
 # Função para o usuário escolher arquivos (um ou vários)
 def selecionar_arquivos():
@@ -26,18 +38,18 @@ def selecionar_arquivos():
 
 # Identificação do tipo de nota
 def identificar_tipo_nota(caminho_arquivo):
+    with metricas.cronometrar('deteccao_tipo'):
+        tipo = _identificar_tipo_nota(caminho_arquivo)
+    metricas.contar('leitor_documentos_total', tipo=tipo)
+    return tipo
+
+def _identificar_tipo_nota(caminho_arquivo):
     extensao = os.path.splitext(caminho_arquivo)[1].lower()
     if extensao == '.xml':
         return 'xml'
     elif extensao == '.pdf':
-        try:
-            reader = PdfReader(caminho_arquivo)
-            for page in reader.pages:
-                if page.extract_text():
-                    return 'pdf_text'
-            return 'pdf_image'
-        except Exception:
-            return 'unknown'
+        # Texto x imagem é decidido página a página em extrair_dados_pdf, com o arquivo aberto uma única vez
+        return 'pdf'
     elif extensao in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
         try:
             with Image.open(caminho_arquivo) as img:
@@ -60,68 +72,298 @@ def ocr_pytesseract(image_path):
 # OCR com easyocr
 def ocr_easyocr(image_path):
     try:
-        reader = easyocr.Reader(['pt'])
-        resultado = reader.readtext(image_path, detail=0, paragraph=True)
-        texto = '\n'.join(resultado)
-        return texto
+        return motor_ocr.ler_texto(image_path)
     except Exception as e:
         return ''
 
+# Namespaces da NF-e, do CT-e e da assinatura digital são descartados dos nomes das tags
+NAMESPACES_FISCAIS = {
+    'http://www.portalfiscal.inf.br/nfe': None,
+    'http://www.portalfiscal.inf.br/cte': None,
+    'http://www.w3.org/2000/09/xmldsig#': None,
+}
+
+def _como_lista(valor):
+    if not valor:
+        return []
+    return valor if isinstance(valor, list) else [valor]
+
+def _caminho(no, *chaves):
+    # Navega no dict do xmltodict devolvendo '' se algum nível não existir
+    for chave in chaves:
+        if not isinstance(no, dict):
+            return ''
+        no = no.get(chave)
+        if no is None:
+            return ''
+    return no
+
+def _data_xml(valor):
+    # 2024-03-05T10:20:00-03:00 ou 2024-03-05 -> 05/03/2024
+    m = re.match(r'(\d{4})-(\d{2})-(\d{2})', valor or '')
+    return f'{m.group(3)}/{m.group(2)}/{m.group(1)}' if m else ''
+
+def _valor_brl(valor):
+    # 1234.5 -> 1.234,50 (mesmo formato devolvido pela OpenAI e esperado na exportação)
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return ''
+    return f'{numero:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.')
+
+def _numero_xml(valor):
+    # Valor numérico do XML; vazio ou malformado vale 0
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _quantidade_brl(valor):
+    # 2.0000 -> 2 ; 2.5000 -> 2,5 (sem separador de milhar)
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return ''
+    return f'{numero:f}'.rstrip('0').rstrip('.').replace('.', ',')
+
+def _documento(no):
+    if not isinstance(no, dict):
+        return ''
+    return no.get('CNPJ') or no.get('CPF') or ''
+
+def _localizar(doc, *nomes):
+    # Procura o primeiro nó com um dos nomes a partir da raiz (nfeProc/NFe/infNFe, NFe/infNFe...)
+    pendentes = [doc]
+    while pendentes:
+        no = pendentes.pop(0)
+        if not isinstance(no, dict):
+            continue
+        for nome in nomes:
+            if nome in no:
+                return no[nome]
+        pendentes.extend(v for v in no.values() if isinstance(v, dict))
+    return None
+
+def mapear_nfe(inf_nfe, arquivo=''):
+    """
+    Monta, a partir do infNFe já parseado, o mesmo dict devolvido por /dados_nota
+    (sem Grupo/Filial, preenchidos depois pelo CNPJ do cliente).
+    """
+    ide = inf_nfe.get('ide', {})
+    total = _caminho(inf_nfe, 'total', 'ICMSTot')
+    duplicatas = _como_lista(_caminho(inf_nfe, 'cobr', 'dup'))
+    data_emissao = _data_xml(ide.get('dhEmi') or ide.get('dEmi'))
+    data_vencimento = _data_xml(duplicatas[0].get('dVenc')) if duplicatas else ''
+    produtos = []
+    for det in _como_lista(inf_nfe.get('det')):
+        prod = det.get('prod', {})
+        produtos.append({
+            'Produto': prod.get('xProd', ''),
+            'Qtde': _quantidade_brl(prod.get('qCom')),
+            'Valor_Unitario': _valor_brl(prod.get('vUnCom')),
+            'Valor_Total_Produto': _valor_brl(prod.get('vProd')),
+        })
+    desconto = _caminho(total, 'vDesc')
+    return {
+        'Arquivo': arquivo,
+        'Numero_Nota': ide.get('nNF', ''),
+        'Cnpj_Fornecedor': format_cnpj(_documento(inf_nfe.get('emit'))),
+        'Cnpj_Cliente': format_cnpj(_documento(inf_nfe.get('dest'))),
+        'Data_Emissao': data_emissao,
+        'Data_Vencimento': data_vencimento,
+        'Condição_de_Pagamento': '',
+        'Prazo': compute_prazo(data_emissao, data_vencimento),
+        'Valor_Total': _valor_brl(_caminho(total, 'vNF')),
+        'Desconto': _valor_brl(desconto) if _numero_xml(desconto) else '',
+        'Nome_do_Lançador': '',
+        'Contrato_de_Parceria?': 'SIM' if len(produtos) > 1 else 'NÃO',
+        'Produtos': produtos,
+    }
+
+# Papéis possíveis do tomador no toma3 do CT-e (toma4 traz o próprio tomador)
+TOMADOR_CTE = {'0': 'rem', '1': 'exped', '2': 'receb', '3': 'dest'}
+
+def _icms_cte(inf_cte):
+    # O grupo de ICMS varia com a tributação (ICMS00, ICMS20, ICMS45, ICMS60, ICMS90, ICMSOutraUF, ICMSSN)
+    icms = _caminho(inf_cte, 'imp', 'ICMS')
+    grupo = next(iter(icms.values()), {}) if isinstance(icms, dict) and icms else {}
+    if not isinstance(grupo, dict):
+        grupo = {}
+    base = grupo.get('vBC') or grupo.get('vBCOutraUF') or grupo.get('vBCSTRet') or ''
+    aliquota = grupo.get('pICMS') or grupo.get('pICMSOutraUF') or grupo.get('pICMSSTRet') or ''
+    valor = grupo.get('vICMS') or grupo.get('vICMSOutraUF') or grupo.get('vICMSSTRet') or ''
+    return _valor_brl(base), _quantidade_brl(aliquota), _valor_brl(valor)
+
+def mapear_cte(inf_cte, arquivo=''):
+    """
+    Monta o dict de /dados_nota a partir do infCte: emitente (transportadora), tomador
+    do serviço como cliente, valores da prestação, ICMS e chaves das NF-e transportadas.
+    """
+    ide = inf_cte.get('ide', {})
+    toma3 = ide.get('toma3') or ide.get('toma03')
+    toma4 = ide.get('toma4') or ide.get('toma04')
+    if isinstance(toma4, dict):
+        tomador = toma4
+    elif isinstance(toma3, dict):
+        tomador = inf_cte.get(TOMADOR_CTE.get(toma3.get('toma'), 'rem'), {})
+    else:
+        tomador = inf_cte.get('rem', {})
+    norm = inf_cte.get('infCTeNorm', {})
+    duplicatas = _como_lista(_caminho(norm, 'cobr', 'dup'))
+    chaves = [n.get('chave', '') for n in _como_lista(_caminho(norm, 'infDoc', 'infNFe')) if isinstance(n, dict)]
+    data_emissao = _data_xml(ide.get('dhEmi') or ide.get('dEmi'))
+    data_vencimento = _data_xml(duplicatas[0].get('dVenc')) if duplicatas else ''
+    valor_prestacao = _valor_brl(_caminho(inf_cte, 'vPrest', 'vTPrest'))
+    base_icms, aliquota_icms, valor_icms = _icms_cte(inf_cte)
+    return {
+        'Arquivo': arquivo,
+        'Numero_Nota': ide.get('nCT', ''),
+        'Cnpj_Fornecedor': format_cnpj(_documento(inf_cte.get('emit'))),
+        'Cnpj_Cliente': format_cnpj(_documento(tomador)),
+        'Data_Emissao': data_emissao,
+        'Data_Vencimento': data_vencimento,
+        'Condição_de_Pagamento': '',
+        'Prazo': compute_prazo(data_emissao, data_vencimento),
+        'Valor_Total': valor_prestacao,
+        'Desconto': '',
+        'Base_ICMS': base_icms,
+        'Aliquota_ICMS': aliquota_icms,
+        'Valor_ICMS': valor_icms,
+        'Chaves_NFe': ', '.join(c for c in chaves if c),
+        'Nome_do_Lançador': '',
+        'Contrato_de_Parceria?': 'NÃO',
+        'Produtos': [{
+            'Produto': ide.get('natOp', '') or 'PRESTACAO DE SERVICO DE TRANSPORTE',
+            'Qtde': '1',
+            'Valor_Unitario': valor_prestacao,
+            'Valor_Total_Produto': valor_prestacao,
+        }],
+    }
+
 # Agentes de extração
 def extrair_dados_xml(caminho_arquivo):
+    with metricas.cronometrar('xml'):
+        return _extrair_dados_xml(caminho_arquivo)
+
+def _extrair_dados_xml(caminho_arquivo):
     with open(caminho_arquivo, 'rb') as f:
         xml_content = f.read()
-        doc = xmltodict.parse(xml_content)
+    texto = xml_content.decode('utf-8', errors='ignore')
     try:
-        infNFe = doc['Nfe']['infNFe']
-        return {'texto_lido': xml_content.decode('utf-8', errors='ignore')}
+        doc = xmltodict.parse(xml_content, process_namespaces=True, namespaces=NAMESPACES_FISCAIS)
+        arquivo = os.path.basename(caminho_arquivo)
+        # NF-e e CT-e têm esquema fixo: os campos saem direto do XML, sem passar pela OpenAI.
+        # O CT-e é testado antes porque o infCte também referencia NF-e (infDoc/infNFe).
+        inf_cte = _localizar(doc, 'infCte')
+        if isinstance(inf_cte, dict):
+            return {'texto_lido': texto, 'tipo': 'cte', 'dados_estruturados': mapear_cte(inf_cte, arquivo)}
+        inf_nfe = _localizar(doc, 'infNFe')
+        if isinstance(inf_nfe, dict):
+            return {'texto_lido': texto, 'tipo': 'nfe', 'dados_estruturados': mapear_nfe(inf_nfe, arquivo)}
+        return {'texto_lido': texto}
     except Exception as e:
-        return {'erro': str(e), 'texto_lido': xml_content.decode('utf-8', errors='ignore')}
+        return {'erro': str(e), 'texto_lido': texto}
 
-def extrair_dados_pdf_texto(caminho_arquivo):
-    reader = PdfReader(caminho_arquivo)
-    texto = ""
-    for page in reader.pages:
-        texto += page.extract_text() or ""
+def extrair_dados_imagem(caminho_arquivo, ao_progresso_ocr=None):
+    with metricas.cronometrar('ocr'):
+        texto = ocr_easyocr(caminho_arquivo)
+    if ao_progresso_ocr:
+        ao_progresso_ocr(1, 1)
     return {
         'texto_lido': texto
     }
 
-def pdf_para_imagens(caminho_arquivo):
-    # Converte cada página do PDF em imagem (usa Pillow e PyPDF2)
-    reader = PdfReader(caminho_arquivo)
-    imagens = []
-    for i, page in enumerate(reader.pages):
-        if '/XObject' in page['/Resources']:
-            continue  # Ignora PDFs que já são pesquisáveis
-        # Caso precise converter PDF para imagem, utilize bibliotecas como pdf2image
-        # Aqui, apenas retorna o PDF, pois o pytesseract pode aceitar PDF diretamente
-    return [caminho_arquivo]
-
-def extrair_dados_imagem(caminho_arquivo):
-    texto = ocr_easyocr(caminho_arquivo)
-    return {
-        'texto_lido': texto
-    }
+def _ocr_pagina(pagina):
+    # Recebe a página já rasterizada como array (sem arquivo temporário em disco)
+    return motor_ocr.ler_texto(pagina)
 
-def extrair_dados_pdf_imagem(caminho_arquivo):
+_pool_ocr = None
+_pool_ocr_lock = threading.Lock()
+
+def _get_pool_ocr():
+    # spawn: o processo web tem threads (fila de extração), então não usamos fork
+    global _pool_ocr
+    with _pool_ocr_lock:
+        if _pool_ocr is None:
+            _pool_ocr = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=motor_ocr.aquecer)
+        return _pool_ocr
+
+def _descartar_pool_ocr(pool):
+    # Um processo do OCR morreu (memória, crash do modelo): o pool não aceita mais tarefas.
+    # Descarta para que a próxima chamada crie outro; só se ainda for o pool atual
+    global _pool_ocr
+    with _pool_ocr_lock:
+        if _pool_ocr is pool:
+            _pool_ocr = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def ocr_paginas(paginas, ao_progresso=None):
+    """
+    Executa o OCR de várias páginas (arrays numpy) em paralelo e devolve os textos na ordem das páginas.
+    `ao_progresso(k, n)` é chamado quando as k primeiras páginas estão prontas.
+    """
+    if OCR_WORKERS <= 1 or len(paginas) <= 1:
+        return _coletar_ocr(map(_ocr_pagina, paginas), len(paginas), ao_progresso)
+    pool = _get_pool_ocr()
+    try:
+        return _coletar_ocr(pool.map(_ocr_pagina, paginas), len(paginas), ao_progresso)
+    except BrokenProcessPool as e:
+        print(f'Pool de OCR interrompido ({e}); recriando e repetindo as {len(paginas)} páginas')
+        _descartar_pool_ocr(pool)
+    pool = _get_pool_ocr()
+    try:
+        return _coletar_ocr(pool.map(_ocr_pagina, paginas), len(paginas), ao_progresso)
+    except BrokenProcessPool:
+        _descartar_pool_ocr(pool)
+        raise
+
+def _coletar_ocr(resultados, total, ao_progresso):
     textos = []
+    for texto in resultados:
+        textos.append(texto)
+        if ao_progresso:
+            ao_progresso(len(textos), total)
+    return textos
+
+def _rasterizar(pagina):
+    pix = pagina.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csRGB, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+def extrair_dados_pdf(caminho_arquivo, ao_progresso_ocr=None):
+    """
+    Abre o PDF uma única vez com o PyMuPDF e classifica cada página: páginas com texto têm
+    o texto extraído diretamente, páginas digitalizadas são rasterizadas e vão para o OCR.
+    Assim um PDF misto (DANFE em texto + boleto digitalizado) só faz OCR do necessário.
+    """
     try:
-        paginas = convert_from_path(
-            caminho_arquivo,
-            poppler_path=r'C:\Users\paulo.lima.LUFT11\Desktop\ROBOS\poppler-24.08.0\Library\bin'
-        )
-        reader = easyocr.Reader(['pt'])
-        for pagina in paginas:
-            pagina.save('temp_page.png')
-            texto = reader.readtext('temp_page.png', detail=0, paragraph=True)
-            textos.append('\n'.join(texto))
-        texto_total = '\n'.join(textos)
+        with metricas.cronometrar('texto_pdf'), fitz.open(caminho_arquivo) as doc:
+            textos = []
+            tipos_paginas = []
+            paginas_ocr = []
+            for i, pagina in enumerate(doc):
+                texto = pagina.get_text()
+                if len(texto.strip()) < MIN_CARACTERES_PAGINA_TEXTO and pagina.get_images():
+                    textos.append('')
+                    tipos_paginas.append('imagem')
+                    paginas_ocr.append((i, _rasterizar(pagina)))
+                else:
+                    textos.append(texto)
+                    tipos_paginas.append('texto')
+        if paginas_ocr:
+            metricas.contar('leitor_paginas_ocr_total', len(paginas_ocr))
+            with metricas.cronometrar('ocr'):
+                textos_ocr = ocr_paginas([arr for _, arr in paginas_ocr], ao_progresso_ocr)
+            for (i, _), texto in zip(paginas_ocr, textos_ocr):
+                textos[i] = texto
+        # \f entre as páginas: a redução do texto (reducao_texto) trata cada página à parte
+        return {
+            'texto_lido': '\n\f'.join(textos),
+            'tipos_paginas': tipos_paginas
+        }
     except Exception as e:
-        texto_total = ''
-    return {
-        'texto_lido': texto_total
-    }
+        print(f'Erro ao ler o PDF {caminho_arquivo}: {e!r}')
+        return {'erro': str(e), 'texto_lido': ''}
 
 # Função principal para processar os arquivos
 def processar_notas(arquivos):
@@ -130,10 +372,8 @@ def processar_notas(arquivos):
         tipo = identificar_tipo_nota(arquivo)
         if tipo == 'xml':
             dados = extrair_dados_xml(arquivo)
-        elif tipo == 'pdf_text':
-            dados = extrair_dados_pdf_texto(arquivo)
-        elif tipo == 'pdf_image':
-            dados = extrair_dados_pdf_imagem(arquivo)
+        elif tipo == 'pdf':
+            dados = extrair_dados_pdf(arquivo)
         elif tipo == 'image':
             dados = extrair_dados_imagem(arquivo)
         else:
@@ -144,16 +384,14 @@ def processar_notas(arquivos):
     return resultados
 
 # Função principal para processar um arquivo individual (para integração com Flask)
-def processar_arquivo_identificador(path):
+def processar_arquivo_identificador(path, ao_progresso_ocr=None):
     tipo = identificar_tipo_nota(path)
     if tipo == 'xml':
         dados = extrair_dados_xml(path)
-    elif tipo == 'pdf_text':
-        dados = extrair_dados_pdf_texto(path)
-    elif tipo == 'pdf_image':
-        dados = extrair_dados_pdf_imagem(path)
+    elif tipo == 'pdf':
+        dados = extrair_dados_pdf(path, ao_progresso_ocr)
     elif tipo == 'image':
-        dados = extrair_dados_imagem(path)
+        dados = extrair_dados_imagem(path, ao_progresso_ocr)
     else:
         dados = {'tipo': 'unknown', 'arquivo': os.path.basename(path)}
     dados['arquivo'] = os.path.basename(path)
@@ -161,7 +399,17 @@ def processar_arquivo_identificador(path):
 
 # Programa principal
 if __name__ == "__main__":
-    arquivos_notas = selecionar_arquivos()
+    import sys
+    # Aceita arquivos ou pastas na linha de comando (ex.: uma pasta de CT-e); sem argumentos abre a janela de seleção
+    if len(sys.argv) > 1:
+        arquivos_notas = []
+        for caminho in sys.argv[1:]:
+            if os.path.isdir(caminho):
+                arquivos_notas.extend(os.path.join(caminho, nome) for nome in sorted(os.listdir(caminho)))
+            else:
+                arquivos_notas.append(caminho)
+    else:
+        arquivos_notas = selecionar_arquivos()
     print(f"Arquivos selecionados: {arquivos_notas}")
     resultados = processar_notas(arquivos_notas)
     json_final = json.dumps(resultados, indent=2, ensure_ascii=False)
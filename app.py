@@ -1,345 +1,338 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, after_this_request
+from flask import Flask, Response, g, render_template, request, jsonify, send_from_directory, send_file, after_this_request
 from flask_cors import CORS
 import os
-import pandas as pd
-import tempfile
 import json
-import Identificador
-import tabular_notas_openai
-import signal
-import re
-from utils import extract_cnpj_fornecedor_cliente, extrair_por_regex, extract_nome_fornecedor, buscar_filial_por_cnpj, COND_PAGAMENTOS_DF, PRODUTOS_DF
-import csv
+import cache_extracao
+import fila_extracao
+import armazenamento
+import exportacao
+import metricas
+import recebimento
+from extracao import nome_base, preencher_filial
+import gzip
+import hashlib
+import time
+import threading
+from utils import buscar_filial_por_cnpj, buscar_filiais_por_cnpjs, buscar_produtos, tabela
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 CORS(app)
+# Os processos do servidor gravam as métricas em disco para que /metrics some todos os workers
+metricas.habilitar_gravacao()
 
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-NOTAS_PATH = "notas_salvas.json"
-OPENAI_HISTORICO_PATH = "openai_historico.json"
-HISTORICO_LIDAS = 'historico_notas_lidas.json'
-
-def carregar_notas():
-    if os.path.exists(NOTAS_PATH):
-        with open(NOTAS_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def salvar_notas(notas):
-    with open(NOTAS_PATH, "w", encoding="utf-8") as f:
-        json.dump(notas, f, ensure_ascii=False, indent=2)
-
-def carregar_historico_openai():
-    if os.path.exists(OPENAI_HISTORICO_PATH):
-        with open(OPENAI_HISTORICO_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def salvar_historico_openai(historico):
-    with open(OPENAI_HISTORICO_PATH, "w", encoding="utf-8") as f:
-        json.dump(historico, f, ensure_ascii=False, indent=2)
+def registrar_resultado_openai(filename, dado, digest=None):
+    # Salva no histórico a resposta tabulada pela OpenAI
+    armazenamento.salvar(armazenamento.COLECAO_OPENAI, nome_base(filename), dado, digest)
 
 def salvar_historico_lidas(filename, registro):
-    try:
-        if os.path.exists(HISTORICO_LIDAS):
-            with open(HISTORICO_LIDAS, 'r', encoding='utf-8') as f:
-                historico = json.load(f)
-        else:
-            historico = {}
-    except Exception:
-        historico = {}
-    historico[filename] = registro
-    with open(HISTORICO_LIDAS, 'w', encoding='utf-8') as f:
-        json.dump(historico, f, ensure_ascii=False, indent=2)
-
-def nome_base(filename):
-    return os.path.splitext(os.path.basename(filename))[0]
-
-# Função para gerar JSON estruturado via regex (fallback)
-def gerar_json_regex(texto, filename):
-    from utils import extract_cnpj_fornecedor_cliente, extrair_por_regex
-    import re
-    cnpj_fornecedor, cnpj_cliente = extract_cnpj_fornecedor_cliente(texto)
-    def format_cnpj(cnpj):
-        cnpj = re.sub(r'\D', '', cnpj)
-        if len(cnpj) == 14:
-            return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
-        return cnpj
-    # Datas
-    data_emissao = extrair_por_regex(texto, 'Data_Emissao')
-    data_vencimento = extrair_por_regex(texto, 'Data_Vencimento')
-    # Prazo
-    prazo = ''
-    try:
-        from utils import compute_prazo
-        prazo = compute_prazo(data_emissao, data_vencimento)
-    except:
-        prazo = ''
-    # Produtos: pode-se tentar regex mais avançado aqui se desejar
-    produtos = []
-    # Tipo heurístico simples
-    tipo = ''
-    texto_lower = texto.lower()
-    if 'serviço' in texto_lower or 'nfs-e' in texto_lower or 'nfs ' in texto_lower:
-        tipo = 'NFS-e'
-    elif 'danfe' in texto_lower:
-        tipo = 'DANFE'
-    # Monta JSON apenas com os campos usados no programa
-    cnpj_cliente_formatado = format_cnpj(cnpj_cliente)
-    grupo, cod_filial, filial = buscar_filial_por_cnpj(cnpj_cliente_formatado)
-    return {
-        'Arquivo': filename,
-        'Cnpj_Fornecedor': format_cnpj(cnpj_fornecedor),
-        'Cnpj_Cliente': cnpj_cliente_formatado,
-        'Grupo': grupo or '',
-        'Cod Filial': cod_filial or '',
-        'Filial': filial or '',
-        'Numero_Nota': extrair_por_regex(texto, 'Numero_Nota'),
-        'Data_Emissao': data_emissao,
-        'Data_Vencimento': data_vencimento,
-        'Prazo': prazo,
-        'Nome_do_Lançador': '',
-        'Valor_Total': extrair_por_regex(texto, 'Valor_Total'),
-        'Desconto': extrair_por_regex(texto, 'Desconto'),
-        'Produtos': produtos,  # Sempre retorna o campo Produtos
-        'erro': 'fallback_regex'
-    }
+    armazenamento.salvar(armazenamento.COLECAO_LIDAS, filename, registro)
+
+def hash_upload(filename):
+    path = os.path.join(UPLOAD_FOLDER, filename)
+    return cache_extracao.hash_do_arquivo(path) if os.path.exists(path) else None
+
+# Tabelas de consulta carregadas inteiras pela tela de validação: rota -> tabela do catálogo
+TABELAS_REFERENCIA = {
+    'cond_pagamentos': 'COND_PAGAMENTOS',
+    'contas_contabeis': 'CONTA_CONTABIL',
+    'cc_reduzido': 'CC_REDUZIDO',
+    'itens_conta': 'ITEM_CONTA',
+}
+
+# chave -> (versao, etag, {codificacao: corpo}); serializado e comprimido uma vez por versão das tabelas
+_respostas_versionadas = {}
+
+def _resposta_serializada(chave, versao, gerar):
+    entrada = _respostas_versionadas.get(chave)
+    if entrada is None or entrada[0] != versao:
+        corpo = app.json.dumps(gerar()).encode('utf-8')
+        corpos = {'identity': corpo, 'gzip': gzip.compress(corpo, compresslevel=6)}
+        if brotli is not None:
+            corpos['br'] = brotli.compress(corpo, quality=6)
+        entrada = (versao, hashlib.sha256(corpo).hexdigest()[:32], corpos)
+        _respostas_versionadas[chave] = entrada
+    return entrada
+
+def resposta_json_versionada(chave, versao, gerar):
+    """
+    Resposta JSON com ETag (hash do conteúdo) e compressão gzip/brotli conforme o
+    Accept-Encoding. `gerar()` só é chamado quando a versão das tabelas muda.
+    Um If-None-Match com o ETag atual recebe 304 sem corpo.
+    """
+    _, etag, corpos = _resposta_serializada(chave, versao, gerar)
+    # ETag fraco: o mesmo conteúdo vale para qualquer codificação
+    if request.if_none_match.contains_weak(etag):
+        resposta = app.response_class(status=304)
+    else:
+        codificacao = 'identity'
+        for candidata in ('br', 'gzip'):
+            if candidata in corpos and request.accept_encodings[candidata]:
+                codificacao = candidata
+                break
+        resposta = app.response_class(corpos[codificacao], mimetype='application/json')
+        if codificacao != 'identity':
+            resposta.headers['Content-Encoding'] = codificacao
+    resposta.set_etag(etag, weak=True)
+    resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.vary.add('Accept-Encoding')
+    return resposta
+
+def resposta_tabela(rota):
+    nome = TABELAS_REFERENCIA[rota]
+    dados = tabela(nome)
+    return resposta_json_versionada(rota, dados['versao'], lambda: dados['registros'])
+
+@app.before_request
+def iniciar_cronometro():
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def registrar_duracao(response):
+    # Rótulo pela regra da rota (/dados_nota/<filename>), não pela URL, para não criar uma série por arquivo
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+        metricas.observar('leitor_http_segundos', time.perf_counter() - inicio,
+                          rota=rota, metodo=request.method, status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return Response(metricas.exportar_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def enfileirar_upload(filename, path, digest):
+    # Processa já no upload: quando o operador abrir a nota ela estará pronta
+    fila_extracao.enfileirar(path, filename, digest, registrar_resultado_openai, repetir_falha=True)
+    # Conteúdo repetido não cria job: avisa /progresso do novo nome mesmo assim
+    fila_extracao.marcar_alteracao()
+
+def resposta_erro_upload(erro):
+    corpo = {'erro': str(erro)}
+    if isinstance(erro, recebimento.PosicaoIncorreta):
+        corpo['recebido'] = erro.recebido
+    return jsonify(corpo), erro.status
+
 @app.route('/notas', methods=['GET', 'POST'])
 def notas():
     if request.method == 'POST':
-        files = request.files.getlist('files')
-        saved_files = []
-        for file in files:
-            filename = file.filename
-            path = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(path)
-            saved_files.append(filename)
+        # Lido direto do corpo, sem request.files: cada arquivo é gravado (e o hash calculado)
+        # à medida que chega, e as notas de um .zip são enfileiradas conforme são extraídas
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return jsonify({'erro': 'Envie os arquivos como multipart/form-data no campo files'}), 400
+        try:
+            saved_files = recebimento.receber_formulario(request.stream, boundary.encode('latin-1'),
+                                                         UPLOAD_FOLDER, enfileirar_upload)
+        except recebimento.UploadInvalido as e:
+            return resposta_erro_upload(e)
         return jsonify({'files': saved_files})
     else:
         files = os.listdir(UPLOAD_FOLDER)
         return jsonify({'files': files})
 
+@app.route('/notas/parcial/<upload_id>', methods=['GET', 'PUT'])
+def nota_parcial(upload_id):
+    """
+    Upload em partes, retomável: GET informa quantos bytes o servidor já tem e cada PUT
+    envia a continuação com Content-Range: bytes inicio-fim/total (?nome= na primeira parte).
+    A última parte registra o arquivo como no POST /notas.
+    """
+    try:
+        if request.method == 'GET':
+            return jsonify({'recebido': recebimento.recebido(upload_id)})
+        return jsonify(recebimento.receber_parte(upload_id, request.args.get('nome'),
+                                                 request.headers.get('Content-Range'), request.stream,
+                                                 UPLOAD_FOLDER, enfileirar_upload))
+    except recebimento.UploadInvalido as e:
+        return resposta_erro_upload(e)
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     return send_from_directory(UPLOAD_FOLDER, filename)
 
 @app.route('/dados_nota/<filename>')
 def dados_nota(filename):
-    key = nome_base(filename)
-    historico = carregar_historico_openai()
-    if key in historico:
-        dado = historico[key]
-        # Preencher Grupo, Cod Filial e Filial se houver Cnpj_Cliente
-        cnpj_cliente = dado.get('Cnpj_Cliente', '')
-        if cnpj_cliente and (not dado.get('Grupo') or not dado.get('Cod Filial') or not dado.get('Filial')):
-            grupo, cod_filial, filial = buscar_filial_por_cnpj(cnpj_cliente)
-            dado['Grupo'] = grupo or ''
-            dado['Cod Filial'] = cod_filial or ''
-            dado['Filial'] = filial or ''
+    path = os.path.join(UPLOAD_FOLDER, filename)
+    # 1. Cache endereçado pelo conteúdo: o mesmo documento com outro nome não é reprocessado
+    digest = cache_extracao.hash_do_arquivo(path) if os.path.exists(path) else None
+    dado = cache_extracao.obter(digest, cache_extracao.TIPO_DADOS)
+    metricas.contar('leitor_cache_total', tipo=cache_extracao.TIPO_DADOS, resultado='hit' if dado else 'miss')
+    if dado:
+        dado['Arquivo'] = filename
+        preencher_filial(dado)
         return jsonify(dado)
-    # 2. Tenta buscar no JSON salvo
-    notas = carregar_notas()
-    if filename in notas:
-        dado = notas[filename]
-        # Preencher Grupo, Cod Filial e Filial se houver Cnpj_Cliente
-        cnpj_cliente = dado.get('Cnpj_Cliente', '')
-        if cnpj_cliente and (not dado.get('Grupo') or not dado.get('Cod Filial') or not dado.get('Filial')):
-            grupo, cod_filial, filial = buscar_filial_por_cnpj(cnpj_cliente)
-            dado['Grupo'] = grupo or ''
-            dado['Cod Filial'] = cod_filial or ''
-            dado['Filial'] = filial or ''
+    # 2. Tenta buscar nas notas salvas
+    dado = armazenamento.obter(armazenamento.COLECAO_SALVAS, filename)
+    if dado:
+        preencher_filial(dado)
         return jsonify(dado)
-    # 3. Se não achou, processa o arquivo original
-    path = os.path.join(UPLOAD_FOLDER, filename)
-    registro = Identificador.processar_arquivo_identificador(path)
-    texto = registro.get('texto_lido', '') or registro.get('Texto_Completo', '') or ''
-    # Gera JSON do regex e guarda em memória
-    json_regex = gerar_json_regex(texto, filename)
-    try:
-        # Determina o tipo da nota
-        tipo_nota = ''
-        if path.lower().endswith('.xml'):
-            tipo_nota = 'NFe/XML'
-        elif path.lower().endswith('.pdf'):
-            if 'serviço' in texto.lower() or 'nfs-e' in texto.lower() or 'nfs ' in texto.lower():
-                tipo_nota = 'NFS-e'
-            elif 'danfe' in texto.lower():
-                tipo_nota = 'DANFE'
-            else:
-                tipo_nota = 'PDF'
-        else:
-            tipo_nota = registro.get('Tipo', '') or 'Desconhecido'
-        resultado_bruto = tabular_notas_openai.tabular_nota(registro, filename)
-        resultado_limpo = tabular_notas_openai.limpar_json_bruto(resultado_bruto)
-        dado = json.loads(resultado_limpo)[0]
-        # Ajusta Contrato_de_Parceria e produtos
-        dado['Contrato_de_Parceria?'] = dado.get('Contrato_de_Parceria', dado.get('Contrato_de_Parceria?', 'NÃO'))
-        produtos = dado.get('Produtos', [])
-        if not isinstance(produtos, list):
-            produtos = [produtos] if produtos else []
-        dado['Produtos'] = produtos
-        dado['Contrato_de_Parceria?'] = 'SIM' if len(produtos) > 1 else 'NÃO'
-        # Preencher automaticamente Grupo, Cod Filial e Filial pelo Cnpj_Cliente
-        grupo, cod_filial, filial = buscar_filial_por_cnpj(dado.get('Cnpj_Cliente', ''))
-        dado['Grupo'] = grupo or ''
-        dado['Cod Filial'] = cod_filial or ''
-        dado['Filial'] = filial or ''
-        # Remove a inserção do campo 'Tipo' no dado
-        # dado['Tipo'] = tipo_nota
-        # Formata CNPJ
-        for campo in ['Cnpj_Fornecedor', 'Cnpj_Cliente']:
-            cnpj = dado.get(campo, '')
-            cnpj = re.sub(r'\D', '', cnpj)
-            if len(cnpj) == 14:
-                cnpj = f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
-            dado[campo] = cnpj
-        # Se a resposta da OpenAI for vazia ou não trouxer produtos, usa o fallback
-        if not dado or not isinstance(dado, dict) or not dado.get('Produtos'):
-            return jsonify(json_regex)
-        # Salva o JSON tabulado na pasta principal
-        json_path = os.path.join(os.path.dirname(__file__), f"{key}_openai.json")
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(dado, f, ensure_ascii=False, indent=2)
-        # Salva no histórico
-        historico[key] = dado
-        salvar_historico_openai(historico)
+    if not digest:
+        return jsonify({'erro': 'Arquivo não encontrado'}), 404
+    # 3. Consulta (ou cria) o job de extração em segundo plano
+    job = fila_extracao.enfileirar(path, filename, digest, registrar_resultado_openai)
+    if job['estado'] in fila_extracao.ESTADOS_FINAIS and job.get('resultado'):
+        dado = job['resultado']
+        dado['Arquivo'] = filename
         return jsonify(dado)
-    except Exception as e:
-        # Se erro, retorna o JSON do regex
-        return jsonify(json_regex)
+    return jsonify({'arquivo': filename, 'estado': job['estado'], 'progresso': job['progresso']}), 202
+
+# /progresso: intervalo entre as verificações da fila, comentário de keep-alive (proxies fecham
+# conexões ociosas; também força uma releitura completa) e duração máxima de cada conexão;
+# o EventSource reconecta sozinho, retomando pelo Last-Event-ID
+PROGRESSO_INTERVALO = float(os.environ.get('PROGRESSO_INTERVALO', 0.5))
+PROGRESSO_KEEPALIVE = 15
+PROGRESSO_DURACAO = int(os.environ.get('PROGRESSO_DURACAO', 2 * 60))
+PROGRESSO_RETRY_MS = 2000
+# Conexões de /progresso simultâneas por processo: cada uma ocupa uma thread do gunicorn
+# (GUNICORN_THREADS), e as demais precisam sobrar para as requisições normais
+PROGRESSO_MAX_CONEXOES = int(os.environ.get('PROGRESSO_MAX_CONEXOES', 4))
+_conexoes_progresso = threading.BoundedSemaphore(PROGRESSO_MAX_CONEXOES)
+
+def _evento_sse(dados, identificador=None, evento=None):
+    linhas = []
+    if identificador is not None:
+        linhas.append(f'id: {identificador}')
+    if evento:
+        linhas.append(f'event: {evento}')
+    linhas.append('data: ' + json.dumps(dados, ensure_ascii=False))
+    return '\n'.join(linhas) + '\n\n'
+
+def _eventos_do_job(job):
+    eventos = job.get('eventos')
+    if eventos is None:
+        # Job gravado antes do registro de eventos: só o estado atual
+        eventos = [{'evento': fila_extracao.EVENTOS_ESTADO[job['estado']], 'em': job.get('atualizado_em', 0)}]
+    return eventos
+
+def gerar_progresso(arquivos, desde):
+    """
+    Eventos de etapa dos arquivos (ou de todos em uploads/) com `em` > `desde`, em ordem de tempo.
+    Na primeira leitura de cada arquivo o último evento é sempre enviado, para que uma reconexão
+    conheça o estado atual. Os eventos finais levam os dados extraídos. Com a lista de arquivos
+    explícita, termina com o evento 'fim' quando todos chegam a um estado final.
+    """
+    yield f'retry: {PROGRESSO_RETRY_MS}\n\n'
+    versoes = {}
+    # arquivo -> instante do último evento enviado
+    enviados = {}
+    finais = set()
+    inicio = ultimo_envio = ultima_leitura = time.monotonic()
+    versao_fila = None
+    primeira = True
+    while time.monotonic() - inicio < PROGRESSO_DURACAO:
+        # Só relê os arquivos quando algum job mudou (ou a cada keep-alive, caso a marca de
+        # tempo da fila não tenha avançado entre duas gravações muito próximas)
+        atual = fila_extracao.versao_fila()
+        if not primeira and atual == versao_fila and time.monotonic() - ultima_leitura < PROGRESSO_KEEPALIVE:
+            time.sleep(PROGRESSO_INTERVALO)
+            continue
+        primeira = False
+        versao_fila = atual
+        ultima_leitura = time.monotonic()
+        novos = []
+        for filename in (arquivos or sorted(os.listdir(UPLOAD_FOLDER))):
+            digest = hash_upload(filename)
+            if not digest:
+                continue
+            versao = fila_extracao.versao(digest)
+            if filename in versoes and versoes[filename] == versao:
+                continue
+            primeira_leitura = filename not in versoes
+            versoes[filename] = versao
+            job = fila_extracao.estado(digest) if versao else None
+            if job is None:
+                # Sem job: resultado já em cache de um envio anterior (mesmo conteúdo)
+                dado = cache_extracao.obter(digest, cache_extracao.TIPO_DADOS)
+                eventos = [{'evento': 'pronto', 'em': os.path.getmtime(os.path.join(UPLOAD_FOLDER, filename))}] if dado else []
+            else:
+                dado = job.get('resultado')
+                eventos = _eventos_do_job(job)
+            enviar = [e for e in eventos if e['em'] > enviados.get(filename, desde)]
+            if primeira_leitura and eventos and not enviar:
+                enviar = eventos[-1:]
+            if enviar:
+                enviados[filename] = enviar[-1]['em']
+            for evento in enviar:
+                evento = dict(evento, arquivo=filename)
+                if evento['evento'] in fila_extracao.EVENTOS_FINAIS:
+                    finais.add(filename)
+                    if dado:
+                        evento['dados'] = dict(dado, Arquivo=filename)
+                    if job and job.get('erro'):
+                        evento['erro'] = job['erro']
+                novos.append(evento)
+        novos.sort(key=lambda e: e['em'])
+        for evento in novos:
+            yield _evento_sse(evento, f"{evento['em']:.6f}")
+        agora = time.monotonic()
+        if novos:
+            ultimo_envio = agora
+        elif agora - ultimo_envio >= PROGRESSO_KEEPALIVE - PROGRESSO_INTERVALO:
+            ultimo_envio = agora
+            yield ': keep-alive\n\n'
+        if arquivos and finais.issuperset(arquivos):
+            yield _evento_sse({'arquivos': len(arquivos)}, evento='fim')
+            return
+        time.sleep(PROGRESSO_INTERVALO)
+
+@app.route('/progresso')
+def progresso():
+    """
+    Server-Sent Events com o andamento da extração por arquivo: recebido, texto_extraido,
+    ocr_pagina (pagina/paginas), llm_solicitado, llm_concluido e pronto | fallback | falha.
+    ?arquivo= (repetível) limita aos arquivos informados; sem ele, todos os de uploads/.
+    O id de cada evento é o instante em que ocorreu: o Last-Event-ID da reconexão retoma dali.
+    Acima de PROGRESSO_MAX_CONEXOES abertas no processo responde 503 (a página segue
+    consultando /dados_nota).
+    """
+    try:
+        arquivos = [recebimento.nome_seguro(a) for a in request.args.getlist('arquivo') if a]
+    except recebimento.UploadInvalido as e:
+        return resposta_erro_upload(e)
+    try:
+        desde = float(request.headers.get('Last-Event-ID') or 0)
+    except ValueError:
+        desde = 0.0
+    if not _conexoes_progresso.acquire(blocking=False):
+        resposta = jsonify({'erro': 'Muitas conexões de progresso abertas; tente mais tarde'})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = '30'
+        return resposta
+    resposta = Response(gerar_progresso(arquivos, desde), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Liberada quando o servidor fecha a resposta: fim do stream ou cliente desconectado
+    resposta.call_on_close(_conexoes_progresso.release)
+    return resposta
 
 @app.route('/exportar_excel', methods=['POST'])
 def exportar_excel():
     dados = request.get_json()
-    linhas = []
-    for nota in dados:
-        # Lógica para rateio otimizada
-        if nota.get('Rateio?') == 'SIM' and any(k.startswith('Rateio_Produto_') for k in nota.keys()):
-            idx = 1
-            while True:
-                prod_rateio = nota.get(f'Rateio_Produto_{idx}')
-                if not prod_rateio:
-                    break
-                linha = nota.copy()
-                for k in list(linha.keys()):
-                    if k.startswith('Rateio_') or k.startswith('Produto_') or k.startswith('Qtde_') or k.startswith('Valor_Unitario_') or k.startswith('Valor_Total_Produto_') or k.startswith('Descricao_Produto_') or k == 'Produtos':
-                        linha.pop(k)
-                linha['Produto'] = prod_rateio
-                linha['Descricao_Produto'] = nota.get(f'Descricao_Produto_{idx}', prod_rateio)
-                linha['Qtde'] = ''
-                linha['Valor_Unitario'] = ''
-                linha['Valor_Total_Produto'] = ''
-                linha['Valor ou %'] = nota.get(f'Rateio_Valor_{idx}', '')
-                linha['ContaContabil'] = nota.get(f'Rateio_ContaContabil_{idx}', '')
-                linha['CC'] = nota.get(f'Rateio_CC_{idx}', '')
-                linha['ItemConta'] = nota.get(f'Rateio_ItemConta_{idx}', '')
-                linhas.append(linha)
-                idx += 1
-        elif nota.get('Produtos'):
-            produtos = nota.get('Produtos', [])
-            if not isinstance(produtos, list):
-                produtos = [produtos] if produtos else []
-            for prod in produtos:
-                linha = nota.copy()
-                for k in list(linha.keys()):
-                    if k.startswith('Produto_') or k.startswith('Qtde_') or k.startswith('Valor_Unitario_') or k.startswith('Valor_Total_Produto_') or k.startswith('Descricao_Produto_') or k == 'Produtos':
-                        linha.pop(k)
-                linha['Produto'] = prod.get('Produto', '')
-                linha['Descricao_Produto'] = prod.get('Descricao', '') or prod.get('Produto', '')
-                qtde = prod.get('Qtde', '')
-                if not qtde or str(qtde).strip() == '':
-                    qtde = 1
-                linha['Qtde'] = qtde
-                linha['Valor_Unitario'] = prod.get('Valor_Unitario', '')
-                linha['Valor_Total_Produto'] = prod.get('Valor_Total_Produto', '')
-                linhas.append(linha)
-        else:
-            linha = nota.copy()
-            for k in list(linha.keys()):
-                if k.startswith('Produto_') or k.startswith('Qtde_') or k.startswith('Valor_Unitario_') or k.startswith('Valor_Total_Produto_') or k.startswith('Descricao_Produto_') or k == 'Produtos':
-                    linha.pop(k)
-            linha['Produto'] = ''
-            linha['Descricao_Produto'] = ''
-            linha['Qtde'] = ''
-            linha['Valor_Unitario'] = ''
-            linha['Valor_Total_Produto'] = ''
-            linhas.append(linha)
-    # Conversão de valores e números para exportação
-    for linha in linhas:
-        for campo in ['Valor_Total', 'Valor_Unitario', 'Valor_Total_Produto']:
-            if campo in linha:
-                valor = str(linha[campo]).replace('R$', '').replace(' ', '').replace('.', '').replace(',', '.')
-                try:
-                    linha[campo] = float(valor)
-                except:
-                    linha[campo] = ''
-        if 'Qtde' in linha:
-            qtde = str(linha['Qtde']).replace('.', '').replace(',', '.')
-            if not qtde or qtde.strip() == '':
-                qtde = '1'
-            try:
-                linha['Qtde'] = float(qtde)
-            except:
-                linha['Qtde'] = 1
-    # Garante que a coluna 'Tipo Rateio' exista em cada linha
-    for linha in linhas:
-        if linha.get('Rateio?') == 'SIM':
-            tipo_rateio = ''
-            if 'tipoValorOuPercentual' in linha:
-                tipo_rateio = linha['tipoValorOuPercentual']
-            elif 'Tipo Rateio' in linha:
-                tipo_rateio = linha['Tipo Rateio']
-            elif 'tipo_rateio' in linha:
-                tipo_rateio = linha['tipo_rateio']
-            else:
-                tipo_rateio = '%'  # ou 'R$', se preferir um padrão
-            linha['Tipo Rateio'] = tipo_rateio
-        else:
-            linha['Tipo Rateio'] = ''
-
-    # Cria o DataFrame
-    df = pd.DataFrame(linhas)
-
-    # Remover colunas sem cabeçalho
-    if hasattr(df.columns, 'notnull'):
-        df = df.loc[:, df.columns.notnull() & (df.columns != '')]
-
-    # Corrigir 'Descricao_Produto' para não ser igual ao código do produto
-    for idx, row in df.iterrows():
-        if 'Produto' in df.columns and 'Descricao_Produto' in df.columns:
-            if row['Produto'] == row['Descricao_Produto']:
-                # Se houver um dicionário de produtos, use-o aqui. Caso contrário, deixe vazio.
-                df.at[idx, 'Descricao_Produto'] = ''
-
-    # Remove colunas duplicadas
-    if hasattr(df.columns, 'duplicated'):
-        df = df.loc[:, ~df.columns.duplicated()]
-
-    # Insere a coluna 'Tipo Rateio' após 'Rateio?'
-    if 'Rateio?' in df.columns and 'Tipo Rateio' in df.columns:
-        idx = df.columns.get_loc('Rateio?') + 1
-        cols = list(df.columns)
-        if cols.index('Tipo Rateio') != idx:
-            cols.insert(idx, cols.pop(cols.index('Tipo Rateio')))
-        df = df[cols]
-    
-    # Remover apenas a coluna 'tipoValorOuPercentual' se existir
-    if 'tipoValorOuPercentual' in df.columns:
-        df = df.drop(columns=['tipoValorOuPercentual'])
-    
-    # Remover a coluna 'Descricao_Produto' se existir
-    if 'Descricao_Produto' in df.columns:
-        df = df.drop(columns=['Descricao_Produto'])
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-    df.to_excel(tmp.name, index=False, engine='openpyxl')
-    tmp.close()
+    # ?formato=csv|parquet; sem o parâmetro, Excel
+    formato = request.args.get('formato', 'xlsx').lower()
+    if formato not in exportacao.FORMATOS:
+        return jsonify({'erro': f'Formato de exportação inválido: {formato}'}), 400
+    extensao, mimetype = exportacao.FORMATOS[formato]
+    download_name = f'notas_validadas.{extensao}'
+    if formato == 'parquet':
+        try:
+            arquivo = exportacao.exportar_parquet(dados)
+        except ImportError:
+            return jsonify({'erro': 'Exportação em Parquet requer o pacote pyarrow'}), 501
+    elif formato == 'xlsx':
+        # Escrita em streaming (xlsxwriter constant_memory) para um temporário apagado ao fim do envio
+        arquivo = exportacao.exportar_xlsx(dados)
     pasta_principal = os.path.dirname(__file__)
     for f in os.listdir(pasta_principal):
         if f.endswith('_openai.json'):
@@ -355,7 +348,11 @@ def exportar_excel():
             except Exception:
                 pass
         return response
-    return send_file(tmp.name, as_attachment=True, download_name='notas_validadas.xlsx')
+    if formato == 'csv':
+        # Enviado bloco a bloco (chunked), à medida que as linhas são montadas
+        return Response(exportacao.gerar_csv(dados), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={download_name}'})
+    return send_file(arquivo, as_attachment=True, download_name=download_name, mimetype=mimetype)
 
 @app.route('/delete_notas', methods=['POST'])
 def delete_notas():
@@ -372,26 +369,34 @@ def delete_notas():
 @app.route('/api/salvar_nota', methods=['POST'])
 def salvar_nota():
     nota = request.json  # dicionário completo enviado pelo frontend
-    notas = carregar_notas()
     chave = nota.get("Arquivo") or nota.get("id")  # use um campo único
     if not chave:
         return jsonify({"erro": "Chave única (Arquivo ou id) não fornecida"}), 400
-    notas[chave] = nota
-    salvar_notas(notas)
+    armazenamento.salvar(armazenamento.COLECAO_SALVAS, chave, nota, hash_upload(chave))
     return jsonify({"status": "ok"})
 
 @app.route('/api/obter_nota/<chave>', methods=['GET'])
 def obter_nota(chave):
-    notas = carregar_notas()
-    nota = notas.get(chave)
+    nota = armazenamento.obter(armazenamento.COLECAO_SALVAS, chave)
     if nota:
         return jsonify(nota)
     return jsonify({"erro": "Nota não encontrada"}), 404
 
 @app.route('/api/listar_notas', methods=['GET'])
 def listar_notas():
-    notas = carregar_notas()
-    return jsonify(list(notas.values()))
+    return jsonify(armazenamento.listar(armazenamento.COLECAO_SALVAS))
+
+@app.route('/api/buscar_notas', methods=['GET'])
+def buscar_notas():
+    # Busca nas notas salvas por hash, Arquivo, Cnpj_Fornecedor e/ou Numero_Nota
+    return jsonify(armazenamento.buscar(
+        colecao=request.args.get('colecao', armazenamento.COLECAO_SALVAS),
+        hash=request.args.get('hash'),
+        arquivo=request.args.get('arquivo'),
+        cnpj_fornecedor=request.args.get('cnpj_fornecedor'),
+        numero_nota=request.args.get('numero_nota'),
+        limite=request.args.get('limite', 100, type=int),
+    ))
 
 @app.route('/buscar_filial/<cnpj>')
 def buscar_filial(cnpj):
@@ -402,81 +407,71 @@ def buscar_filial(cnpj):
         'Filial': filial or ''
     })
 
+@app.route('/buscar_filiais', methods=['POST'])
+def buscar_filiais():
+    # Resolve vários CNPJs em uma única requisição: {"cnpjs": [...]}
+    corpo = request.get_json(silent=True)
+    if corpo is None:
+        corpo = {}
+    cnpjs = corpo.get('cnpjs', []) if isinstance(corpo, dict) else None
+    if not isinstance(cnpjs, list) or not all(isinstance(cnpj, str) for cnpj in cnpjs):
+        return jsonify({'erro': 'Envie {"cnpjs": [...]} com os CNPJs como texto'}), 400
+    resultado = {}
+    for cnpj, (grupo, cod_filial, filial) in buscar_filiais_por_cnpjs(cnpjs).items():
+        resultado[cnpj] = {
+            'Grupo': grupo or '',
+            'Cod Filial': cod_filial or '',
+            'Filial': filial or ''
+        }
+    return jsonify(resultado)
+
 @app.route('/filiais_por_grupo/<grupo>')
 def filiais_por_grupo(grupo):
-    from utils import FILIAIS_DF
-    if FILIAIS_DF is not None and not FILIAIS_DF.empty:
-        filiais = FILIAIS_DF[FILIAIS_DF['GRUPO'] == str(grupo)]
-        result = filiais[['Cod. Filial', 'Filial']].drop_duplicates().to_dict(orient='records')
-        return jsonify(result)
-    return jsonify([])
+    return jsonify(tabela('FILIAIS')['por_grupo'].get(str(grupo), []))
 
 @app.route('/cond_pagamentos')
 def cond_pagamentos():
-    if COND_PAGAMENTOS_DF is not None and not COND_PAGAMENTOS_DF.empty:
-        return jsonify(COND_PAGAMENTOS_DF[['CODIGO', 'DESCRICAO']].drop_duplicates().to_dict(orient='records'))
-    return jsonify([])
+    return resposta_tabela('cond_pagamentos')
 
 @app.route('/descricao_cond_pagamento/<codigo>')
 def descricao_cond_pagamento(codigo):
-    if COND_PAGAMENTOS_DF is not None and not COND_PAGAMENTOS_DF.empty:
-        linha = COND_PAGAMENTOS_DF[COND_PAGAMENTOS_DF['CODIGO'] == str(codigo)]
-        if not linha.empty:
-            return jsonify({'DESCRICAO': linha.iloc[0]['DESCRICAO']})
-    return jsonify({'DESCRICAO': ''})
+    return jsonify({'DESCRICAO': tabela('COND_PAGAMENTOS')['por_codigo'].get(str(codigo), '')})
 
 @app.route('/produtos')
 def produtos():
-    if PRODUTOS_DF is not None and not PRODUTOS_DF.empty:
-        return jsonify(PRODUTOS_DF[['COD_PRODUTO', 'DESCRICAO']].drop_duplicates().to_dict(orient='records'))
-    return jsonify([])
+    dados = tabela('PRODUTOS')
+    return resposta_json_versionada('produtos', dados['versao'], lambda: dados['registros'])
+
+@app.route('/produtos/search')
+def produtos_search():
+    # Typeahead: devolve só os melhores resultados em vez do catálogo inteiro
+    consulta = request.args.get('q', '')
+    limite = min(request.args.get('limite', 10, type=int), 50)
+    return jsonify(buscar_produtos(consulta, limite))
 
 @app.route('/descricao_produto/<codigo>')
 def descricao_produto(codigo):
-    if PRODUTOS_DF is not None and not PRODUTOS_DF.empty:
-        linha = PRODUTOS_DF[PRODUTOS_DF['COD_PRODUTO'] == str(codigo)]
-        if not linha.empty:
-            return jsonify({'DESCRICAO': linha.iloc[0]['DESCRICAO']})
-    return jsonify({'DESCRICAO': ''})
+    return jsonify({'DESCRICAO': tabela('PRODUTOS')['por_codigo'].get(str(codigo), '')})
 
 @app.route('/contas_contabeis')
 def contas_contabeis():
-    with open('TABELAS_PROTHEUS/CONTA CONTABIL.csv', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f, delimiter=';')
-        # Normaliza os nomes das colunas para remover espaços extras e BOM
-        if reader.fieldnames:
-            reader.fieldnames = [fn.strip().replace('\ufeff', '') for fn in reader.fieldnames]
-        result = []
-        for row in reader:
-            codigo = row.get('CÓDIGO') or row.get('CODIGO') or row.get('Codigo')
-            descricao = row.get('Descricao Conta Contábil') or row.get('DescricaoContaContábil') or row.get('DESCRICAO') or row.get('Descricao') or row.get('DESCRIÇÃO')
-            if codigo:
-                result.append({'CODIGO': codigo, 'DESCRICAO': descricao or ''})
-        return jsonify(result)
+    return resposta_tabela('contas_contabeis')
 
 @app.route('/cc_reduzido')
 def cc_reduzido():
-    with open('TABELAS_PROTHEUS/CC REDUZIDO.csv', encoding='utf-8') as f:
-        reader = csv.DictReader(f, delimiter=';')
-        return jsonify([
-            {'CCUSTO': row['C. CUSTO'], 'DESCRICAO': row['DESCRIÇÃO']}
-            for row in reader if row.get('C. CUSTO')
-        ])
+    return resposta_tabela('cc_reduzido')
 
 @app.route('/itens_conta')
 def itens_conta():
-    with open('TABELAS_PROTHEUS/ITEM CONTA.csv', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f, delimiter=';')
-        # Normaliza os nomes das colunas para remover espaços extras e BOM
-        if reader.fieldnames:
-            reader.fieldnames = [fn.strip().replace('\ufeff', '') for fn in reader.fieldnames]
-        result = []
-        for row in reader:
-            item = row.get('Item Conta')
-            operacao = row.get('Operação')
-            if item:
-                result.append({'ITEM': item, 'OPERACAO': operacao or ''})
-        return jsonify(result)
+    return resposta_tabela('itens_conta')
+
+@app.route('/referencias')
+def referencias():
+    # Todas as tabelas de consulta da tela em um único payload; 304 enquanto nenhuma mudar
+    snapshots = {rota: tabela(nome) for rota, nome in TABELAS_REFERENCIA.items()}
+    versao = tuple(dados['versao'] for dados in snapshots.values())
+    return resposta_json_versionada('referencias', versao,
+                                    lambda: {rota: dados['registros'] for rota, dados in snapshots.items()})
 
 @app.route('/sair', methods=['POST'])
 def sair():
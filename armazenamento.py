@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Armazenamento das notas em SQLite (modo WAL), substituindo os JSONs reescritos a cada gravação.
+# Cada registro pertence a uma coleção:
+#   salvas -> notas validadas pelo usuário (antigo notas_salvas.json, chave = Arquivo)
+#   openai -> respostas tabuladas pela OpenAI (antigo openai_historico.json, chave = nome base do arquivo)
+#   lidas  -> histórico de notas lidas (antigo historico_notas_lidas.json, chave = nome do arquivo)
+PASTA_PRINCIPAL = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get('NOTAS_DB_PATH', os.path.join(PASTA_PRINCIPAL, 'notas.db'))
+
+COLECAO_SALVAS = 'salvas'
+COLECAO_OPENAI = 'openai'
+COLECAO_LIDAS = 'lidas'
+
+# Arquivos JSON importados uma única vez na primeira abertura do banco
+JSONS_LEGADOS = {
+    COLECAO_SALVAS: 'notas_salvas.json',
+    COLECAO_OPENAI: 'openai_historico.json',
+    COLECAO_LIDAS: 'historico_notas_lidas.json',
+}
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS notas (
+    colecao TEXT NOT NULL,
+    chave TEXT NOT NULL,
+    hash TEXT,
+    arquivo TEXT,
+    cnpj_fornecedor TEXT,
+    numero_nota TEXT,
+    dados TEXT NOT NULL,
+    atualizado_em REAL NOT NULL,
+    PRIMARY KEY (colecao, chave)
+);
+CREATE INDEX IF NOT EXISTS idx_notas_hash ON notas (hash);
+CREATE INDEX IF NOT EXISTS idx_notas_arquivo ON notas (arquivo);
+CREATE INDEX IF NOT EXISTS idx_notas_cnpj_fornecedor ON notas (cnpj_fornecedor);
+CREATE INDEX IF NOT EXISTS idx_notas_numero_nota ON notas (numero_nota);
+CREATE TABLE IF NOT EXISTS migracoes (
+    arquivo TEXT PRIMARY KEY,
+    registros INTEGER NOT NULL,
+    migrado_em REAL NOT NULL
+);
+"""
+
+_local = threading.local()
+_lock_inicio = threading.Lock()
+_iniciado = False
+
+
+def _conexao():
+    # Uma conexão por thread (e por processo, já que os workers do gunicorn são forks)
+    con = getattr(_local, 'con', None)
+    if con is None or getattr(_local, 'pid', None) != os.getpid():
+        con = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA synchronous=NORMAL')
+        _local.con = con
+        _local.pid = os.getpid()
+    _iniciar(con)
+    return con
+
+
+def _iniciar(con):
+    global _iniciado
+    if _iniciado:
+        return
+    with _lock_inicio:
+        if _iniciado:
+            return
+        con.executescript(ESQUEMA)
+        migrar_json(con)
+        _iniciado = True
+
+
+def _somente_digitos(valor):
+    return ''.join(filter(str.isdigit, str(valor or '')))
+
+
+def _linha(colecao, chave, dado, digest):
+    return (
+        colecao,
+        chave,
+        digest,
+        dado.get('Arquivo') or chave,
+        _somente_digitos(dado.get('Cnpj_Fornecedor')),
+        str(dado.get('Numero_Nota') or ''),
+        json.dumps(dado, ensure_ascii=False),
+        time.time(),
+    )
+
+
+UPSERT = """
+INSERT INTO notas (colecao, chave, hash, arquivo, cnpj_fornecedor, numero_nota, dados, atualizado_em)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (colecao, chave) DO UPDATE SET
+    hash = COALESCE(excluded.hash, notas.hash),
+    arquivo = excluded.arquivo,
+    cnpj_fornecedor = excluded.cnpj_fornecedor,
+    numero_nota = excluded.numero_nota,
+    dados = excluded.dados,
+    atualizado_em = excluded.atualizado_em
+"""
+
+
+def migrar_json(con=None):
+    """
+    Importa os JSONs antigos (notas_salvas, openai_historico, historico_notas_lidas) para o banco.
+    Cada arquivo é migrado uma única vez; os JSONs originais ficam intactos como backup.
+    """
+    con = con or _conexao()
+    for colecao, nome in JSONS_LEGADOS.items():
+        caminho = os.path.join(PASTA_PRINCIPAL, nome)
+        if not os.path.exists(caminho):
+            continue
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            if con.execute('SELECT 1 FROM migracoes WHERE arquivo = ?', (nome,)).fetchone():
+                con.execute('COMMIT')
+                continue
+            try:
+                with open(caminho, 'r', encoding='utf-8') as f:
+                    conteudo = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f'Erro ao migrar {nome}: {e}')
+                conteudo = {}
+            if not isinstance(conteudo, dict):
+                # Formato inesperado (ex.: lista): ignora o arquivo em vez de impedir o uso do banco
+                print(f'Aviso: {nome} não contém um objeto JSON ({type(conteudo).__name__}); arquivo ignorado na migração')
+                conteudo = {}
+            linhas = [_linha(colecao, chave, dado, None) for chave, dado in conteudo.items() if isinstance(dado, dict)]
+            con.executemany(UPSERT, linhas)
+            con.execute('INSERT INTO migracoes (arquivo, registros, migrado_em) VALUES (?, ?, ?)',
+                        (nome, len(linhas), time.time()))
+            con.execute('COMMIT')
+            print(f'{nome}: {len(linhas)} registros migrados para {os.path.basename(DB_PATH)}')
+        except Exception:
+            con.execute('ROLLBACK')
+            raise
+
+
+def salvar(colecao, chave, dado, digest=None):
+    """
+    Grava (ou substitui) um único registro. Não reescreve os demais.
+    """
+    _conexao().execute(UPSERT, _linha(colecao, chave, dado, digest))
+
+
+def obter(colecao, chave):
+    linha = _conexao().execute('SELECT dados FROM notas WHERE colecao = ? AND chave = ?', (colecao, chave)).fetchone()
+    return json.loads(linha[0]) if linha else None
+
+
+def listar(colecao):
+    linhas = _conexao().execute('SELECT dados FROM notas WHERE colecao = ? ORDER BY atualizado_em', (colecao,))
+    return [json.loads(dados) for (dados,) in linhas]
+
+
+def remover(colecao, chave):
+    _conexao().execute('DELETE FROM notas WHERE colecao = ? AND chave = ?', (colecao, chave))
+
+
+def buscar(colecao=None, hash=None, arquivo=None, cnpj_fornecedor=None, numero_nota=None, limite=100):
+    """
+    Busca registros pelos campos indexados. O CNPJ pode vir com ou sem máscara.
+    Retorna os dicts mais recentes primeiro.
+    """
+    filtros = []
+    valores = []
+    for coluna, valor in (('colecao', colecao), ('hash', hash), ('arquivo', arquivo),
+                          ('cnpj_fornecedor', _somente_digitos(cnpj_fornecedor) if cnpj_fornecedor else None),
+                          ('numero_nota', numero_nota)):
+        if valor:
+            filtros.append(f'{coluna} = ?')
+            valores.append(valor)
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ''
+    valores.append(int(limite))
+    linhas = _conexao().execute(f'SELECT dados FROM notas {where} ORDER BY atualizado_em DESC LIMIT ?', valores)
+    return [json.loads(dados) for (dados,) in linhas]
@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from functools import lru_cache
+import limitador_openai
+
+# Backend das chamadas de chat completions, escolhido por LLM_MODO:
+#   live   - API da OpenAI (ou compatível, via OPENAI_BASE_URL)
+#   record - como live, e grava cada resposta em LLM_GRAVACOES_DIR pelo hash do pedido
+#   replay - devolve as respostas gravadas, sem rede; pedidos não gravados seguem LLM_REPLAY_FALTANTE
+#   stub   - resposta sintética determinística (um objeto por "Arquivo:" do prompt)
+# Em replay e stub, LLM_LATENCIA simula o tempo de resposta e LLM_TAXA_ERRO injeta timeouts,
+# que passam pelas mesmas repetições do limitador_openai que os erros reais.
+LLM_MODO = os.environ.get('LLM_MODO', 'live').lower()
+LLM_GRAVACOES_DIR = os.environ.get('LLM_GRAVACOES_DIR', os.path.join(os.path.dirname(__file__), 'gravacoes_llm'))
+LLM_LATENCIA = float(os.environ.get('LLM_LATENCIA', 0))
+# Variação relativa da latência simulada (0.2 = ±20%)
+LLM_LATENCIA_VARIACAO = float(os.environ.get('LLM_LATENCIA_VARIACAO', 0))
+LLM_TAXA_ERRO = float(os.environ.get('LLM_TAXA_ERRO', 0))
+# Em replay, o que fazer com um pedido que não foi gravado: 'erro' ou 'stub'
+LLM_REPLAY_FALTANTE = os.environ.get('LLM_REPLAY_FALTANTE', 'erro').lower()
+
+LIVE = 'live'
+RECORD = 'record'
+REPLAY = 'replay'
+STUB = 'stub'
+MODOS = (LIVE, RECORD, REPLAY, STUB)
+
+if LLM_MODO not in MODOS:
+    raise ValueError(f"LLM_MODO inválido: {LLM_MODO} (use {', '.join(MODOS)})")
+
+_aleatorio = random.Random()
+_lock_aleatorio = threading.Lock()
+
+
+class GravacaoNaoEncontrada(Exception):
+    pass
+
+
+def chave_pedido(modelo, mensagens, max_tokens, temperatura):
+    """
+    Hash do pedido (modelo, mensagens, max_tokens, temperatura): identifica a resposta gravada.
+    """
+    pedido = json.dumps({'model': modelo, 'messages': mensagens, 'max_tokens': max_tokens,
+                         'temperature': temperatura}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(pedido.encode('utf-8')).hexdigest()
+
+
+def _caminho_gravacao(chave, pasta=None):
+    return os.path.join(pasta or LLM_GRAVACOES_DIR, f'{chave}.json')
+
+
+def obter_gravacao(chave, pasta=None):
+    try:
+        with open(_caminho_gravacao(chave, pasta), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def gravar(chave, conteudo, uso, modelo, pasta=None):
+    # Só a resposta e metadados: o texto das notas (prompt) não é gravado
+    pasta = pasta or LLM_GRAVACOES_DIR
+    os.makedirs(pasta, exist_ok=True)
+    caminho = _caminho_gravacao(chave, pasta)
+    tmp = f'{caminho}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'modelo': modelo, 'conteudo': conteudo, 'uso': uso, 'gravado_em': time.time()},
+                  f, ensure_ascii=False)
+    os.replace(tmp, caminho)
+
+
+def resposta_stub(prompt):
+    # Um objeto por arquivo do prompt, com valores determinísticos derivados do nome
+    notas = []
+    for arquivo in re.findall(r'^Arquivo: (.+)$', prompt, flags=re.MULTILINE):
+        semente = int(hashlib.sha256(arquivo.encode('utf-8')).hexdigest()[:8], 16)
+        valor = f'{semente % 100000 / 100:.2f}'.replace('.', ',')
+        notas.append({
+            'Arquivo': arquivo,
+            'Numero_Nota': str(semente % 1000000),
+            'Cnpj_Fornecedor': f'{semente % 10 ** 14:014d}',
+            'Cnpj_Cliente': '',
+            'Data_Emissao': '01/01/2025',
+            'Data_Vencimento': '31/01/2025',
+            'Condição_de_Pagamento': '',
+            'Prazo': '30',
+            'Valor_Total': valor,
+            'Contrato_de_Parceria': 'NÃO',
+            'Produtos': [{'Produto': 'SERVICO', 'Qtde': '1', 'Valor_Unitario': valor, 'Valor_Total_Produto': valor}],
+        })
+    return json.dumps(notas, ensure_ascii=False, indent=2)
+
+
+def sortear_erro(taxa=None):
+    with _lock_aleatorio:
+        return _aleatorio.random() < (LLM_TAXA_ERRO if taxa is None else taxa)
+
+
+def latencia_simulada(latencia=None, variacao=None):
+    latencia = LLM_LATENCIA if latencia is None else latencia
+    variacao = LLM_LATENCIA_VARIACAO if variacao is None else variacao
+    if variacao:
+        with _lock_aleatorio:
+            latencia *= _aleatorio.uniform(1 - variacao, 1 + variacao)
+    return max(latencia, 0.0)
+
+
+@lru_cache(maxsize=1)
+def _cliente():
+    import openai
+    chave = os.getenv('OPENAI_API_KEY')
+    if not chave:
+        raise ValueError("OPENAI_API_KEY não encontrada nas variáveis de ambiente!")
+    # As repetições (429, timeouts) ficam a cargo do limitador_openai, que conhece os limites da conta
+    return openai.OpenAI(api_key=chave, max_retries=0)
+
+
+def _completar_api(modelo, mensagens, max_tokens, temperatura):
+    bruta = _cliente().chat.completions.with_raw_response.create(
+        model=modelo,
+        messages=mensagens,
+        temperature=temperatura,
+        max_tokens=max_tokens
+    )
+    resposta = bruta.parse()
+    uso = None
+    if resposta.usage:
+        uso = {'prompt_tokens': resposta.usage.prompt_tokens, 'completion_tokens': resposta.usage.completion_tokens}
+    return resposta.choices[0].message.content, bruta.headers, uso
+
+
+def _simular(conteudo, prompt, modelo, uso=None):
+    time.sleep(latencia_simulada())
+    if sortear_erro():
+        import openai
+        import httpx
+        raise openai.APITimeoutError(request=httpx.Request('POST', 'http://llm-simulado/v1/chat/completions'))
+    if uso is None:
+        uso = {'prompt_tokens': limitador_openai.estimar_tokens(prompt, modelo),
+               'completion_tokens': limitador_openai.estimar_tokens(conteudo, modelo)}
+    return conteudo, {}, uso
+
+
+def completar(modelo, mensagens, max_tokens, temperatura=0.0):
+    """
+    Executa o pedido no backend de LLM_MODO. Retorna (conteúdo, cabeçalhos, uso), onde uso é
+    {'prompt_tokens', 'completion_tokens'} ou None. Os cabeçalhos (x-ratelimit-*) só vêm da API.
+    """
+    if LLM_MODO == LIVE:
+        return _completar_api(modelo, mensagens, max_tokens, temperatura)
+    chave = chave_pedido(modelo, mensagens, max_tokens, temperatura)
+    if LLM_MODO == RECORD:
+        conteudo, cabecalhos, uso = _completar_api(modelo, mensagens, max_tokens, temperatura)
+        gravar(chave, conteudo, uso, modelo)
+        return conteudo, cabecalhos, uso
+    prompt = '\n'.join(str(m.get('content', '')) for m in mensagens)
+    if LLM_MODO == REPLAY:
+        gravacao = obter_gravacao(chave)
+        if gravacao is not None:
+            return _simular(gravacao['conteudo'], prompt, modelo, gravacao.get('uso'))
+        if LLM_REPLAY_FALTANTE != STUB:
+            raise GravacaoNaoEncontrada(f'Pedido {chave[:12]} não gravado em {LLM_GRAVACOES_DIR}')
+    return _simular(resposta_stub(prompt), prompt, modelo)
@@ -0,0 +1,312 @@
+"""
+Teste de carga da aplicação: N operadores em paralelo repetindo o fluxo real da tela de validação:
+upload em /notas, /dados_nota até a nota ficar pronta, /buscar_filial, /produtos (com ETag,
+como o navegador), /api/salvar_nota e, ao fim do ciclo, /exportar_excel.
+
+Reporta vazão, p50/p95/p99 e taxa de erro por endpoint, mais o tempo do upload até a nota
+ficar pronta ("nota_pronta"). Os documentos vêm do corpus sintético (benchmarks/corpus_sintetico.py),
+com conteúdo distinto por operador para não acertar o cache por hash.
+
+Com --iniciar-servidor o próprio teste sobe o app com o LLM simulado (LLM_MODO=stub, ver
+backend_llm) em uma pasta temporária, onde ficam uploads/, o banco, as métricas, o cache de
+extração e a fila de jobs (o cache e a fila reais não recebem os documentos sintéticos):
+gunicorn com --workers W e a configuração de gunicorn.conf.py (worker_class e threads, ver
+--threads), ou o servidor do Flask se o gunicorn não estiver instalado. Sem a opção, usa o
+servidor em --url. Os JSONs <nota>_openai.json continuam sendo gravados na pasta do app e são
+apagados pelo /exportar_excel.
+
+Atenção: /exportar_excel apaga todos os arquivos de uploads/, inclusive os de outros
+operadores; 404 em /dados_nota sob concorrência costuma vir daí.
+
+Uso:
+    python benchmarks/bench_carga.py --iniciar-servidor [--workers 2] [--threads 16] [--operadores 10] [--ciclos 3]
+                                     [--notas 3] [--latencia-llm 1.0] [--saida carga.json]
+    python benchmarks/bench_carga.py --url http://127.0.0.1:5000 --operadores 20
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import runpy
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import corpus_sintetico
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+TIMEOUT_REQUISICAO = 120
+# Intervalo entre as consultas a /dados_nota enquanto a nota está em processamento (202)
+INTERVALO_CONSULTA = 0.5
+
+
+class Registro:
+    """
+    Medições de todos os operadores: (endpoint, segundos, status, erro).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.medicoes = []
+
+    def adicionar(self, endpoint, segundos, status, erro=None):
+        with self._lock:
+            self.medicoes.append((endpoint, segundos, status, erro))
+
+
+def _percentil(valores, fracao):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(fracao * (len(ordenados) - 1))))]
+
+
+def _multipart(arquivos):
+    fronteira = uuid.uuid4().hex
+    partes = []
+    for nome, conteudo in arquivos:
+        partes.append(f'--{fronteira}\r\nContent-Disposition: form-data; name="files"; filename="{nome}"\r\n'
+                      f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + conteudo + b'\r\n')
+    partes.append(f'--{fronteira}--\r\n'.encode('utf-8'))
+    return b''.join(partes), f'multipart/form-data; boundary={fronteira}'
+
+
+class Operador:
+    def __init__(self, numero, url, registro, documentos):
+        self.numero = numero
+        self.url = url.rstrip('/')
+        self.registro = registro
+        self.documentos = documentos
+        self.etag_produtos = None
+
+    def requisitar(self, endpoint, metodo, caminho, corpo=None, tipo=None, cabecalhos=None):
+        """
+        Executa e registra a requisição. Retorna (status, corpo, cabeçalhos); status None em falha de rede.
+        """
+        cabecalhos = dict(cabecalhos or {})
+        if tipo:
+            cabecalhos['Content-Type'] = tipo
+        pedido = urllib.request.Request(self.url + caminho, data=corpo, headers=cabecalhos, method=metodo)
+        inicio = time.perf_counter()
+        try:
+            with urllib.request.urlopen(pedido, timeout=TIMEOUT_REQUISICAO) as resposta:
+                dados = resposta.read()
+                status, resposta_cabecalhos = resposta.status, resposta.headers
+        except urllib.error.HTTPError as e:
+            dados, status, resposta_cabecalhos = e.read(), e.code, e.headers
+        except (urllib.error.URLError, OSError) as e:
+            self.registro.adicionar(endpoint, time.perf_counter() - inicio, None, str(e))
+            return None, b'', {}
+        # 304 (ETag) não é erro
+        self.registro.adicionar(endpoint, time.perf_counter() - inicio, status,
+                                None if status < 400 else dados[:200].decode('utf-8', 'replace').strip())
+        return status, dados, resposta_cabecalhos
+
+    def _json(self, endpoint, metodo, caminho, valor):
+        return self.requisitar(endpoint, metodo, caminho, json.dumps(valor).encode('utf-8'), 'application/json')
+
+    def aguardar_nota(self, nome, prazo):
+        inicio = time.perf_counter()
+        caminho = '/dados_nota/' + urllib.parse.quote(nome)
+        while time.perf_counter() - inicio < prazo:
+            status, dados, _ = self.requisitar('GET /dados_nota', 'GET', caminho)
+            if status == 200:
+                self.registro.adicionar('nota_pronta', time.perf_counter() - inicio, 200)
+                return json.loads(dados)
+            if status != 202:
+                break
+            time.sleep(INTERVALO_CONSULTA)
+        self.registro.adicionar('nota_pronta', time.perf_counter() - inicio, status or 0, 'nota não ficou pronta')
+        return None
+
+    def ciclo(self, numero_ciclo, prazo_nota):
+        arquivos = []
+        for documento in self.documentos:
+            with open(documento['caminho'], 'rb') as f:
+                conteudo = f.read()
+            # Nome único por operador e ciclo (uploads/ é compartilhado); conteúdo distinto por
+            # ciclo para que a nota passe pelo pipeline em vez do cache por hash
+            nome = f'op{self.numero:03d}_c{numero_ciclo}_{os.path.basename(documento["caminho"])}'
+            if documento['caminho'].endswith('.xml'):
+                conteudo += f'<!-- {nome} -->'.encode('utf-8')
+            else:
+                conteudo += f'\n%{nome}\n'.encode('utf-8')
+            arquivos.append((nome, conteudo))
+        corpo, tipo = _multipart(arquivos)
+        status, _, _ = self.requisitar('POST /notas', 'POST', '/notas', corpo, tipo)
+        if status != 200:
+            return
+
+        # Catálogo de produtos: o navegador revalida com If-None-Match
+        cabecalhos = {'Accept-Encoding': 'gzip'}
+        if self.etag_produtos:
+            cabecalhos['If-None-Match'] = self.etag_produtos
+        status, _, resposta_cabecalhos = self.requisitar('GET /produtos', 'GET', '/produtos', cabecalhos=cabecalhos)
+        if status == 200:
+            self.etag_produtos = resposta_cabecalhos.get('ETag')
+
+        validadas = []
+        for nome, _ in arquivos:
+            dado = self.aguardar_nota(nome, prazo_nota)
+            if dado is None:
+                continue
+            cnpj = ''.join(filter(str.isdigit, dado.get('Cnpj_Cliente', ''))) or '0'
+            self.requisitar('GET /buscar_filial', 'GET', f'/buscar_filial/{cnpj}')
+            dado.update({'Arquivo': nome, 'Rateio?': 'NÃO', 'Nome_do_Lançador': f'operador {self.numero}'})
+            self._json('POST /api/salvar_nota', 'POST', '/api/salvar_nota', dado)
+            validadas.append(dado)
+        if validadas:
+            self._json('POST /exportar_excel', 'POST', '/exportar_excel', validadas)
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def iniciar_servidor(workers, latencia_llm, pasta, threads=None):
+    """
+    Sobe o app com o LLM simulado em `pasta` (uploads/, banco, métricas, cache e fila ficam lá).
+    `threads` sobrepõe GUNICORN_THREADS. Retorna (processo, url, descrição do servidor).
+    """
+    porta = _porta_livre()
+    ambiente = dict(os.environ, LLM_MODO='stub', LLM_LATENCIA=str(latencia_llm), LLM_LATENCIA_VARIACAO='0.3',
+                    PYTHONPATH=os.pathsep.join(filter(None, [RAIZ, os.environ.get('PYTHONPATH')])),
+                    NOTAS_DB_PATH=os.path.join(pasta, 'notas.db'), METRICAS_DIR=os.path.join(pasta, 'metricas'),
+                    CACHE_EXTRACAO_DIR=os.path.join(pasta, 'cache_extracao'),
+                    FILA_EXTRACAO_DIR=os.path.join(pasta, 'fila_extracao'),
+                    PORT=str(porta))
+    if threads:
+        ambiente['GUNICORN_THREADS'] = str(threads)
+    try:
+        import gunicorn  # noqa: F401
+        configuracao = os.path.join(RAIZ, 'gunicorn.conf.py')
+        comando = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{porta}', '--timeout', '120',
+                   '--workers', str(workers), '-c', configuracao]
+        # Lê worker_class/threads da configuração com o mesmo ambiente do servidor
+        ambiente_atual = dict(os.environ)
+        os.environ.update(ambiente)
+        try:
+            valores = runpy.run_path(configuracao)
+        finally:
+            os.environ.clear()
+            os.environ.update(ambiente_atual)
+        classe = valores.get('worker_class', 'sync')
+        descricao = f'gunicorn, {workers} worker(s) {classe}'
+        if classe == 'gthread':
+            descricao += f' x {valores.get("threads", 1)} threads'
+    except ImportError:
+        comando = [sys.executable, '-c', f'import app; app.app.run(host="127.0.0.1", port={porta}, threaded=True)']
+        descricao = 'servidor do Flask (gunicorn não instalado), threaded'
+    processo = subprocess.Popen(comando, cwd=pasta, env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{porta}'
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f'O servidor terminou ao iniciar (código {processo.returncode})')
+        try:
+            with urllib.request.urlopen(url + '/notas', timeout=2):
+                return processo, url, descricao
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.3)
+    processo.terminate()
+    raise RuntimeError('O servidor não respondeu em 60s')
+
+
+def resumir(registro, duracao):
+    por_endpoint = {}
+    for endpoint, segundos, status, erro in registro.medicoes:
+        por_endpoint.setdefault(endpoint, []).append((segundos, status, erro))
+    resumo = {}
+    for endpoint, medicoes in sorted(por_endpoint.items()):
+        tempos = [segundos * 1000 for segundos, _, _ in medicoes]
+        erros = [erro for _, _, erro in medicoes if erro]
+        status = {}
+        for _, codigo, _ in medicoes:
+            status[str(codigo)] = status.get(str(codigo), 0) + 1
+        resumo[endpoint] = {
+            'requisicoes': len(medicoes),
+            'por_segundo': round(len(medicoes) / duracao, 2) if duracao else 0.0,
+            'p50_ms': round(_percentil(tempos, 0.50), 1),
+            'p95_ms': round(_percentil(tempos, 0.95), 1),
+            'p99_ms': round(_percentil(tempos, 0.99), 1),
+            'max_ms': round(max(tempos), 1),
+            'taxa_erro': round(len(erros) / len(medicoes), 4),
+            'status': status,
+            'exemplo_erro': erros[0] if erros else None,
+        }
+    return resumo
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga com operadores simultâneos')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--iniciar-servidor', action='store_true', help='sobe o app com LLM simulado')
+    parser.add_argument('--workers', type=int, default=2, help='workers do gunicorn (com --iniciar-servidor)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='threads por worker do gunicorn (padrão: GUNICORN_THREADS de gunicorn.conf.py)')
+    parser.add_argument('--latencia-llm', type=float, default=1.0, help='segundos por chamada ao LLM simulado')
+    parser.add_argument('--operadores', type=int, default=10)
+    parser.add_argument('--ciclos', type=int, default=3, help='ciclos de upload/validação/exportação por operador')
+    parser.add_argument('--notas', type=int, default=3, help='documentos por upload')
+    parser.add_argument('--itens', type=int, default=5, help='itens por nota')
+    parser.add_argument('--prazo-nota', type=float, default=120, help='espera máxima (s) por uma nota pronta')
+    parser.add_argument('--saida', default=None, help='grava o resultado em JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='carga_') as pasta:
+        processo = None
+        url, servidor = args.url, args.url
+        if args.iniciar_servidor:
+            processo, url, servidor = iniciar_servidor(args.workers, args.latencia_llm, pasta, args.threads)
+        try:
+            # DANFE e NFS-e em texto e NF-e XML; o OCR de digitalizados tem benchmark próprio
+            tipos = [corpus_sintetico.DANFE_PDF, corpus_sintetico.NFSE_PDF, corpus_sintetico.NFE_XML]
+            registro = Registro()
+            operadores = []
+            for numero in range(args.operadores):
+                documentos = corpus_sintetico.gerar_corpus(os.path.join(pasta, f'corpus_{numero}'), 1, args.itens,
+                                                           semente=numero + 1, tipos=tipos)
+                operadores.append(Operador(numero, url, registro, (documentos * args.notas)[:args.notas]))
+
+            def executar(operador):
+                for numero_ciclo in range(args.ciclos):
+                    operador.ciclo(numero_ciclo, args.prazo_nota)
+
+            print(f'{args.operadores} operadores x {args.ciclos} ciclos x {args.notas} notas contra {servidor}')
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.operadores) as executor:
+                list(executor.map(executar, operadores))
+            duracao = time.perf_counter() - inicio
+        finally:
+            if processo:
+                processo.terminate()
+                processo.wait(timeout=30)
+
+    resumo = resumir(registro, duracao)
+    total = len(registro.medicoes)
+    print(f'Duração {duracao:.1f}s, {total} medições')
+    print(f"{'endpoint':<24} {'req':>6} {'req/s':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'erros':>7}")
+    for endpoint, dados in resumo.items():
+        print(f"{endpoint:<24} {dados['requisicoes']:>6} {dados['por_segundo']:>7.2f} {dados['p50_ms']:>9.1f} "
+              f"{dados['p95_ms']:>9.1f} {dados['p99_ms']:>9.1f} {dados['taxa_erro']:>7.1%}")
+    for endpoint, dados in resumo.items():
+        if dados['exemplo_erro']:
+            print(f"  {endpoint}: {dados['status']} ex.: {dados['exemplo_erro'][:120]}")
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump({'servidor': servidor, 'parametros': vars(args), 'duracao_s': round(duracao, 2),
+                       'endpoints': resumo}, f, ensure_ascii=False, indent=2)
+        print(f'Resultado gravado em {args.saida}')
+
+
+if __name__ == '__main__':
+    main()
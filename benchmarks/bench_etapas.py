@@ -0,0 +1,248 @@
+"""
+Benchmark por etapa do processamento sobre um corpus sintético (benchmarks/corpus_sintetico.py):
+detecção do tipo, extração de texto (PDF/XML), OCR, extração por regex, busca de filial e
+exportação (xlsx e CSV), cada uma medida separadamente e por tipo de documento.
+
+O resultado é gravado em JSON (mínimo, mediana, p95, média e número de medições por
+etapa/tipo, com o commit e os parâmetros da execução), junto com os acertos do regex por
+campo. Com --comparar, cada etapa é comparada com uma execução anterior pelo tempo mínimo
+(o menos sujeito a ruído) e as que ficaram mais lentas que o limiar são apontadas como
+regressão (código de saída 1).
+
+Uso:
+    python benchmarks/bench_etapas.py [--quantidade 5] [--itens 5] [--repeticoes 10] [--sem-ocr]
+                                      [--saida resultados.json] [--comparar anterior.json] [--limiar 0.2]
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import statistics
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+# As medições do benchmark não devem aparecer no /metrics da aplicação
+os.environ.setdefault('METRICAS_DIR', tempfile.mkdtemp(prefix='bench_metricas_'))
+
+import corpus_sintetico
+import Identificador
+import exportacao
+import utils
+from utils import extract_cnpj_fornecedor_cliente, extrair_campos_regex, buscar_filial_por_cnpj
+
+CAMPOS_REGEX = ['Data_Emissao', 'Data_Vencimento', 'Numero_Nota', 'Valor_Total', 'Desconto']
+# Diferenças abaixo disso (ms) não contam como regressão: ruído de medição
+TOLERANCIA_MS = 0.02
+
+
+def _percentil(valores, fracao):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(fracao * (len(ordenados) - 1))))]
+
+
+def _resumo(tempos):
+    ms = [t * 1000 for t in tempos]
+    return {
+        'min_ms': round(min(ms), 4),
+        'mediana_ms': round(statistics.median(ms), 4),
+        'p95_ms': round(_percentil(ms, 0.95), 4),
+        'media_ms': round(statistics.fmean(ms), 4),
+        'n': len(ms),
+    }
+
+
+def medir(funcao, repeticoes, aquecer=True):
+    # A primeira execução (caches frios, regex compilados sob demanda) não entra na conta
+    resultado = funcao() if aquecer else None
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos, resultado
+
+
+def _ler(documento):
+    caminho = documento['caminho']
+    if documento['tipo'] == corpus_sintetico.NFE_XML:
+        return Identificador.extrair_dados_xml(caminho)
+    return Identificador.extrair_dados_pdf(caminho)
+
+
+def _dado_exportacao(documento):
+    # Nota como a tela de validação envia para /exportar_excel
+    nota = documento['nota']
+    return {
+        'Arquivo': os.path.basename(documento['caminho']),
+        'Numero_Nota': nota['numero'],
+        'Cnpj_Fornecedor': corpus_sintetico.formatar_cnpj(nota['cnpj_fornecedor']),
+        'Cnpj_Cliente': corpus_sintetico.formatar_cnpj(nota['cnpj_cliente']),
+        'Data_Emissao': f'{nota["emissao"]:%d/%m/%Y}',
+        'Data_Vencimento': f'{nota["vencimento"]:%d/%m/%Y}',
+        'Valor_Total': corpus_sintetico.brl(nota['total']),
+        'Rateio?': 'NÃO',
+        'Produtos': [{'Produto': descricao, 'Qtde': str(quantidade), 'Valor_Unitario': corpus_sintetico.brl(unitario),
+                      'Valor_Total_Produto': corpus_sintetico.brl(total)}
+                     for descricao, quantidade, unitario, total in nota['itens']],
+    }
+
+
+def executar(documentos, repeticoes, com_ocr=True):
+    """
+    Mede cada etapa por tipo de documento.
+    Retorna ({etapa: {tipo: resumo}}, {tipo: {campo: 'acertos/total'}} do regex).
+    """
+    tempos = {}
+    acertos = {}
+
+    def registrar(etapa, tipo, valores):
+        tempos.setdefault(etapa, {}).setdefault(tipo, []).extend(valores)
+
+    for documento in documentos:
+        tipo = documento['tipo']
+        if tipo == corpus_sintetico.NFSE_PDF:
+            tipo = f'{tipo}_{documento["layout"]}'
+        caminho = documento['caminho']
+        digitalizado = documento['tipo'] == corpus_sintetico.PDF_DIGITALIZADO
+        if digitalizado and not com_ocr:
+            continue
+
+        valores, _ = medir(lambda: Identificador.identificar_tipo_nota(caminho), repeticoes)
+        registrar('deteccao_tipo', tipo, valores)
+
+        # PDF digitalizado: a leitura é o OCR; nos demais, extração direta do texto
+        try:
+            valores, registro = medir(lambda: _ler(documento), 1 if digitalizado else repeticoes,
+                                      aquecer=not digitalizado)
+        except Exception as e:
+            print(f'{os.path.basename(caminho)}: erro na leitura ({e})')
+            continue
+        registrar('ocr' if digitalizado else 'extracao_texto', tipo, valores)
+        texto = registro.get('texto_lido', '')
+
+        def regex():
+            return extract_cnpj_fornecedor_cliente(texto), extrair_campos_regex(texto, CAMPOS_REGEX)
+        valores, ((cnpj_fornecedor, cnpj_cliente), campos) = medir(regex, repeticoes)
+        registrar('regex', tipo, valores)
+        # Acertos por campo: mostra também se uma mudança no regex deixou de encontrar algo
+        nota = documento['nota']
+        esperados = {
+            'Cnpj_Fornecedor': (cnpj_fornecedor, corpus_sintetico.formatar_cnpj(nota['cnpj_fornecedor'])),
+            'Cnpj_Cliente': (cnpj_cliente, corpus_sintetico.formatar_cnpj(nota['cnpj_cliente'])),
+            'Numero_Nota': (campos.get('Numero_Nota', '').lstrip('0'), nota['numero']),
+            'Data_Emissao': (campos.get('Data_Emissao'), f'{nota["emissao"]:%d/%m/%Y}'),
+            'Data_Vencimento': (campos.get('Data_Vencimento'), f'{nota["vencimento"]:%d/%m/%Y}'),
+            'Valor_Total': (campos.get('Valor_Total'), corpus_sintetico.brl(nota['total'])),
+        }
+        por_campo = acertos.setdefault(tipo, {})
+        for campo, (obtido, esperado) in esperados.items():
+            certo, total = por_campo.get(campo, (0, 0))
+            por_campo[campo] = (certo + (obtido == esperado), total + 1)
+
+        cnpj_cliente = corpus_sintetico.formatar_cnpj(nota['cnpj_cliente'])
+        valores, _ = medir(lambda: buscar_filial_por_cnpj(cnpj_cliente), repeticoes)
+        registrar('filial', tipo, valores)
+
+    notas = [_dado_exportacao(documento) for documento in documentos]
+    valores, _ = medir(lambda: exportacao.escrever_xlsx(notas, tempfile.SpooledTemporaryFile()), repeticoes)
+    registrar('exportacao_xlsx', 'todos', valores)
+    valores, _ = medir(lambda: sum(len(pedaco) for pedaco in exportacao.gerar_csv(notas)), repeticoes)
+    registrar('exportacao_csv', 'todos', valores)
+
+    resultados = {etapa: {tipo: _resumo(valores) for tipo, valores in por_tipo.items()}
+                  for etapa, por_tipo in tempos.items()}
+    return resultados, {tipo: {campo: f'{certo}/{total}' for campo, (certo, total) in por_campo.items()}
+                        for tipo, por_campo in acertos.items()}
+
+
+def comparar(atual, anterior, limiar):
+    """
+    Lista (etapa, tipo, mínimo anterior, mínimo atual, variação) das etapas presentes nas
+    duas execuções, e as que pioraram mais que `limiar` (fração) como regressões.
+    """
+    linhas = []
+    regressoes = []
+    for etapa, por_tipo in atual['etapas'].items():
+        for tipo, resumo in por_tipo.items():
+            antes = anterior.get('etapas', {}).get(etapa, {}).get(tipo)
+            if not antes or not antes.get('min_ms'):
+                continue
+            variacao = resumo['min_ms'] / antes['min_ms'] - 1
+            linha = (etapa, tipo, antes['min_ms'], resumo['min_ms'], variacao)
+            linhas.append(linha)
+            if variacao > limiar and resumo['min_ms'] - antes['min_ms'] > TOLERANCIA_MS:
+                regressoes.append(linha)
+    return linhas, regressoes
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark por etapa sobre um corpus sintético')
+    parser.add_argument('--quantidade', type=int, default=5, help='documentos por tipo')
+    parser.add_argument('--itens', type=int, default=5, help='itens por nota')
+    parser.add_argument('--repeticoes', type=int, default=10)
+    parser.add_argument('--semente', type=int, default=1)
+    parser.add_argument('--sem-ocr', action='store_true', help='não gera nem mede PDFs digitalizados')
+    parser.add_argument('--saida', default=None, help='arquivo JSON do resultado (padrão: bench_etapas_<data>.json)')
+    parser.add_argument('--comparar', default=None, help='JSON de uma execução anterior')
+    parser.add_argument('--limiar', type=float, default=0.2, help='piora relativa considerada regressão')
+    args = parser.parse_args()
+
+    tipos = [t for t in corpus_sintetico.TIPOS if not (args.sem_ocr and t == corpus_sintetico.PDF_DIGITALIZADO)]
+    utils.carregar_catalogo()
+    with tempfile.TemporaryDirectory(prefix='corpus_') as pasta:
+        documentos = corpus_sintetico.gerar_corpus(pasta, args.quantidade, args.itens, args.semente, tipos)
+        etapas, acertos = executar(documentos, args.repeticoes, com_ocr=not args.sem_ocr)
+
+    resultado = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'parametros': {'quantidade': args.quantidade, 'itens': args.itens, 'repeticoes': args.repeticoes,
+                       'semente': args.semente, 'ocr': not args.sem_ocr},
+        'acertos_regex': acertos,
+        'etapas': etapas,
+    }
+    saida = args.saida or f'bench_etapas_{datetime.now():%Y%m%d_%H%M%S}.json'
+    with open(saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+    print(f"{'etapa':<18} {'tipo':<26} {'mín (ms)':>10} {'mediana (ms)':>13} {'p95 (ms)':>10} {'n':>5}")
+    for etapa, por_tipo in etapas.items():
+        for tipo, resumo in por_tipo.items():
+            print(f"{etapa:<18} {tipo:<26} {resumo['min_ms']:>10.3f} {resumo['mediana_ms']:>13.3f} "
+                  f"{resumo['p95_ms']:>10.3f} {resumo['n']:>5}")
+    print('Acertos do regex por campo:')
+    for tipo, por_campo in acertos.items():
+        print(f"  {tipo:<24} " + '  '.join(f'{campo} {valor}' for campo, valor in por_campo.items()))
+    print(f'Resultado gravado em {saida}')
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            anterior = json.load(f)
+        linhas, regressoes = comparar(resultado, anterior, args.limiar)
+        print(f"\nComparação do tempo mínimo com {args.comparar} (commit {anterior.get('commit')}):")
+        for etapa, tipo, antes, depois, variacao in linhas:
+            marca = '  <-- REGRESSÃO' if (etapa, tipo, antes, depois, variacao) in regressoes else ''
+            print(f'{etapa:<18} {tipo:<26} {antes:>10.3f} -> {depois:>10.3f} ms  {variacao:+7.1%}{marca}')
+        if regressoes:
+            print(f'{len(regressoes)} etapa(s) mais lentas que o limiar de {args.limiar:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Benchmark da montagem das linhas de /exportar_excel: implementação anterior, linha a linha
+(cópia de cada nota, varredura das chaves com startswith e conversão de valores célula
+a célula) x transformação colunar de exportacao.montar_tabela. Confere também que a
+planilha gerada pelas duas é idêntica byte a byte (exceto a data de criação em docProps).
+Mede também a exportação em CSV (exportacao.gerar_csv).
+
+Uso:
+    python benchmarks/bench_exportacao.py [numero_de_notas]
+"""
+import io
+import os
+import math
+import sys
+import time
+import random
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import exportacao
+
+
+# ---- Implementação anterior (linha a linha) ----
+
+def _sem_campos_produto(nota, remover_rateio=False):
+    linha = {}
+    for k, v in nota.items():
+        if k == 'Produtos' or k.startswith(exportacao.PREFIXOS_PRODUTO) or (remover_rateio and k.startswith('Rateio_')):
+            continue
+        linha[k] = v
+    return linha
+
+
+def _linhas_brutas(nota):
+    if nota.get('Rateio?') == 'SIM' and any(k.startswith('Rateio_Produto_') for k in nota.keys()):
+        base = _sem_campos_produto(nota, remover_rateio=True)
+        idx = 1
+        while True:
+            prod_rateio = nota.get(f'Rateio_Produto_{idx}')
+            if not prod_rateio:
+                break
+            linha = dict(base)
+            linha['Produto'] = prod_rateio
+            linha['Descricao_Produto'] = nota.get(f'Descricao_Produto_{idx}', prod_rateio)
+            linha['Qtde'] = ''
+            linha['Valor_Unitario'] = ''
+            linha['Valor_Total_Produto'] = ''
+            linha['Valor ou %'] = nota.get(f'Rateio_Valor_{idx}', '')
+            linha['ContaContabil'] = nota.get(f'Rateio_ContaContabil_{idx}', '')
+            linha['CC'] = nota.get(f'Rateio_CC_{idx}', '')
+            linha['ItemConta'] = nota.get(f'Rateio_ItemConta_{idx}', '')
+            yield linha
+            idx += 1
+    elif nota.get('Produtos'):
+        produtos = nota.get('Produtos', [])
+        if not isinstance(produtos, list):
+            produtos = [produtos] if produtos else []
+        base = _sem_campos_produto(nota)
+        for prod in produtos:
+            linha = dict(base)
+            linha['Produto'] = prod.get('Produto', '')
+            linha['Descricao_Produto'] = prod.get('Descricao', '') or prod.get('Produto', '')
+            qtde = prod.get('Qtde', '')
+            if not qtde or str(qtde).strip() == '':
+                qtde = 1
+            linha['Qtde'] = qtde
+            linha['Valor_Unitario'] = prod.get('Valor_Unitario', '')
+            linha['Valor_Total_Produto'] = prod.get('Valor_Total_Produto', '')
+            yield linha
+    else:
+        linha = _sem_campos_produto(nota)
+        linha['Produto'] = ''
+        linha['Descricao_Produto'] = ''
+        linha['Qtde'] = ''
+        linha['Valor_Unitario'] = ''
+        linha['Valor_Total_Produto'] = ''
+        yield linha
+
+
+def _converter_valores(linha):
+    # Conversão de valores e números para exportação
+    for campo in exportacao.CAMPOS_MONETARIOS:
+        if campo in linha:
+            valor = str(linha[campo]).replace('R$', '').replace(' ', '').replace('.', '').replace(',', '.')
+            try:
+                linha[campo] = float(valor)
+            except ValueError:
+                linha[campo] = ''
+    if 'Qtde' in linha:
+        qtde = str(linha['Qtde']).replace('.', '').replace(',', '.')
+        if not qtde or qtde.strip() == '':
+            qtde = '1'
+        try:
+            linha['Qtde'] = float(qtde)
+        except ValueError:
+            linha['Qtde'] = 1
+    # Garante que a coluna 'Tipo Rateio' exista em cada linha
+    if linha.get('Rateio?') == 'SIM':
+        if 'tipoValorOuPercentual' in linha:
+            tipo_rateio = linha['tipoValorOuPercentual']
+        elif 'Tipo Rateio' in linha:
+            tipo_rateio = linha['Tipo Rateio']
+        elif 'tipo_rateio' in linha:
+            tipo_rateio = linha['tipo_rateio']
+        else:
+            tipo_rateio = '%'  # ou 'R$', se preferir um padrão
+        linha['Tipo Rateio'] = tipo_rateio
+    else:
+        linha['Tipo Rateio'] = ''
+    return linha
+
+
+def gerar_linhas(notas):
+    """
+    Gera, uma a uma, as linhas da exportação (dicts) com valores já convertidos.
+    """
+    for nota in notas:
+        for linha in _linhas_brutas(nota):
+            yield _converter_valores(linha)
+
+
+def escrever_xlsx_linha_a_linha(notas, destino):
+    # Mesmo escritor de exportacao.escrever_xlsx, alimentado pelas linhas em dicts
+    colunas = exportacao.colunas_exportacao(notas)
+    workbook = exportacao.xlsxwriter.Workbook(destino, {'constant_memory': True, 'strings_to_urls': False})
+    planilha = workbook.add_worksheet('Sheet1')
+    if colunas:
+        cabecalho = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        for col, nome in enumerate(colunas):
+            planilha.write_string(0, col, str(nome), cabecalho)
+        for lin, linha in enumerate(gerar_linhas(notas), start=1):
+            for col, nome in enumerate(colunas):
+                valor = linha.get(nome)
+                # Ausentes e NaN ficam em branco
+                if valor is not None and not (isinstance(valor, float) and math.isnan(valor)):
+                    planilha.write(lin, col, valor)
+    workbook.close()
+
+
+# ---- Benchmark ----
+
+def gerar_notas(quantidade, semente=1):
+    """
+    Notas como as enviadas pela tela de validação: ~20% com rateio, a maioria com
+    produtos e algumas sem nenhum.
+    """
+    aleatorio = random.Random(semente)
+    notas = []
+    for i in range(quantidade):
+        nota = {
+            'Arquivo': f'nota_{i:05d}.pdf', 'Numero_Nota': str(1000 + i),
+            'Cnpj_Fornecedor': '12.345.678/0001-99', 'Cnpj_Cliente': '01.194.185/0001-85',
+            'Grupo': '01', 'Cod Filial': '01', 'Filial': 'PORTO ALEGRE',
+            'Data_Emissao': '01/03/2025', 'Data_Vencimento': '31/03/2025', 'Prazo': '30',
+            'Condição_de_Pagamento': '001', 'Valor_Total': aleatorio.choice(['1.234,56', 'R$ 980,00', '15.000,00']),
+            'Rateio?': 'SIM' if aleatorio.random() < 0.2 else 'NÃO',
+        }
+        if nota['Rateio?'] == 'SIM':
+            for j in range(1, aleatorio.randint(2, 5)):
+                nota[f'Rateio_Produto_{j}'] = f'10100{j:04d}'
+                nota[f'Rateio_Valor_{j}'] = '25'
+                nota[f'Rateio_ContaContabil_{j}'] = '41101001'
+                nota[f'Rateio_CC_{j}'] = '1001'
+                nota[f'Rateio_ItemConta_{j}'] = '001'
+            nota['tipoValorOuPercentual'] = '%'
+        elif aleatorio.random() < 0.9:
+            nota['Produtos'] = [{'Produto': f'10100{j:04d}', 'Qtde': aleatorio.choice(['1', '2,5', '']),
+                                 'Valor_Unitario': '123,45', 'Valor_Total_Produto': '246,90'}
+                                for j in range(aleatorio.randint(1, 4))]
+            for j, prod in enumerate(nota['Produtos'], start=1):
+                nota[f'Produto_{j}'] = prod['Produto']
+                nota[f'Qtde_{j}'] = prod['Qtde']
+        notas.append(nota)
+    return notas
+
+
+def _membros(conteudo):
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as z:
+        return {nome: z.read(nome) for nome in z.namelist() if nome != 'docProps/core.xml'}
+
+
+def medir(funcao):
+    inicio = time.perf_counter()
+    resultado = funcao()
+    return time.perf_counter() - inicio, resultado
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    notas = gerar_notas(quantidade)
+    colunas = exportacao.colunas_exportacao(notas)
+
+    t_linhas, linhas = medir(lambda: [[linha.get(c) for c in colunas] for linha in gerar_linhas(notas)])
+    t_colunar, tabelas = medir(lambda: list(exportacao.gerar_tabelas(notas, colunas)))
+    total_linhas = sum(len(t) for t in tabelas)
+
+    anterior = io.BytesIO()
+    t_xlsx_anterior, _ = medir(lambda: escrever_xlsx_linha_a_linha(notas, anterior))
+    atual = io.BytesIO()
+    t_xlsx_atual, _ = medir(lambda: exportacao.escrever_xlsx(notas, atual))
+    identicas = _membros(anterior.getvalue()) == _membros(atual.getvalue())
+
+    # CSV: tempo até o primeiro bloco de linhas (quando o download começa) e total
+    inicio = time.perf_counter()
+    pedacos = exportacao.gerar_csv(notas)
+    tamanho = len(next(pedacos, b'')) + len(next(pedacos, b''))
+    t_csv_primeiro = time.perf_counter() - inicio
+    tamanho += sum(len(pedaco) for pedaco in pedacos)
+    t_csv = time.perf_counter() - inicio
+
+    print(f'{quantidade} notas -> {len(linhas)} linhas ({total_linhas} na tabela colunar), {len(colunas)} colunas')
+    print(f'Montagem linha a linha: {t_linhas:7.2f} s')
+    print(f'Montagem colunar:       {t_colunar:7.2f} s  ({t_linhas / t_colunar:.1f}x)')
+    print(f'Planilha completa:      {t_xlsx_anterior:7.2f} s (anterior)  x  {t_xlsx_atual:7.2f} s (atual)')
+    print(f'Planilhas idênticas: {"sim" if identicas else "NÃO"}')
+    print(f'CSV completo:           {t_csv:7.2f} s  ({tamanho / 1e6:.1f} MB, primeiro bloco em {t_csv_primeiro:.2f} s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark da busca de filial por CNPJ: varredura do DataFrame a cada chamada
+(implementação anterior) x índice FILIAIS_POR_CNPJ (utils.buscar_filial_por_cnpj).
+
+Uso:
+    python benchmarks/bench_filiais.py [numero_de_buscas]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import utils
+
+
+def buscar_filial_por_cnpj_dataframe(cnpj_cliente):
+    # Implementação anterior: normaliza a coluna inteira a cada busca
+    cnpj_limpo = ''.join(filter(str.isdigit, str(cnpj_cliente)))
+    cnpjs_planilha = utils.FILIAIS_DF['CNPJ'].astype(str).apply(lambda x: x.zfill(14))
+    linha = utils.FILIAIS_DF[cnpjs_planilha == cnpj_limpo]
+    if not linha.empty:
+        return linha.iloc[0]['GRUPO'], linha.iloc[0]['Cod. Filial'], linha.iloc[0]['Filial']
+    return None, None, None
+
+
+def medir(funcao, cnpjs):
+    inicio = time.perf_counter()
+    for cnpj in cnpjs:
+        funcao(cnpj)
+    return (time.perf_counter() - inicio) / len(cnpjs)
+
+
+def main():
+    buscas = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    conhecidos = list(utils.FILIAIS_POR_CNPJ)
+    # Metade das buscas acerta uma filial (com máscara), metade é de CNPJ desconhecido
+    cnpjs = []
+    for i in range(buscas):
+        if i % 2 == 0:
+            cnpjs.append(utils.format_cnpj(conhecidos[i % len(conhecidos)]))
+        else:
+            cnpjs.append(f'{i:014d}')
+    for cnpj in cnpjs[:50]:
+        assert buscar_filial_por_cnpj_dataframe(cnpj) == utils.buscar_filial_por_cnpj(cnpj)
+    antigo = medir(buscar_filial_por_cnpj_dataframe, cnpjs)
+    novo = medir(utils.buscar_filial_por_cnpj, cnpjs)
+    print(f'{len(utils.FILIAIS_POR_CNPJ)} filiais, {buscas} buscas')
+    print(f'DataFrame: {antigo * 1e6:10.2f} us/busca')
+    print(f'Índice:    {novo * 1e6:10.2f} us/busca  ({antigo / novo:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
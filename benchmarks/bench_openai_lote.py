@@ -0,0 +1,72 @@
+"""
+Benchmark da tabulação pela OpenAI contra o stub local (benchmarks/stub_openai.py):
+uma nota por chamada com time.sleep(1.5) (implementação anterior) x lotes despachados
+em paralelo pelo limitador_openai (tabular_notas_em_lote).
+
+A implementação anterior é medida em uma amostra das notas e extrapolada, já que o tempo
+é linear no número de notas.
+
+Uso:
+    python benchmarks/bench_openai_lote.py [numero_de_notas] [latencia_do_stub]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import stub_openai
+
+
+def gerar_notas(quantidade):
+    notas = []
+    for i in range(quantidade):
+        texto = (f'DANFE NF-e Nº {1000 + i}\nEMITENTE FORNECEDOR LTDA CNPJ 12.345.678/0001-{i % 100:02d}\n'
+                 f'Data de emissão 01/01/2025 Vencimento 31/01/2025\n'
+                 + 'PRODUTO SERVICO DE MANUTENCAO 1,00 UN 150,00 150,00\n' * (3 + i % 5)
+                 + 'VALOR TOTAL DA NOTA 750,00\n')
+        notas.append({'arquivo': f'nota_{i+1:04d}.pdf', 'texto_lido': texto})
+    return notas
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latencia = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    servidor, base_url = stub_openai.iniciar_em_thread(porta=0, latencia=latencia, rpm=500, tpm=200000)
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'stub')
+    import tabular_notas_openai
+
+    notas = gerar_notas(quantidade)
+
+    amostra = notas[:5]
+    inicio = time.perf_counter()
+    for nota in amostra:
+        tabular_notas_openai.tabular_nota(nota, nota['arquivo'])
+        time.sleep(1.5)
+    por_nota = (time.perf_counter() - inicio) / len(amostra)
+    tokens_individual = sum(tabular_notas_openai.estimar_tokens(
+        tabular_notas_openai.montar_prompt([(n['arquivo'], n['texto_lido'])])) for n in notas)
+
+    atendidas_antes = servidor.contadores['atendidas']
+    inicio = time.perf_counter()
+    resultados = tabular_notas_openai.tabular_notas_em_lote(notas)
+    tempo_lote = time.perf_counter() - inicio
+    chamadas = servidor.contadores['atendidas'] - atendidas_antes
+    lotes = tabular_notas_openai.agrupar_em_lotes([(n['arquivo'], n['texto_lido']) for n in notas])
+    tokens_lote = sum(tabular_notas_openai.estimar_tokens(tabular_notas_openai.montar_prompt(lote)) for lote in lotes)
+    validos = sum(1 for _, dado, _ in resultados if dado)
+
+    print(f'{quantidade} notas, latência do stub {latencia}s')
+    print(f'Uma por chamada + sleep(1.5): {por_nota * quantidade:8.1f} s  ({quantidade} chamadas, '
+          f'~{tokens_individual} tokens de prompt)  [extrapolado de {len(amostra)} notas]')
+    print(f'Lotes em paralelo:            {tempo_lote:8.1f} s  ({chamadas} chamadas, ~{tokens_lote} tokens de prompt, '
+          f'{validos}/{quantidade} válidas)')
+    print(f'Limitador: {tabular_notas_openai.limitador_openai.get_limitador().estatisticas()}')
+    print(f'Stub: {servidor.contadores}')
+    servidor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
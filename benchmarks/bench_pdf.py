@@ -0,0 +1,87 @@
+"""
+Compara a leitura de PDFs com texto pelo caminho antigo (PyPDF2, arquivo aberto duas vezes
+e texto concatenado página a página) com o pipeline atual em PyMuPDF (Identificador.extrair_dados_pdf).
+
+Uso:
+    python benchmarks/bench_pdf.py                 # gera PDFs sintéticos de 1, 5 e 20 páginas
+    python benchmarks/bench_pdf.py nota1.pdf ...   # usa PDFs reais
+"""
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fitz
+from PyPDF2 import PdfReader
+import Identificador
+
+REPETICOES = 5
+
+LINHA_DANFE = 'PALLET PBR 1,200X1,000  UN  2,0000  1.500,50  3.001,00  5102  0  0,00  0,00'
+
+
+def ler_pdf_pypdf2(caminho_arquivo):
+    # Caminho anterior: identificar_tipo_nota + extrair_dados_pdf_texto
+    reader = PdfReader(caminho_arquivo)
+    for page in reader.pages:
+        if page.extract_text():
+            break
+    reader = PdfReader(caminho_arquivo)
+    texto = ""
+    for page in reader.pages:
+        texto += page.extract_text() or ""
+    return texto
+
+
+def ler_pdf_pymupdf(caminho_arquivo):
+    return Identificador.extrair_dados_pdf(caminho_arquivo)['texto_lido']
+
+
+def gerar_pdf_texto(caminho, paginas):
+    doc = fitz.open()
+    for n in range(paginas):
+        pagina = doc.new_page()
+        y = 40
+        pagina.insert_text((40, y), f'DANFE - DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRÔNICA  FOLHA {n + 1}/{paginas}', fontsize=9)
+        for _ in range(60):
+            y += 12
+            pagina.insert_text((40, y), LINHA_DANFE, fontsize=8)
+    doc.save(caminho)
+    doc.close()
+
+
+def medir(funcao, caminho):
+    tempos = []
+    for _ in range(REPETICOES):
+        inicio = time.perf_counter()
+        funcao(caminho)
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos)
+
+
+def main():
+    arquivos = sys.argv[1:]
+    temporarios = []
+    if not arquivos:
+        for paginas in (1, 5, 20):
+            fd, caminho = tempfile.mkstemp(suffix=f'_{paginas}p.pdf')
+            os.close(fd)
+            gerar_pdf_texto(caminho, paginas)
+            temporarios.append(caminho)
+        arquivos = temporarios
+    print(f"{'arquivo':<30} {'PyPDF2 (ms)':>12} {'PyMuPDF (ms)':>13} {'ganho':>7}")
+    try:
+        for caminho in arquivos:
+            antigo = medir(ler_pdf_pypdf2, caminho)
+            novo = medir(ler_pdf_pymupdf, caminho)
+            print(f'{os.path.basename(caminho):<30} {antigo * 1000:>12.1f} {novo * 1000:>13.1f} {antigo / novo:>6.1f}x')
+    finally:
+        for caminho in temporarios:
+            os.remove(caminho)
+
+
+if __name__ == '__main__':
+    main()
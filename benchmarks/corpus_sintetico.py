@@ -0,0 +1,264 @@
+"""
+Gerador de um corpus sintético de notas fiscais para os benchmarks: NF-e em XML, DANFE em
+PDF com texto, DANFE digitalizada (PDF só com imagens, que passa pelo OCR) e NFS-e em PDF
+nos layouts de São Paulo, ABRASF e do padrão nacional (DANFSe).
+
+Os dados são determinísticos pela semente. Metade dos clientes são CNPJs da tabela
+FILIAIS, para que a busca de filial exercite os dois caminhos (encontrada/não encontrada).
+
+Uso:
+    python benchmarks/corpus_sintetico.py destino/ [--quantidade 5] [--itens 5] [--semente 1]
+                                                   [--tipos nfe_xml,danfe_pdf,...]
+"""
+import os
+import sys
+import random
+import argparse
+from datetime import date, timedelta
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fitz
+
+NFE_XML = 'nfe_xml'
+DANFE_PDF = 'danfe_pdf'
+PDF_DIGITALIZADO = 'pdf_digitalizado'
+NFSE_PDF = 'nfse_pdf'
+TIPOS = (NFE_XML, DANFE_PDF, PDF_DIGITALIZADO, NFSE_PDF)
+LAYOUTS_NFSE = ('sao_paulo', 'abrasf', 'nacional')
+
+LINHAS_POR_PAGINA = 60
+DPI_DIGITALIZADO = 150
+
+PRODUTOS = ('PALLET PBR 1,200X1,000', 'FILME STRETCH 500MM', 'CAIXA PAPELAO 40X30X30', 'FITA ADESIVA 48MM',
+            'ETIQUETA TERMICA 100X150', 'OLEO DIESEL S10', 'PNEU 295/80 R22.5', 'CINTA DE AMARRACAO 9M')
+SERVICOS = ('SERVICO DE MANUTENCAO PREVENTIVA', 'LOCACAO DE EMPILHADEIRA', 'ARMAZENAGEM', 'SERVICO DE LIMPEZA',
+            'MOVIMENTACAO DE CARGAS', 'CONSULTORIA EM LOGISTICA')
+FORNECEDORES = ('COMERCIAL SUL LTDA', 'EMBALAGENS PAMPA S.A.', 'TRANSPORTES SERRA LTDA', 'AUTO PECAS GAUCHA LTDA',
+                'SERVICOS INTEGRADOS ME')
+
+
+def _digito_cnpj(base):
+    pesos = list(range(len(base) - 7, 1, -1)) + list(range(9, 1, -1))
+    resto = sum(int(d) * p for d, p in zip(base, pesos)) % 11
+    return '0' if resto < 2 else str(11 - resto)
+
+
+def gerar_cnpj(rng):
+    base = f'{rng.randrange(10 ** 8):08d}0001'
+    base += _digito_cnpj(base)
+    return base + _digito_cnpj(base)
+
+
+def formatar_cnpj(cnpj):
+    return f'{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}'
+
+
+def brl(valor):
+    return f'{valor:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.')
+
+
+def cnpjs_filiais():
+    try:
+        import utils
+        return sorted(utils.tabela('FILIAIS')['por_cnpj'])
+    except Exception:
+        return []
+
+
+def gerar_nota(rng, itens, clientes, servico=False):
+    """
+    Dados de uma nota: números, partes, datas e itens (descrição, quantidade, unitário, total).
+    """
+    emissao = date(2024, 1, 1) + timedelta(days=rng.randrange(365))
+    lista = []
+    for _ in range(itens):
+        quantidade = 1 if servico else rng.randint(1, 50)
+        unitario = round(rng.uniform(5, 3000), 2)
+        lista.append((rng.choice(SERVICOS if servico else PRODUTOS), quantidade, unitario,
+                      round(quantidade * unitario, 2)))
+    usar_filial = clientes and rng.random() < 0.5
+    return {
+        'numero': str(rng.randint(1, 999999)),
+        'serie': str(rng.randint(1, 9)),
+        'fornecedor': rng.choice(FORNECEDORES),
+        'cnpj_fornecedor': gerar_cnpj(rng),
+        'cnpj_cliente': rng.choice(clientes) if usar_filial else gerar_cnpj(rng),
+        'emissao': emissao,
+        'vencimento': emissao + timedelta(days=rng.choice((0, 15, 28, 30, 45, 60))),
+        'itens': lista,
+        'total': round(sum(total for *_, total in lista), 2),
+    }
+
+
+def escrever_nfe_xml(caminho, nota):
+    dets = ''.join(
+        f'<det nItem="{i}"><prod><cProd>{i:04d}</cProd><xProd>{escape(descricao)}</xProd><CFOP>5102</CFOP>'
+        f'<uCom>UN</uCom><qCom>{quantidade:.4f}</qCom><vUnCom>{unitario:.10f}</vUnCom><vProd>{total:.2f}</vProd>'
+        f'</prod><imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><vBC>{total:.2f}</vBC><pICMS>17.00</pICMS>'
+        f'<vICMS>{total * 0.17:.2f}</vICMS></ICMS00></ICMS></imposto></det>'
+        for i, (descricao, quantidade, unitario, total) in enumerate(nota['itens'], start=1))
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe><infNFe versao="4.00" '
+        f'Id="NFe43{nota["emissao"]:%y%m}{nota["cnpj_fornecedor"]}55{int(nota["serie"]):03d}{int(nota["numero"]):09d}">'
+        f'<ide><cUF>43</cUF><natOp>VENDA</natOp><mod>55</mod><serie>{nota["serie"]}</serie><nNF>{nota["numero"]}</nNF>'
+        f'<dhEmi>{nota["emissao"]:%Y-%m-%d}T10:00:00-03:00</dhEmi><tpNF>1</tpNF></ide>'
+        f'<emit><CNPJ>{nota["cnpj_fornecedor"]}</CNPJ><xNome>{escape(nota["fornecedor"])}</xNome></emit>'
+        f'<dest><CNPJ>{nota["cnpj_cliente"]}</CNPJ><xNome>CLIENTE</xNome></dest>'
+        f'{dets}<total><ICMSTot><vProd>{nota["total"]:.2f}</vProd><vDesc>0.00</vDesc><vNF>{nota["total"]:.2f}</vNF>'
+        f'</ICMSTot></total><cobr><fat><nFat>{nota["numero"]}</nFat><vLiq>{nota["total"]:.2f}</vLiq></fat>'
+        f'<dup><nDup>001</nDup><dVenc>{nota["vencimento"]:%Y-%m-%d}</dVenc><vDup>{nota["total"]:.2f}</vDup></dup></cobr>'
+        '</infNFe><Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignedInfo/>'
+        f'<SignatureValue>{"A" * 344}</SignatureValue></Signature></NFe></nfeProc>'
+    )
+    with open(caminho, 'w', encoding='utf-8') as f:
+        f.write(xml)
+
+
+def linhas_danfe(nota):
+    linhas = [
+        f'RECEBEMOS DE {nota["fornecedor"]} OS PRODUTOS CONSTANTES DA NOTA FISCAL INDICADA AO LADO',
+        'DATA DE RECEBIMENTO            IDENTIFICAÇÃO E ASSINATURA DO RECEBEDOR',
+        f'NF-e Nº {nota["numero"]} SÉRIE {nota["serie"]}',
+        'DANFE - DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRÔNICA',
+        f'EMITENTE: {nota["fornecedor"]}',
+        f'CNPJ: {formatar_cnpj(nota["cnpj_fornecedor"])}',
+        'DESTINATÁRIO / REMETENTE',
+        f'NOME/RAZÃO SOCIAL: CLIENTE    CNPJ/CPF: {formatar_cnpj(nota["cnpj_cliente"])}',
+        f'DATA DA EMISSÃO: {nota["emissao"]:%d/%m/%Y}',
+        'FATURA / DUPLICATAS',
+        f'001  VENC. {nota["vencimento"]:%d/%m/%Y}  VALOR {brl(nota["total"])}',
+        'DADOS DOS PRODUTOS / SERVIÇOS',
+        'DESCRIÇÃO DO PRODUTO  UN  QUANT  VALOR UNIT  VALOR TOTAL  CFOP',
+    ]
+    linhas += [f'{descricao}  UN  {quantidade:.4f}'.replace('.', ',') + f'  {brl(unitario)}  {brl(total)}  5102'
+               for descricao, quantidade, unitario, total in nota['itens']]
+    linhas += [
+        f'VALOR TOTAL DOS PRODUTOS {brl(nota["total"])}',
+        f'VALOR TOTAL DA NOTA {brl(nota["total"])}',
+        'DADOS ADICIONAIS',
+        'INFORMAÇÕES COMPLEMENTARES: DOCUMENTO EMITIDO POR ME OU EPP OPTANTE PELO SIMPLES NACIONAL',
+        'NÃO GERA DIREITO A CRÉDITO FISCAL DE IPI',
+    ]
+    return linhas
+
+
+def linhas_nfse(nota, layout):
+    servicos = [f'{descricao}  {brl(total)}' for descricao, _, _, total in nota['itens']]
+    if layout == 'sao_paulo':
+        return [
+            'PREFEITURA DO MUNICÍPIO DE SÃO PAULO',
+            'SECRETARIA MUNICIPAL DA FAZENDA',
+            'NOTA FISCAL ELETRÔNICA DE SERVIÇOS - NFS-e',
+            f'Número da Nota {int(nota["numero"]):08d}   Data e Hora de Emissão {nota["emissao"]:%d/%m/%Y} 10:00:00',
+            'PRESTADOR DE SERVIÇOS',
+            f'CPF/CNPJ: {formatar_cnpj(nota["cnpj_fornecedor"])}   Nome/Razão Social: {nota["fornecedor"]}',
+            'TOMADOR DE SERVIÇOS',
+            f'CPF/CNPJ: {formatar_cnpj(nota["cnpj_cliente"])}   Nome/Razão Social: CLIENTE',
+            'DISCRIMINAÇÃO DOS SERVIÇOS',
+            *servicos,
+            f'Vencimento: {nota["vencimento"]:%d/%m/%Y}',
+            f'VALOR TOTAL DO SERVIÇO = R$ {brl(nota["total"])}',
+            'Código do Serviço 07498 - Outros serviços   Valor do ISS (R$) ' + brl(nota['total'] * 0.05),
+        ]
+    if layout == 'abrasf':
+        return [
+            'NOTA FISCAL DE SERVIÇOS ELETRÔNICA - NFS-e',
+            f'Nº da Nota: {nota["numero"]}   Emissão: {nota["emissao"]:%d/%m/%Y}   Competência: {nota["emissao"]:%m/%Y}',
+            f'Prestador: {nota["fornecedor"]}',
+            f'CNPJ: {formatar_cnpj(nota["cnpj_fornecedor"])}   Inscrição Municipal: 123456',
+            'Tomador: CLIENTE',
+            f'CNPJ: {formatar_cnpj(nota["cnpj_cliente"])}',
+            'Discriminação dos Serviços',
+            *servicos,
+            f'Valor dos Serviços: R$ {brl(nota["total"])}   Desconto Incondicionado: R$ 0,00',
+            f'Valor Líquido: R$ {brl(nota["total"])}   Data de Vencimento: {nota["vencimento"]:%d/%m/%Y}',
+        ]
+    return [
+        'DANFSe v1.0 - Documento Auxiliar da NFS-e',
+        f'Número da NFS-e {nota["numero"]}   Data e Hora da emissão da NFS-e {nota["emissao"]:%d/%m/%Y} 10:00:00',
+        'EMITENTE DA NFS-e   Prestador do Serviço',
+        f'CNPJ / CPF / NIF {formatar_cnpj(nota["cnpj_fornecedor"])}   Nome / Nome Empresarial {nota["fornecedor"]}',
+        'TOMADOR DO SERVIÇO',
+        f'CNPJ / CPF / NIF {formatar_cnpj(nota["cnpj_cliente"])}   Nome / Nome Empresarial CLIENTE',
+        'SERVIÇO PRESTADO   Descrição do Serviço',
+        *servicos,
+        f'VALOR TOTAL DA NFS-E   Valor do Serviço R$ {brl(nota["total"])}',
+        f'Valor Líquido da NFS-e R$ {brl(nota["total"])}   Vencimento {nota["vencimento"]:%d/%m/%Y}',
+    ]
+
+
+def _documento_texto(linhas):
+    doc = fitz.open()
+    for inicio in range(0, max(len(linhas), 1), LINHAS_POR_PAGINA):
+        pagina = doc.new_page()
+        y = 40
+        for linha in linhas[inicio:inicio + LINHAS_POR_PAGINA]:
+            pagina.insert_text((30, y), linha, fontsize=8)
+            y += 12
+    return doc
+
+
+def escrever_pdf_texto(caminho, linhas):
+    doc = _documento_texto(linhas)
+    doc.save(caminho)
+    doc.close()
+
+
+def escrever_pdf_digitalizado(caminho, linhas, dpi=DPI_DIGITALIZADO):
+    # Cada página vira uma imagem, sem camada de texto, como um documento escaneado
+    origem = _documento_texto(linhas)
+    doc = fitz.open()
+    for pagina in origem:
+        pix = pagina.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+        nova = doc.new_page(width=pagina.rect.width, height=pagina.rect.height)
+        nova.insert_image(nova.rect, pixmap=pix)
+    origem.close()
+    doc.save(caminho, deflate=True)
+    doc.close()
+
+
+def gerar_corpus(destino, quantidade=5, itens=5, semente=1, tipos=TIPOS):
+    """
+    Gera `quantidade` documentos de cada tipo em `destino`. Retorna uma lista de dicts
+    com 'caminho', 'tipo', 'layout' e os dados da 'nota' (para conferir a extração).
+    """
+    os.makedirs(destino, exist_ok=True)
+    rng = random.Random(semente)
+    clientes = cnpjs_filiais()
+    documentos = []
+    for tipo in tipos:
+        for i in range(quantidade):
+            layout = LAYOUTS_NFSE[i % len(LAYOUTS_NFSE)] if tipo == NFSE_PDF else ''
+            nota = gerar_nota(rng, itens, clientes, servico=tipo == NFSE_PDF)
+            nome = f'{tipo}_{layout + "_" if layout else ""}{i + 1:03d}'
+            if tipo == NFE_XML:
+                caminho = os.path.join(destino, f'{nome}.xml')
+                escrever_nfe_xml(caminho, nota)
+            else:
+                caminho = os.path.join(destino, f'{nome}.pdf')
+                linhas = linhas_nfse(nota, layout) if tipo == NFSE_PDF else linhas_danfe(nota)
+                if tipo == PDF_DIGITALIZADO:
+                    escrever_pdf_digitalizado(caminho, linhas)
+                else:
+                    escrever_pdf_texto(caminho, linhas)
+            documentos.append({'caminho': caminho, 'tipo': tipo, 'layout': layout, 'nota': nota})
+    return documentos
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera um corpus sintético de notas fiscais')
+    parser.add_argument('destino')
+    parser.add_argument('--quantidade', type=int, default=5, help='documentos por tipo')
+    parser.add_argument('--itens', type=int, default=5, help='itens por nota (mais itens = mais páginas)')
+    parser.add_argument('--semente', type=int, default=1)
+    parser.add_argument('--tipos', default=','.join(TIPOS))
+    args = parser.parse_args()
+    documentos = gerar_corpus(args.destino, args.quantidade, args.itens, args.semente, args.tipos.split(','))
+    print(f'{len(documentos)} documentos gerados em {args.destino}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Servidor local que imita o endpoint /v1/chat/completions da OpenAI, para testar o
+limitador, o modo em lote e a aplicação inteira sem gastar cota. Responde um objeto JSON por
+"Arquivo:" do prompt (ou, com --gravacoes, a resposta gravada pelo backend_llm em modo record
+para o mesmo pedido), com latência simulada, erros 500 injetados, limites de requisições/tokens
+por minuto (429 + retry-after), recusas 429 iniciais e cota esgotada (insufficient_quota) forçadas,
+e os cabeçalhos x-ratelimit-* da API real.
+
+Uso:
+    python benchmarks/stub_openai.py [--porta 8765] [--latencia 0.5] [--variacao 0.2] [--rpm 60]
+                                     [--tpm 40000] [--taxa-erro 0.05] [--gravacoes gravacoes_llm/]
+                                     [--recusas-iniciais 3] [--sem-cota]
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub python tabular_notas_openai.py
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import backend_llm
+
+
+def _estimar_tokens(texto):
+    return len(texto) // 3 + 1
+
+
+def _duracao(segundos):
+    # Formato dos cabeçalhos x-ratelimit-reset-*: '1.5s', '20ms'
+    return f'{int(segundos * 1000)}ms' if segundos < 1 else f'{segundos:.3f}s'
+
+
+class JanelaMinuto:
+    """
+    Consumo dos últimos 60 segundos (janela deslizante), como o limite da API.
+    """
+
+    def __init__(self, limite):
+        self.limite = limite
+        self._eventos = deque()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _expirar(self, agora):
+        while self._eventos and agora - self._eventos[0][0] >= 60:
+            self._total -= self._eventos.popleft()[1]
+
+    def consumir(self, quantidade):
+        """
+        Retorna (aceito, restante, segundos_para_liberar).
+        """
+        with self._lock:
+            agora = time.monotonic()
+            self._expirar(agora)
+            if self._total + quantidade > self.limite and self._eventos:
+                liberado = self._total + quantidade - self.limite
+                espera = 0.0
+                for instante, valor in self._eventos:
+                    liberado -= valor
+                    espera = 60 - (agora - instante)
+                    if liberado <= 0:
+                        break
+                return False, max(0, self.limite - self._total), max(espera, 0.001)
+            self._eventos.append((agora, quantidade))
+            self._total += quantidade
+            reinicio = 60 - (agora - self._eventos[0][0])
+            return True, max(0, self.limite - self._total), reinicio
+
+
+# Mesma resposta sintética do backend_llm em modo stub
+resposta_para_prompt = backend_llm.resposta_stub
+
+
+def criar_servidor(porta=8765, latencia=0.5, rpm=60, tpm=40000, host='127.0.0.1', variacao=0.0,
+                   taxa_erro=0.0, gravacoes=None, recusas_iniciais=0, sem_cota=False, retry_after=0.05):
+    """
+    `recusas_iniciais`: as primeiras requisições recebem 429 (rate_limit_exceeded) com
+    retry-after de `retry_after` segundos, independentemente dos limites.
+    `sem_cota`: todas recebem 429 de cota esgotada (insufficient_quota), sem retry-after.
+    """
+    requisicoes = JanelaMinuto(rpm)
+    tokens = JanelaMinuto(tpm)
+    contadores = {'atendidas': 0, 'recusadas_429': 0, 'erros_500': 0, 'gravadas': 0}
+    recusas_pendentes = [recusas_iniciais]
+    lock = threading.Lock()
+
+    class Manipulador(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, formato, *args):
+            pass
+
+        def _enviar(self, status, corpo, cabecalhos):
+            dados = json.dumps(corpo, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(dados)))
+            for nome, valor in cabecalhos.items():
+                self.send_header(nome, valor)
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_POST(self):
+            corpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self._enviar(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}}, {})
+                return
+            if sem_cota:
+                with lock:
+                    contadores['recusadas_429'] += 1
+                self._enviar(429, {'error': {'message': 'You exceeded your current quota (stub)',
+                                             'type': 'insufficient_quota', 'code': 'insufficient_quota'}}, {})
+                return
+            with lock:
+                recusar = recusas_pendentes[0] > 0
+                if recusar:
+                    recusas_pendentes[0] -= 1
+                    contadores['recusadas_429'] += 1
+            if recusar:
+                self._enviar(429, {'error': {'message': 'Rate limit reached (stub)', 'type': 'requests',
+                                             'code': 'rate_limit_exceeded'}}, {'retry-after': f'{retry_after:.3f}'})
+                return
+            mensagens = corpo.get('messages', [])
+            prompt = '\n'.join(str(m.get('content', '')) for m in mensagens)
+            tokens_prompt = _estimar_tokens(prompt)
+            # Como na API real, o max_tokens pedido conta no limite de tokens/min
+            custo = tokens_prompt + int(corpo.get('max_tokens') or 0)
+            aceito_req, restante_req, reinicio_req = requisicoes.consumir(1)
+            aceito_tok, restante_tok, reinicio_tok = (tokens.consumir(custo) if aceito_req
+                                                      else (True, tokens.limite, 0.0))
+            cabecalhos = {
+                'x-ratelimit-limit-requests': str(rpm),
+                'x-ratelimit-limit-tokens': str(tpm),
+                'x-ratelimit-remaining-requests': str(int(restante_req)),
+                'x-ratelimit-remaining-tokens': str(int(restante_tok)),
+                'x-ratelimit-reset-requests': _duracao(reinicio_req),
+                'x-ratelimit-reset-tokens': _duracao(reinicio_tok),
+            }
+            if not (aceito_req and aceito_tok):
+                if aceito_req:
+                    # A requisição não foi atendida: devolve a vaga consumida
+                    requisicoes.consumir(-1)
+                with lock:
+                    contadores['recusadas_429'] += 1
+                espera = reinicio_req if not aceito_req else reinicio_tok
+                cabecalhos['retry-after'] = f'{espera:.3f}'
+                self._enviar(429, {'error': {'message': 'Rate limit reached (stub)', 'type': 'requests',
+                                             'code': 'rate_limit_exceeded'}}, cabecalhos)
+                return
+            time.sleep(backend_llm.latencia_simulada(latencia, variacao))
+            if backend_llm.sortear_erro(taxa_erro):
+                with lock:
+                    contadores['erros_500'] += 1
+                self._enviar(500, {'error': {'message': 'Erro injetado (stub)', 'type': 'server_error'}}, cabecalhos)
+                return
+            gravacao = None
+            if gravacoes:
+                chave = backend_llm.chave_pedido(corpo.get('model'), mensagens, corpo.get('max_tokens'),
+                                                 corpo.get('temperature'))
+                gravacao = backend_llm.obter_gravacao(chave, gravacoes)
+            conteudo = gravacao['conteudo'] if gravacao else resposta_para_prompt(prompt)
+            with lock:
+                contadores['atendidas'] += 1
+                contadores['gravadas'] += bool(gravacao)
+            self._enviar(200, {
+                'id': f"chatcmpl-stub-{contadores['atendidas']}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': corpo.get('model', 'stub'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': conteudo},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': tokens_prompt, 'completion_tokens': _estimar_tokens(conteudo),
+                          'total_tokens': tokens_prompt + _estimar_tokens(conteudo)},
+            }, cabecalhos)
+
+    servidor = ThreadingHTTPServer((host, porta), Manipulador)
+    servidor.daemon_threads = True
+    servidor.contadores = contadores
+    return servidor
+
+
+def iniciar_em_thread(**opcoes):
+    """
+    Sobe o servidor em uma thread daemon e retorna (servidor, base_url).
+    Com porta=0 o sistema escolhe uma porta livre.
+    """
+    servidor = criar_servidor(**opcoes)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    host, porta = servidor.server_address[:2]
+    return servidor, f'http://{host}:{porta}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub local da API de chat completions da OpenAI')
+    parser.add_argument('--porta', type=int, default=8765)
+    parser.add_argument('--latencia', type=float, default=0.5, help='segundos por resposta')
+    parser.add_argument('--variacao', type=float, default=0.0, help='variação relativa da latência (0.2 = ±20%%)')
+    parser.add_argument('--rpm', type=int, default=60)
+    parser.add_argument('--tpm', type=int, default=40000)
+    parser.add_argument('--taxa-erro', type=float, default=0.0, help='fração das respostas com erro 500')
+    parser.add_argument('--gravacoes', default=None, help='pasta de gravações do backend_llm (LLM_MODO=record)')
+    parser.add_argument('--recusas-iniciais', type=int, default=0, help='429 forçados nas primeiras requisições')
+    parser.add_argument('--sem-cota', action='store_true', help='responde sempre 429 insufficient_quota')
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args()
+    servidor = criar_servidor(args.porta, args.latencia, args.rpm, args.tpm, args.host, args.variacao,
+                              args.taxa_erro, args.gravacoes, args.recusas_iniciais, args.sem_cota)
+    print(f'Stub OpenAI em http://{args.host}:{args.porta}/v1 (latência {args.latencia}s, {args.rpm} req/min, '
+          f'{args.tpm} tokens/min, erros {args.taxa_erro:.0%})')
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
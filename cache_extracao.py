@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import threading
+
+# Cache de extração endereçado pelo conteúdo (SHA-256 dos bytes enviados).
+# Guarda separadamente o texto bruto lido pelo Identificador e o dict final tabulado,
+# de forma que o mesmo documento enviado com nomes diferentes seja processado uma única vez.
+CACHE_DIR = os.environ.get('CACHE_EXTRACAO_DIR', os.path.join(os.path.dirname(__file__), 'cache_extracao'))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_EXTRACAO_MAX_BYTES', 200 * 1024 * 1024))
+TAMANHO_BLOCO = 64 * 1024
+
+TIPO_TEXTO = 'texto'
+TIPO_DADOS = 'dados'
+
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+_lock = threading.Lock()
+# (caminho, tamanho, mtime) -> sha256, evita recalcular o hash de arquivos já conhecidos
+_hashes_arquivos = {}
+
+
+def registrar_hash_arquivo(caminho, digest):
+    # O hash do upload é calculado enquanto os bytes chegam (recebimento.gravar_blocos)
+    try:
+        st = os.stat(caminho)
+    except OSError:
+        return
+    with _lock:
+        _hashes_arquivos[(os.path.abspath(caminho), st.st_size, st.st_mtime_ns)] = digest
+
+
+def hash_do_arquivo(caminho):
+    """
+    Retorna o SHA-256 de um arquivo já gravado. Usa o hash calculado no upload quando
+    disponível (mesmo processo); caso contrário lê o arquivo em blocos.
+    """
+    st = os.stat(caminho)
+    chave = (os.path.abspath(caminho), st.st_size, st.st_mtime_ns)
+    with _lock:
+        digest = _hashes_arquivos.get(chave)
+    if digest:
+        return digest
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b''):
+            sha.update(bloco)
+    digest = sha.hexdigest()
+    with _lock:
+        _hashes_arquivos[chave] = digest
+    return digest
+
+
+def _caminho_entrada(digest, tipo):
+    return os.path.join(CACHE_DIR, f'{digest}_{tipo}.json')
+
+
+def obter(digest, tipo):
+    """
+    Retorna o conteúdo em cache para o hash e tipo ('texto' ou 'dados') ou None.
+    Um acerto atualiza o mtime da entrada, que é usado como relógio do LRU.
+    """
+    if not digest:
+        return None
+    caminho = _caminho_entrada(digest, tipo)
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            valor = json.load(f)
+        os.utime(caminho, None)
+        return valor
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def contem(digest, tipo):
+    # Sem ler nem contar como uso no LRU
+    return bool(digest) and os.path.exists(_caminho_entrada(digest, tipo))
+
+
+def guardar(digest, tipo, valor):
+    """
+    Grava a entrada de forma atômica (arquivo temporário + rename) e aplica a
+    evicção por tamanho total do cache.
+    """
+    if not digest:
+        return
+    caminho = _caminho_entrada(digest, tipo)
+    tmp = f'{caminho}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(valor, f, ensure_ascii=False)
+    os.replace(tmp, caminho)
+    _aplicar_limite()
+
+
+def remover(digest):
+    for tipo in (TIPO_TEXTO, TIPO_DADOS):
+        try:
+            os.remove(_caminho_entrada(digest, tipo))
+        except OSError:
+            pass
+
+
+def _aplicar_limite():
+    # LRU: remove as entradas menos usadas recentemente até caber em CACHE_MAX_BYTES
+    entradas = []
+    total = 0
+    for nome in os.listdir(CACHE_DIR):
+        if not nome.endswith('.json'):
+            continue
+        caminho = os.path.join(CACHE_DIR, nome)
+        try:
+            st = os.stat(caminho)
+        except OSError:
+            continue
+        entradas.append((st.st_mtime, st.st_size, caminho))
+        total += st.st_size
+    if total <= CACHE_MAX_BYTES:
+        return
+    entradas.sort()
+    for _, tamanho, caminho in entradas:
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(caminho)
+            total -= tamanho
+        except OSError:
+            pass
@@ -0,0 +1,341 @@
+import os
+import io
+import tempfile
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+# Exportação das notas validadas. Cada nota vira uma ou mais linhas (uma por produto ou por
+# item de rateio) e as linhas são escritas à medida que são geradas, com o xlsxwriter em modo
+# constant_memory: o uso de memória não cresce com o número de linhas exportadas.
+# As mesmas tabelas alimentam o CSV (gerado em pedaços, para envio em streaming) e o Parquet.
+
+# Campos por produto da tela de validação, substituídos pelas colunas Produto/Qtde/...
+PREFIXOS_PRODUTO = ('Produto_', 'Qtde_', 'Valor_Unitario_', 'Valor_Total_Produto_', 'Descricao_Produto_')
+CAMPOS_MONETARIOS = ('Valor_Total', 'Valor_Unitario', 'Valor_Total_Produto')
+# Colunas que não vão para a planilha
+COLUNAS_REMOVIDAS = ('tipoValorOuPercentual', 'Descricao_Produto')
+# Acima disso o arquivo gerado sai da memória para um temporário em disco
+EXPORTACAO_SPOOL_MAX = int(os.environ.get('EXPORTACAO_SPOOL_MAX', 16 * 1024 * 1024))
+# Notas transformadas por vez: limita o tamanho dos DataFrames intermediários
+EXPORTACAO_NOTAS_POR_BLOCO = int(os.environ.get('EXPORTACAO_NOTAS_POR_BLOCO', 2000))
+# CSV no padrão do Excel em português: ';' entre campos, vírgula decimal e BOM UTF-8
+CSV_SEPARADOR = os.environ.get('EXPORTACAO_CSV_SEPARADOR', ';')
+CSV_DECIMAL = os.environ.get('EXPORTACAO_CSV_DECIMAL', ',')
+# Colunas numéricas da exportação (float no Parquet); as demais são texto
+COLUNAS_NUMERICAS = ('Qtde',) + CAMPOS_MONETARIOS
+
+# Formato -> (extensão, mimetype)
+FORMATOS = {
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('csv', 'text/csv'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+# Colunas acrescentadas a cada linha, conforme a origem da linha
+COLUNAS_PRODUTO = ['Produto', 'Descricao_Produto', 'Qtde', 'Valor_Unitario', 'Valor_Total_Produto']
+COLUNAS_RATEIO = COLUNAS_PRODUTO + ['Valor ou %', 'ContaContabil', 'CC', 'ItemConta']
+CAMPOS_RATEIO = {'Valor ou %': 'Rateio_Valor_', 'ContaContabil': 'Rateio_ContaContabil_',
+                 'CC': 'Rateio_CC_', 'ItemConta': 'Rateio_ItemConta_'}
+
+RATEIO = 'rateio'
+PRODUTOS = 'produtos'
+SEM_PRODUTOS = 'sem_produtos'
+
+
+def _produtos(nota):
+    produtos = nota.get('Produtos', [])
+    if not isinstance(produtos, list):
+        produtos = [produtos] if produtos else []
+    return produtos
+
+
+def _planejar(nota):
+    """
+    (origem, quantidade de linhas) da nota: uma linha por item de rateio (Rateio_Produto_1..N
+    até o primeiro vazio), uma por produto ou uma linha sem produto.
+    """
+    if nota.get('Rateio?') == 'SIM' and any(k.startswith('Rateio_Produto_') for k in nota.keys()):
+        quantidade = 0
+        while nota.get(f'Rateio_Produto_{quantidade + 1}'):
+            quantidade += 1
+        return RATEIO, quantidade
+    if nota.get('Produtos'):
+        return PRODUTOS, len(_produtos(nota))
+    return SEM_PRODUTOS, 1
+
+
+def _excluida(coluna, origem):
+    # Campos por produto da tela (e os de rateio, nas linhas de rateio) não vão para a planilha
+    return (coluna == 'Produtos' or coluna.startswith(PREFIXOS_PRODUTO)
+            or (origem == RATEIO and coluna.startswith('Rateio_')))
+
+
+def colunas_exportacao(notas):
+    """
+    Colunas da planilha na ordem em que aparecem nas linhas (campos da nota seguidos dos
+    acrescentados pela exportação), com 'Tipo Rateio' reposicionada após 'Rateio?' como na
+    exportação anterior e sem colunas vazias ou removidas. Todas as linhas de uma nota têm
+    as mesmas colunas, então basta percorrer as chaves de cada nota.
+    """
+    colunas = {}
+    for nota in notas:
+        origem, quantidade = _planejar(nota)
+        if not quantidade:
+            continue
+        for coluna in nota:
+            if not _excluida(coluna, origem):
+                colunas.setdefault(coluna, None)
+        for coluna in (COLUNAS_RATEIO if origem == RATEIO else COLUNAS_PRODUTO):
+            colunas.setdefault(coluna, None)
+        colunas.setdefault('Tipo Rateio', None)
+    colunas = [c for c in colunas if c is not None and c != '']
+    if 'Rateio?' in colunas and 'Tipo Rateio' in colunas:
+        # A posição é calculada antes de retirar a coluna, como fazia a exportação com pandas:
+        # uma 'Tipo Rateio' que vinha antes de 'Rateio?' fica uma coluna depois da seguinte
+        posicao = colunas.index('Rateio?') + 1
+        colunas.remove('Tipo Rateio')
+        colunas.insert(posicao, 'Tipo Rateio')
+    return [c for c in colunas if c not in COLUNAS_REMOVIDAS]
+
+
+def _valor_brl(texto):
+    # '1.234,56' / 'R$ 10,00' -> float; o que não for número fica NaN (célula em branco)
+    try:
+        return float(texto.replace('R$', '').replace(' ', '').replace('.', '').replace(',', '.'))
+    except ValueError:
+        return np.nan
+
+
+def _quantidade(texto):
+    # Quantidade vazia ou inválida vale 1
+    texto = texto.replace('.', '').replace(',', '.')
+    if not texto or texto.strip() == '':
+        texto = '1'
+    try:
+        return float(texto)
+    except ValueError:
+        return 1.0
+
+
+def _converter(valores, conversor):
+    """
+    Converte uma coluna para float aplicando `conversor(str(valor))` uma única vez por valor
+    distinto: os valores são fatorados em códigos e o resultado é expandido por indexação.
+    """
+    textos = np.array([str(valor) for valor in valores], dtype=object)
+    codigos, distintos = pd.factorize(textos)
+    return np.array([conversor(texto) for texto in distintos], dtype=float)[codigos]
+
+
+def _tipo_rateio(nota):
+    if nota.get('Rateio?') != 'SIM':
+        return ''
+    for campo in ('tipoValorOuPercentual', 'Tipo Rateio', 'tipo_rateio'):
+        if campo in nota:
+            return nota[campo]
+    return '%'  # ou 'R$', se preferir um padrão
+
+
+def montar_tabela(notas, colunas):
+    """
+    Transforma um bloco de notas nas linhas da planilha, de forma colunar: as notas viram
+    um DataFrame, cada nota é repetida pelo número de linhas que gera, os produtos e os
+    grupos Rateio_*_N são explodidos e preenchidos por máscara, e os valores em formato
+    brasileiro são convertidos por coluna. Retorna o DataFrame com as `colunas` da planilha.
+    """
+    plano = [_planejar(nota) for nota in notas]
+    quantidades = np.array([quantidade for _, quantidade in plano], dtype=int)
+    total = int(quantidades.sum())
+    if not total or not colunas:
+        return pd.DataFrame(columns=colunas, dtype=object)
+    origens_nota = np.array([origem for origem, _ in plano], dtype=object)
+    nota_da_linha = np.repeat(np.arange(len(notas)), quantidades)
+    # Posição da linha dentro da nota (0, 1, ...)
+    item = np.arange(total) - np.repeat(np.cumsum(quantidades) - quantidades, quantidades)
+    origem = origens_nota[nota_da_linha]
+    rateio = origem == RATEIO
+    produtos = origem == PRODUTOS
+
+    # dtype=object já na construção: sem inferência, 1 continua int (e não 1.0) ao lado de ausentes
+    base = pd.DataFrame(notas, dtype=object)
+
+    def da_nota(nome):
+        # Campo da nota repetido em cada uma das suas linhas
+        if nome not in base.columns:
+            return np.full(total, np.nan, dtype=object)
+        return base[nome].to_numpy()[nota_da_linha]
+
+    novas = {
+        'Produto': np.full(total, '', dtype=object),
+        'Qtde': np.ones(total),
+        'Valor_Unitario': np.full(total, np.nan),
+        'Valor_Total_Produto': np.full(total, np.nan),
+    }
+    for nome in CAMPOS_RATEIO:
+        novas[nome] = da_nota(nome)
+
+    # Rateio: a linha do item N recebe os campos Rateio_*_N da nota
+    if rateio.any():
+        for n in np.unique(item[rateio]) + 1:
+            selecao = rateio & (item == n - 1)
+            notas_selecao = nota_da_linha[selecao]
+            novas['Produto'][selecao] = base[f'Rateio_Produto_{n}'].to_numpy()[notas_selecao]
+            for nome, prefixo in CAMPOS_RATEIO.items():
+                coluna = f'{prefixo}{n}'
+                novas[nome][selecao] = base[coluna].to_numpy()[notas_selecao] if coluna in base.columns else ''
+
+    # Produtos: explode a lista de cada nota, na mesma ordem das linhas
+    if produtos.any():
+        lista = [prod for nota, (orig, _) in zip(notas, plano) if orig == PRODUTOS for prod in _produtos(nota)]
+        qtdes = [prod.get('Qtde', '') for prod in lista]
+        qtdes = [1 if not qtde or str(qtde).strip() == '' else qtde for qtde in qtdes]
+        novas['Produto'][produtos] = [prod.get('Produto', '') for prod in lista]
+        novas['Qtde'][produtos] = _converter(qtdes, _quantidade)
+        novas['Valor_Unitario'][produtos] = _converter([prod.get('Valor_Unitario', '') for prod in lista], _valor_brl)
+        novas['Valor_Total_Produto'][produtos] = _converter(
+            [prod.get('Valor_Total_Produto', '') for prod in lista], _valor_brl)
+
+    # Campos da nota convertidos uma vez por nota, antes de repetir nas linhas
+    valor_total = None
+    if 'Valor_Total' in base.columns:
+        presente = np.array(['Valor_Total' in nota for nota in notas])
+        valor_total = np.where(presente, _converter(base['Valor_Total'].to_numpy(), _valor_brl), np.nan)
+    tipo_rateio = np.array([_tipo_rateio(nota) for nota in notas], dtype=object)
+
+    dados = {}
+    for nome in colunas:
+        if nome in novas:
+            dados[nome] = novas[nome]
+        elif nome == 'Tipo Rateio':
+            dados[nome] = tipo_rateio[nota_da_linha]
+        elif nome == 'Valor_Total' and valor_total is not None:
+            dados[nome] = valor_total[nota_da_linha]
+        else:
+            valores = da_nota(nome)
+            # Os campos Rateio_* não aparecem nas linhas de rateio
+            if nome.startswith('Rateio_'):
+                valores[rateio] = np.nan
+            dados[nome] = valores
+    return pd.DataFrame(dados, columns=colunas)
+
+
+def gerar_tabelas(notas, colunas=None):
+    """
+    Gera os DataFrames da exportação em blocos de EXPORTACAO_NOTAS_POR_BLOCO notas,
+    para que a memória usada não dependa do tamanho da exportação.
+    """
+    if colunas is None:
+        colunas = colunas_exportacao(notas)
+    for inicio in range(0, len(notas), EXPORTACAO_NOTAS_POR_BLOCO):
+        tabela = montar_tabela(notas[inicio:inicio + EXPORTACAO_NOTAS_POR_BLOCO], colunas)
+        if len(tabela):
+            yield tabela
+
+
+def escrever_xlsx(notas, destino):
+    """
+    Escreve a planilha das notas em `destino` (caminho ou arquivo binário) linha a linha.
+    Os temporários do modo constant_memory ficam em um diretório removido ao final,
+    mesmo se a escrita falhar.
+    """
+    colunas = colunas_exportacao(notas)
+    with tempfile.TemporaryDirectory(prefix='exportacao_') as tmpdir:
+        workbook = xlsxwriter.Workbook(destino, {
+            'constant_memory': True,
+            'tmpdir': tmpdir,
+            'strings_to_urls': False,
+        })
+        try:
+            planilha = workbook.add_worksheet('Sheet1')
+            if colunas:
+                # Mesmo estilo de cabeçalho do pandas.DataFrame.to_excel
+                cabecalho = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+                for col, nome in enumerate(colunas):
+                    planilha.write_string(0, col, str(nome), cabecalho)
+                lin = 1
+                for tabela in gerar_tabelas(notas, colunas):
+                    for linha in tabela.itertuples(index=False, name=None):
+                        for col, valor in enumerate(linha):
+                            if valor.__class__ is float:
+                                if valor == valor:
+                                    planilha.write_number(lin, col, valor)
+                            elif valor is not None:
+                                planilha.write(lin, col, valor)
+                        lin += 1
+        finally:
+            workbook.close()
+
+
+def exportar_xlsx(notas):
+    """
+    Gera a planilha em um SpooledTemporaryFile (memória até EXPORTACAO_SPOOL_MAX, disco acima
+    disso, apagado ao fechar) posicionado no início, pronto para ser enviado.
+    """
+    arquivo = tempfile.SpooledTemporaryFile(max_size=EXPORTACAO_SPOOL_MAX, suffix='.xlsx')
+    try:
+        escrever_xlsx(notas, arquivo)
+    except Exception:
+        arquivo.close()
+        raise
+    arquivo.seek(0)
+    return arquivo
+
+
+def gerar_csv(notas):
+    """
+    Gera o CSV da exportação em pedaços de bytes (cabeçalho e depois um pedaço por bloco
+    de notas), para ser enviado enquanto é produzido.
+    """
+    colunas = colunas_exportacao(notas)
+    if not colunas:
+        return
+    cabecalho = io.StringIO()
+    pd.DataFrame(columns=colunas).to_csv(cabecalho, sep=CSV_SEPARADOR, index=False)
+    yield ('\ufeff' + cabecalho.getvalue()).encode('utf-8')
+    for tabela in gerar_tabelas(notas, colunas):
+        yield tabela.to_csv(sep=CSV_SEPARADOR, decimal=CSV_DECIMAL, index=False, header=False).encode('utf-8')
+
+
+def _texto(valor):
+    # Texto da célula no Parquet; ausentes e NaN ficam nulos
+    if valor is None or (isinstance(valor, float) and valor != valor):
+        return None
+    return str(valor)
+
+
+def escrever_parquet(notas, destino):
+    """
+    Escreve as notas em Parquet, um row group por bloco de notas. O esquema é fixo para
+    todos os blocos: colunas numéricas em float64 e as demais em texto.
+    Requer o pyarrow (ImportError se não estiver instalado).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    colunas = colunas_exportacao(notas)
+    esquema = pa.schema([(nome, pa.float64() if nome in COLUNAS_NUMERICAS else pa.string()) for nome in colunas])
+    with pq.ParquetWriter(destino, esquema) as escritor:
+        for tabela in gerar_tabelas(notas, colunas):
+            dados = {}
+            for nome in colunas:
+                valores = tabela[nome].to_numpy()
+                if nome in COLUNAS_NUMERICAS:
+                    dados[nome] = pd.to_numeric(valores, errors='coerce')
+                else:
+                    dados[nome] = [_texto(valor) for valor in valores]
+            escritor.write_table(pa.table(dados, schema=esquema))
+
+
+def exportar_parquet(notas):
+    """
+    Como exportar_xlsx, para o Parquet.
+    """
+    arquivo = tempfile.SpooledTemporaryFile(max_size=EXPORTACAO_SPOOL_MAX, suffix='.parquet')
+    try:
+        escrever_parquet(notas, arquivo)
+    except Exception:
+        arquivo.close()
+        raise
+    arquivo.seek(0)
+    return arquivo
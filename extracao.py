@@ -0,0 +1,173 @@
+import os
+import json
+import Identificador
+import tabular_notas_openai
+import cache_extracao
+import metricas
+from utils import extract_cnpj_fornecedor_cliente, extrair_campos_regex, buscar_filial_por_cnpj, compute_prazo, format_cnpj
+
+# Pipeline de extração de uma nota: leitura do arquivo (texto/OCR), tabulação pela OpenAI
+# e fallback por regex. Usado tanto pela fila em segundo plano quanto pelas rotas do Flask.
+
+PASTA_PRINCIPAL = os.path.dirname(__file__)
+
+
+def nome_base(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def preencher_filial(dado):
+    # Preencher Grupo, Cod Filial e Filial se houver Cnpj_Cliente
+    cnpj_cliente = dado.get('Cnpj_Cliente', '')
+    if cnpj_cliente and (not dado.get('Grupo') or not dado.get('Cod Filial') or not dado.get('Filial')):
+        with metricas.cronometrar('filial'):
+            grupo, cod_filial, filial = buscar_filial_por_cnpj(cnpj_cliente)
+        dado['Grupo'] = grupo or ''
+        dado['Cod Filial'] = cod_filial or ''
+        dado['Filial'] = filial or ''
+    return dado
+
+
+# Função para gerar JSON estruturado via regex (fallback)
+def gerar_json_regex(texto, filename):
+    metricas.contar('leitor_fallback_regex_total')
+    with metricas.cronometrar('regex'):
+        cnpj_fornecedor, cnpj_cliente = extract_cnpj_fornecedor_cliente(texto)
+        # Todos os campos de uma vez: padrões compartilhados são executados uma única vez
+        campos = extrair_campos_regex(texto, ['Data_Emissao', 'Data_Vencimento', 'Numero_Nota', 'Valor_Total', 'Desconto'])
+    # Datas
+    data_emissao = campos['Data_Emissao']
+    data_vencimento = campos['Data_Vencimento']
+    # Prazo
+    prazo = compute_prazo(data_emissao, data_vencimento)
+    # Produtos: pode-se tentar regex mais avançado aqui se desejar
+    produtos = []
+    # Monta JSON apenas com os campos usados no programa
+    cnpj_cliente_formatado = format_cnpj(cnpj_cliente)
+    with metricas.cronometrar('filial'):
+        grupo, cod_filial, filial = buscar_filial_por_cnpj(cnpj_cliente_formatado)
+    return {
+        'Arquivo': filename,
+        'Cnpj_Fornecedor': format_cnpj(cnpj_fornecedor),
+        'Cnpj_Cliente': cnpj_cliente_formatado,
+        'Grupo': grupo or '',
+        'Cod Filial': cod_filial or '',
+        'Filial': filial or '',
+        'Numero_Nota': campos['Numero_Nota'],
+        'Data_Emissao': data_emissao,
+        'Data_Vencimento': data_vencimento,
+        'Prazo': prazo,
+        'Nome_do_Lançador': '',
+        'Valor_Total': campos['Valor_Total'],
+        'Desconto': campos['Desconto'],
+        'Produtos': produtos,  # Sempre retorna o campo Produtos
+        'erro': 'fallback_regex'
+    }
+
+
+def _texto_do_registro(registro):
+    return registro.get('texto_lido', '') or registro.get('Texto_Completo', '') or ''
+
+
+def texto_em_cache(digest):
+    """
+    Texto já lido do arquivo (cache por conteúdo) ou '' se a leitura não chegou a terminar.
+    """
+    registro = cache_extracao.obter(digest, cache_extracao.TIPO_TEXTO)
+    return _texto_do_registro(registro) if registro else ''
+
+
+def extrair_texto(path, filename, digest, ao_progresso_ocr=None):
+    """
+    Lê o texto do arquivo (PDF, imagem, XML) reaproveitando o cache por conteúdo.
+    `ao_progresso_ocr(k, n)` acompanha o OCR página a página.
+    """
+    registro = cache_extracao.obter(digest, cache_extracao.TIPO_TEXTO)
+    metricas.contar('leitor_cache_total', tipo=cache_extracao.TIPO_TEXTO, resultado='miss' if registro is None else 'hit')
+    if registro is None:
+        with metricas.cronometrar('leitura'):
+            registro = Identificador.processar_arquivo_identificador(path, ao_progresso_ocr)
+        if registro.get('texto_lido'):
+            cache_extracao.guardar(digest, cache_extracao.TIPO_TEXTO, registro)
+    registro['arquivo'] = filename
+    return registro
+
+
+def tabular_registro(registro, filename):
+    """
+    Envia o texto lido para a OpenAI e normaliza a resposta no formato usado pela tela
+    de validação. Retorna None se a resposta não trouxer produtos.
+    """
+    resultado_bruto = tabular_notas_openai.tabular_nota(registro, filename)
+    with metricas.cronometrar('limpar_json'):
+        resultado_limpo = tabular_notas_openai.limpar_json_bruto(resultado_bruto)
+        dado = json.loads(resultado_limpo)[0]
+    if not dado or not isinstance(dado, dict):
+        return None
+    # Ajusta Contrato_de_Parceria e produtos
+    produtos = dado.get('Produtos', [])
+    if not isinstance(produtos, list):
+        produtos = [produtos] if produtos else []
+    dado['Produtos'] = produtos
+    dado['Contrato_de_Parceria?'] = 'SIM' if len(produtos) > 1 else 'NÃO'
+    # Preencher automaticamente Grupo, Cod Filial e Filial pelo Cnpj_Cliente
+    with metricas.cronometrar('filial'):
+        grupo, cod_filial, filial = buscar_filial_por_cnpj(dado.get('Cnpj_Cliente', ''))
+    dado['Grupo'] = grupo or ''
+    dado['Cod Filial'] = cod_filial or ''
+    dado['Filial'] = filial or ''
+    # Formata CNPJ
+    for campo in ['Cnpj_Fornecedor', 'Cnpj_Cliente']:
+        dado[campo] = format_cnpj(dado.get(campo, ''))
+    # Se a resposta da OpenAI não trouxer produtos, usa o fallback
+    if not dado.get('Produtos'):
+        return None
+    return dado
+
+
+def processar_nota(path, filename, digest, ao_mudar_estado=None, ao_evento=None):
+    """
+    Executa o pipeline completo de uma nota. `ao_mudar_estado(estado)` é chamado ao fim
+    de cada etapa e `ao_evento(evento, **dados)` nos passos intermediários
+    ('ocr_pagina' com pagina/paginas, 'llm_solicitado'). Retorna (dado, usou_fallback).
+    """
+    with metricas.cronometrar('total'):
+        return _processar_nota(path, filename, digest, ao_mudar_estado, ao_evento)
+
+
+def _processar_nota(path, filename, digest, ao_mudar_estado, ao_evento):
+    def avisar(estado):
+        if ao_mudar_estado:
+            ao_mudar_estado(estado)
+
+    def progresso_ocr(pagina, paginas):
+        if ao_evento:
+            ao_evento('ocr_pagina', pagina=pagina, paginas=paginas)
+
+    registro = extrair_texto(path, filename, digest, progresso_ocr)
+    texto = _texto_do_registro(registro)
+    avisar('text_extracted')
+    if registro.get('dados_estruturados'):
+        # Documentos com esquema fixo (NF-e XML) já vêm mapeados: não há chamada à OpenAI
+        dado = dict(registro['dados_estruturados'], Arquivo=filename)
+        preencher_filial(dado)
+        avisar('llm_done')
+        cache_extracao.guardar(digest, cache_extracao.TIPO_DADOS, dado)
+        return dado, False
+    if ao_evento:
+        ao_evento('llm_solicitado')
+    try:
+        dado = tabular_registro(registro, filename)
+    except Exception as e:
+        print(f'Erro ao tabular {filename} pela OpenAI: {e}')
+        dado = None
+    avisar('llm_done')
+    if dado is None:
+        return gerar_json_regex(texto, filename), True
+    # Salva o JSON tabulado na pasta principal
+    key = nome_base(filename)
+    json_path = os.path.join(PASTA_PRINCIPAL, f"{key}_openai.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(dado, f, ensure_ascii=False, indent=2)
+    cache_extracao.guardar(digest, cache_extracao.TIPO_DADOS, dado)
+    return dado, False
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import extracao
+import cache_extracao
+
+# Fila de extração em segundo plano. Cada arquivo salvo em /notas vira um job identificado
+# pelo SHA-256 do conteúdo, processado por um pool local de threads.
+# Estados: queued -> text_extracted -> llm_done -> ready | failed
+# O estado de cada job fica em disco (um JSON por hash) para ser visível aos dois workers do gunicorn.
+# Jobs prontos são apagados depois de FILA_RETENCAO: o resultado continua no cache de extração.
+# Cada job guarda também a lista de eventos por etapa (recebido, texto_extraido, ocr_pagina,
+# llm_solicitado, llm_concluido, pronto | fallback | falha), transmitida por /progresso.
+FILA_DIR = os.environ.get('FILA_EXTRACAO_DIR', os.path.join(os.path.dirname(__file__), 'fila_extracao'))
+EXTRACAO_WORKERS = int(os.environ.get('EXTRACAO_WORKERS', 2))
+# Jobs sem atualização há mais tempo que isso são considerados abandonados (thread travada); os
+# de um worker que já saiu (morto pelo timeout ou reciclado) são abandonados de imediato
+JOB_TIMEOUT = int(os.environ.get('EXTRACAO_JOB_TIMEOUT', 15 * 60))
+# Tempo que um job pronto fica na fila depois de concluído, para que as conexões de /progresso
+# abertas recebam o evento final; também o intervalo mínimo entre duas limpezas por processo
+FILA_RETENCAO = int(os.environ.get('FILA_EXTRACAO_RETENCAO', 10 * 60))
+
+QUEUED = 'queued'
+TEXT_EXTRACTED = 'text_extracted'
+LLM_DONE = 'llm_done'
+READY = 'ready'
+FAILED = 'failed'
+ESTADOS_FINAIS = (READY, FAILED)
+PROGRESSO = {QUEUED: 0, TEXT_EXTRACTED: 40, LLM_DONE: 80, READY: 100, FAILED: 100}
+# Evento registrado quando o job entra em cada estado (FAILED vira 'fallback' se o regex respondeu)
+EVENTOS_ESTADO = {QUEUED: 'recebido', TEXT_EXTRACTED: 'texto_extraido', LLM_DONE: 'llm_concluido',
+                  READY: 'pronto', FAILED: 'falha'}
+EVENTOS_FINAIS = ('pronto', 'fallback', 'falha')
+
+os.makedirs(FILA_DIR, exist_ok=True)
+
+# Marca de alteração da fila inteira: tocada a cada gravação de job, permite que /progresso
+# verifique um único arquivo por leitura em vez de um por nota
+_CAMINHO_VERSAO_FILA = os.path.join(FILA_DIR, 'versao')
+
+_executor = None
+_executor_lock = threading.Lock()
+_ultima_limpeza = 0.0
+
+
+def _get_executor():
+    # Criado sob demanda para que cada worker do gunicorn tenha o próprio pool após o fork
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXTRACAO_WORKERS, thread_name_prefix='extracao')
+        return _executor
+
+
+def _caminho_job(digest):
+    return os.path.join(FILA_DIR, f'{digest}.json')
+
+
+def estado(digest):
+    """
+    Retorna o registro do job (dict) ou None se o hash nunca foi enfileirado.
+    """
+    try:
+        with open(_caminho_job(digest), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def versao(digest):
+    """
+    Marca de alteração do job (mtime do arquivo em ns) ou None: permite reler só os jobs que mudaram.
+    """
+    try:
+        return os.stat(_caminho_job(digest)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def versao_fila():
+    try:
+        return os.stat(_CAMINHO_VERSAO_FILA).st_mtime_ns
+    except OSError:
+        return None
+
+
+def marcar_alteracao():
+    try:
+        with open(_CAMINHO_VERSAO_FILA, 'a'):
+            pass
+        os.utime(_CAMINHO_VERSAO_FILA, None)
+    except OSError:
+        pass
+
+
+def _novo_evento(evento, **dados):
+    return dict(dados, evento=evento, em=time.time())
+
+
+def _gravar(job):
+    job['atualizado_em'] = time.time()
+    caminho = _caminho_job(job['digest'])
+    tmp = f'{caminho}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(tmp, caminho)
+    marcar_alteracao()
+
+
+def _criar_job(job):
+    # Criação exclusiva: só um worker/processo assume o job de um mesmo hash
+    job['atualizado_em'] = time.time()
+    caminho = _caminho_job(job['digest'])
+    tmp = f'{caminho}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False)
+    try:
+        os.link(tmp, caminho)
+        marcar_alteracao()
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp)
+
+
+def _processo_vivo(pid):
+    if not pid:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Existe, mas pertence a outro usuário
+        return True
+    return True
+
+
+def _abandonado(job):
+    if job['estado'] in ESTADOS_FINAIS:
+        return False
+    return not _processo_vivo(job.get('pid')) or time.time() - job.get('atualizado_em', 0) > JOB_TIMEOUT
+
+
+def enfileirar(path, filename, digest, ao_concluir=None, repetir_falha=False):
+    """
+    Enfileira o arquivo para extração, a menos que já exista job ativo ou concluído
+    para o mesmo conteúdo (jobs com falha são refeitos se `repetir_falha`).
+    `ao_concluir(filename, dado, digest)` é chamado quando a OpenAI devolve um resultado válido.
+    Retorna o registro do job.
+    """
+    existente = estado(digest)
+    if existente and not _abandonado(existente) and not (repetir_falha and existente['estado'] == FAILED):
+        return existente
+    if existente is None:
+        # Job pronto já apagado da fila: o resultado está no cache e não precisa ser refeito
+        dado = cache_extracao.obter(digest, cache_extracao.TIPO_DADOS)
+        if dado:
+            return {'digest': digest, 'arquivo': filename, 'estado': READY,
+                    'progresso': PROGRESSO[READY], 'resultado': dado}
+    if existente:
+        remover(digest)
+    job = {
+        'digest': digest,
+        'arquivo': filename,
+        'estado': QUEUED,
+        'progresso': PROGRESSO[QUEUED],
+        'criado_em': time.time(),
+        'pid': os.getpid(),
+        'eventos': [_novo_evento(EVENTOS_ESTADO[QUEUED])],
+    }
+    if not _criar_job(job):
+        return estado(digest) or job
+    _get_executor().submit(_executar, job, path, ao_concluir)
+    return job
+
+
+def _executar(job, path, ao_concluir):
+    filename = job['arquivo']
+
+    def mudar_estado(novo, evento=None):
+        job['estado'] = novo
+        job['progresso'] = PROGRESSO[novo]
+        job['eventos'].append(_novo_evento(evento or EVENTOS_ESTADO[novo]))
+        _gravar(job)
+
+    def registrar_evento(evento, **dados):
+        job['eventos'].append(_novo_evento(evento, **dados))
+        _gravar(job)
+
+    try:
+        dado, usou_fallback = extracao.processar_nota(path, filename, job['digest'], mudar_estado, registrar_evento)
+        if not usou_fallback and ao_concluir:
+            ao_concluir(filename, dado, job['digest'])
+        job['resultado'] = dado
+        if usou_fallback:
+            mudar_estado(FAILED, 'fallback')
+        else:
+            mudar_estado(READY)
+    except Exception as e:
+        print(f'Erro ao processar {filename}: {e}')
+        job['erro'] = str(e)
+        # Se a leitura chegou a terminar o texto está no cache: o regex ainda tem o que extrair
+        job['resultado'] = extracao.gerar_json_regex(extracao.texto_em_cache(job['digest']), filename)
+        mudar_estado(FAILED)
+    limpar_concluidos()
+
+
+def limpar_concluidos():
+    """
+    Apaga os jobs prontos há mais de FILA_RETENCAO cujo resultado está no cache de extração.
+    Jobs com falha ficam: guardam o resultado do fallback e o erro.
+    """
+    global _ultima_limpeza
+    agora = time.time()
+    with _executor_lock:
+        if agora - _ultima_limpeza < FILA_RETENCAO:
+            return
+        _ultima_limpeza = agora
+    for nome in os.listdir(FILA_DIR):
+        if not nome.endswith('.json'):
+            continue
+        job = estado(nome[:-len('.json')])
+        if (job and job['estado'] == READY and agora - job.get('atualizado_em', agora) > FILA_RETENCAO
+                and cache_extracao.contem(job['digest'], cache_extracao.TIPO_DADOS)):
+            remover(job['digest'])
+
+
+def remover(digest):
+    try:
+        os.remove(_caminho_job(digest))
+    except OSError:
+        pass
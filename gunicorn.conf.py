@@ -0,0 +1,32 @@
+import os
+import threading
+
+# Lido automaticamente pelo gunicorn (./gunicorn.conf.py). As opções do Procfile continuam valendo.
+
+# Com OCR_AQUECER=1 cada worker carrega o motor OCR logo após o fork, em segundo plano,
+# para que a primeira nota digitalizada não pague o tempo de carga dos modelos.
+OCR_AQUECER = os.environ.get('OCR_AQUECER', '0') == '1'
+
+# Workers com threads: cada conexão de /progresso (Server-Sent Events) fica aberta por minutos
+# e, com workers sync, ocuparia um processo inteiro (e seria morta pelo --timeout)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+
+def on_starting(server):
+    # As métricas de /metrics são somadas dos arquivos de cada worker: começa do zero a cada início
+    import metricas
+    metricas.limpar()
+
+
+def child_exit(server, worker):
+    # No master, depois que o worker saiu (inclusive morto por timeout): o arquivo de métricas
+    # dele não é mais somado, senão os contadores seriam contados de novo com o substituto
+    import metricas
+    metricas.descartar_processo(worker.pid)
+
+
+def post_fork(server, worker):
+    if OCR_AQUECER:
+        import motor_ocr
+        threading.Thread(target=motor_ocr.aquecer, daemon=True).start()
@@ -0,0 +1,226 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Controle de vazão das chamadas à OpenAI, compartilhado por tudo que roda no processo
+# (lote da linha de comando e fila de extração do Flask). Dois baldes de tokens, um para
+# requisições/min e outro para tokens/min, mais um limite de chamadas simultâneas.
+# Os limites iniciais vêm do ambiente e são ajustados pelos cabeçalhos x-ratelimit-* das respostas.
+# Cada worker do gunicorn tem o próprio limitador; os cabeçalhos refletem o consumo somado da conta.
+OPENAI_RPM = float(os.environ.get('OPENAI_RPM', 500))
+OPENAI_TPM = float(os.environ.get('OPENAI_TPM', 60000))
+OPENAI_MAX_SIMULTANEAS = int(os.environ.get('OPENAI_MAX_SIMULTANEAS', 4))
+OPENAI_MAX_TENTATIVAS = int(os.environ.get('OPENAI_MAX_TENTATIVAS', 5))
+
+
+@lru_cache(maxsize=None)
+def _codificador(modelo):
+    return tiktoken.encoding_for_model(modelo)
+
+
+def estimar_tokens(texto, modelo):
+    """
+    Estimativa local do número de tokens, sem chamar a API. Usa o tiktoken se estiver
+    instalado; senão ~3 caracteres por token, que superestima textos em português.
+    """
+    if tiktoken is not None:
+        return len(_codificador(modelo).encode(texto))
+    return len(texto) // 3 + 1
+
+
+def _segundos(valor):
+    """
+    Converte as durações dos cabeçalhos da OpenAI ('20ms', '1.5s', '6m0s', '1h2m') em segundos.
+    """
+    if valor is None:
+        return None
+    valor = str(valor).strip()
+    try:
+        return float(valor)
+    except ValueError:
+        pass
+    partes = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', valor)
+    if not partes:
+        return None
+    fatores = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(numero) * fatores[unidade] for numero, unidade in partes)
+
+
+def _sem_cota(erro):
+    # 429 de cota esgotada (billing): ao contrário do limite por minuto, esperar não resolve
+    return 'insufficient_quota' in (getattr(erro, 'code', None), getattr(erro, 'type', None))
+
+
+def _numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+class BaldeTokens:
+    """
+    Balde de tokens com capacidade por minuto, reabastecido continuamente.
+    `adquirir(n)` bloqueia até haver n unidades disponíveis.
+    """
+
+    def __init__(self, por_minuto):
+        self.capacidade = float(por_minuto)
+        self.disponivel = float(por_minuto)
+        self._atualizado = time.monotonic()
+        self._pausado_ate = 0.0
+        self._cond = threading.Condition()
+
+    def _reabastecer(self):
+        agora = time.monotonic()
+        self.disponivel = min(self.capacidade, self.disponivel + (agora - self._atualizado) * self.capacidade / 60)
+        self._atualizado = agora
+
+    def adquirir(self, quantidade=1):
+        # Um pedido maior que o balde inteiro esperaria para sempre: limita à capacidade
+        with self._cond:
+            while True:
+                quantidade_efetiva = min(quantidade, self.capacidade)
+                self._reabastecer()
+                espera = self._pausado_ate - time.monotonic()
+                if espera <= 0:
+                    if self.disponivel >= quantidade_efetiva:
+                        self.disponivel -= quantidade_efetiva
+                        return
+                    espera = (quantidade_efetiva - self.disponivel) * 60 / self.capacidade
+                self._cond.wait(espera)
+
+    def ajustar(self, limite=None, restante=None, reinicio=None):
+        """
+        Ajusta o balde pelo que a API informou: limite por minuto, quanto resta e em quanto
+        tempo o saldo volta ao limite.
+        """
+        with self._cond:
+            self._reabastecer()
+            if limite:
+                self.capacidade = float(limite)
+            if restante is not None:
+                self.disponivel = min(self.disponivel, float(restante))
+                if restante <= 0 and reinicio:
+                    self._pausado_ate = max(self._pausado_ate, time.monotonic() + reinicio)
+            self._cond.notify_all()
+
+    def pausar(self, segundos):
+        # Resposta 429: ninguém consome até o fim da espera pedida pela API
+        with self._cond:
+            self._reabastecer()
+            self.disponivel = 0.0
+            self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos)
+            self._cond.notify_all()
+
+
+class LimitadorOpenAI:
+    """
+    Combina os baldes de requisições e de tokens com um semáforo de chamadas simultâneas.
+    """
+
+    def __init__(self, rpm=OPENAI_RPM, tpm=OPENAI_TPM, max_simultaneas=OPENAI_MAX_SIMULTANEAS):
+        self.requisicoes = BaldeTokens(rpm)
+        self.tokens = BaldeTokens(tpm)
+        self.max_simultaneas = max_simultaneas
+        self._semaforo = threading.BoundedSemaphore(max_simultaneas)
+        self._lock = threading.Lock()
+        self._estatisticas = {'chamadas': 0, 'rate_limit_429': 0, 'tentativas_repetidas': 0,
+                              'espera_total': 0.0, 'em_andamento': 0}
+
+    def _contar(self, campo, valor=1):
+        with self._lock:
+            self._estatisticas[campo] += valor
+
+    def atualizar(self, cabecalhos):
+        if not cabecalhos:
+            return
+        for balde, sufixo in ((self.requisicoes, 'requests'), (self.tokens, 'tokens')):
+            balde.ajustar(
+                limite=_numero(cabecalhos.get(f'x-ratelimit-limit-{sufixo}')),
+                restante=_numero(cabecalhos.get(f'x-ratelimit-remaining-{sufixo}')),
+                reinicio=_segundos(cabecalhos.get(f'x-ratelimit-reset-{sufixo}')),
+            )
+
+    def chamar(self, funcao, tokens_estimados):
+        """
+        Executa `funcao()` respeitando os limites. `funcao` deve retornar (resultado, cabeçalhos).
+        Respostas 429, timeouts e erros 5xx são repetidos com espera crescente
+        (ou a indicada em retry-after) até OPENAI_MAX_TENTATIVAS. Cota esgotada
+        (insufficient_quota) é levantada na primeira vez.
+        """
+        import openai
+        tentativa = 0
+        while True:
+            tentativa += 1
+            espera_erro = 0
+            inicio = time.perf_counter()
+            with self._semaforo:
+                self.requisicoes.adquirir(1)
+                self.tokens.adquirir(tokens_estimados)
+                self._contar('espera_total', time.perf_counter() - inicio)
+                self._contar('em_andamento')
+                try:
+                    resultado, cabecalhos = funcao()
+                    self._contar('chamadas')
+                    self.atualizar(cabecalhos)
+                    return resultado
+                except (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                        openai.InternalServerError) as e:
+                    cabecalhos = getattr(getattr(e, 'response', None), 'headers', None)
+                    if isinstance(e, openai.RateLimitError):
+                        self._contar('rate_limit_429')
+                    if tentativa >= OPENAI_MAX_TENTATIVAS or _sem_cota(e):
+                        raise
+                    espera = _segundos((cabecalhos or {}).get('retry-after')) or min(2 ** tentativa, 30)
+                    self.atualizar(cabecalhos)
+                    if isinstance(e, openai.RateLimitError):
+                        self.requisicoes.pausar(espera)
+                        self.tokens.pausar(espera)
+                    else:
+                        espera_erro = espera
+                    self._contar('tentativas_repetidas')
+                finally:
+                    self._contar('em_andamento', -1)
+            # Fora do semáforo: a espera de um erro transitório não ocupa a vaga de outra chamada
+            if espera_erro:
+                time.sleep(espera_erro)
+
+    def mapear(self, funcao, itens):
+        """
+        Aplica `funcao` a cada item em paralelo (até max_simultaneas em voo) e retorna os
+        resultados na ordem dos itens. Os limites ficam a cargo de `chamar`, dentro de `funcao`.
+        """
+        itens = list(itens)
+        if len(itens) <= 1:
+            return [funcao(item) for item in itens]
+        with ThreadPoolExecutor(max_workers=min(self.max_simultaneas, len(itens)), thread_name_prefix='openai') as executor:
+            return list(executor.map(funcao, itens))
+
+    def estatisticas(self):
+        with self._lock:
+            dados = dict(self._estatisticas)
+        dados['rpm'] = self.requisicoes.capacidade
+        dados['tpm'] = self.tokens.capacidade
+        dados['max_simultaneas'] = self.max_simultaneas
+        return dados
+
+
+_limitador = None
+_lock_limitador = threading.Lock()
+
+
+def get_limitador():
+    global _limitador
+    with _lock_limitador:
+        if _limitador is None:
+            _limitador = LimitadorOpenAI()
+        return _limitador
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+# Métricas de latência por etapa e contadores do processamento das notas, expostas em
+# /metrics no formato texto do Prometheus. Cada processo acumula as métricas em memória e
+# as grava periodicamente em METRICAS_DIR/<pid>.json; o /metrics soma os arquivos de todos
+# os processos, então qualquer worker do gunicorn responde pelo conjunto.
+# Só o servidor grava (habilitar_gravacao, chamado pelo app.py): linha de comando, benchmarks
+# e testes acumulam apenas em memória. O arquivo de um worker encerrado é apagado pelo master
+# (child_exit em gunicorn.conf.py), todos são descartados no início do servidor (on_starting)
+# e os de processos que já não existem (servidor de desenvolvimento) são apagados ao somar.
+METRICAS_DIR = os.environ.get('METRICAS_DIR', os.path.join(os.path.dirname(__file__), 'metricas'))
+# Intervalo máximo, em segundos, entre uma observação e a gravação em disco
+METRICAS_INTERVALO = float(os.environ.get('METRICAS_INTERVALO', 2))
+
+# Limites dos baldes dos histogramas, em segundos (do regex em ms até OCR/OpenAI em minutos)
+BALDES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Histogramas que não medem tempo: nome -> baldes próprios
+BALDES_POR_NOME = {
+    'leitor_reducao_razao': (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+}
+
+# nome -> (tipo, ajuda)
+DESCRICOES = {
+    'leitor_etapa_segundos': ('histogram', 'Duração de cada etapa do processamento das notas'),
+    'leitor_http_segundos': ('histogram', 'Duração das requisições HTTP por rota'),
+    'leitor_cache_total': ('counter', 'Consultas ao cache de extração por tipo e resultado (hit/miss)'),
+    'leitor_fallback_regex_total': ('counter', 'Notas extraídas pelo fallback de regex (erro: fallback_regex)'),
+    'leitor_openai_chamadas_total': ('counter', 'Chamadas à OpenAI por resultado'),
+    'leitor_openai_tokens_total': ('counter', 'Tokens informados pela OpenAI (prompt/completion)'),
+    'leitor_reducao_razao': ('histogram', 'Fração dos tokens do texto de cada nota removida pela redução'),
+    'leitor_documentos_total': ('counter', 'Documentos lidos por tipo detectado'),
+    'leitor_paginas_ocr_total': ('counter', 'Páginas de PDF enviadas ao OCR'),
+}
+
+_lock = threading.Lock()
+_gravacao_habilitada = False
+_pid = None
+_contadores = {}
+_histogramas = {}
+_alterado = False
+_gravador = None
+
+
+def habilitar_gravacao():
+    global _gravacao_habilitada
+    os.makedirs(METRICAS_DIR, exist_ok=True)
+    _gravacao_habilitada = True
+
+
+def _baldes(nome):
+    return BALDES_POR_NOME.get(nome, BALDES)
+
+
+def _chave(nome, rotulos):
+    return nome, tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+
+
+def _verificar_processo():
+    # Após um fork o processo filho começa do zero e grava no próprio arquivo
+    global _pid, _contadores, _histogramas, _alterado, _gravador
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _contadores = {}
+        _histogramas = {}
+        _alterado = False
+        _gravador = None
+
+
+def _agendar_gravacao():
+    global _alterado, _gravador
+    _alterado = True
+    if _gravador is None and _gravacao_habilitada:
+        _gravador = threading.Thread(target=_gravar_periodicamente, name='metricas', daemon=True)
+        _gravador.start()
+
+
+def _gravar_periodicamente():
+    while True:
+        time.sleep(METRICAS_INTERVALO)
+        gravar()
+
+
+def contar(nome, valor=1, **rotulos):
+    with _lock:
+        _verificar_processo()
+        chave = _chave(nome, rotulos)
+        _contadores[chave] = _contadores.get(chave, 0) + valor
+        _agendar_gravacao()
+
+
+def observar(nome, valor, **rotulos):
+    with _lock:
+        _verificar_processo()
+        chave = _chave(nome, rotulos)
+        baldes = _baldes(nome)
+        histograma = _histogramas.get(chave)
+        if histograma is None:
+            histograma = _histogramas[chave] = {'baldes': [0] * len(baldes), 'soma': 0.0, 'contagem': 0}
+        for i, limite in enumerate(baldes):
+            if valor <= limite:
+                histograma['baldes'][i] += 1
+                break
+        histograma['soma'] += valor
+        histograma['contagem'] += 1
+        _agendar_gravacao()
+
+
+@contextmanager
+def cronometrar(etapa, nome='leitor_etapa_segundos', **rotulos):
+    """
+    Mede o bloco e registra a duração no histograma `nome` com o rótulo etapa=`etapa`.
+    A duração é registrada mesmo se o bloco levantar exceção.
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar(nome, time.perf_counter() - inicio, etapa=etapa, **rotulos)
+
+
+def _caminho_processo(pid):
+    return os.path.join(METRICAS_DIR, f'{pid}.json')
+
+
+def _instantaneo():
+    # Chamado com _lock: cópia serializável das métricas do processo
+    return {
+        'contadores': [[nome, dict(rotulos), valor] for (nome, rotulos), valor in _contadores.items()],
+        'histogramas': [[nome, dict(rotulos), list(h['baldes']), h['soma'], h['contagem']]
+                        for (nome, rotulos), h in _histogramas.items()],
+    }
+
+
+def gravar():
+    """
+    Grava as métricas do processo em METRICAS_DIR/<pid>.json (arquivo temporário + rename).
+    """
+    global _alterado
+    with _lock:
+        _verificar_processo()
+        if not _alterado or not _gravacao_habilitada:
+            return
+        dados = _instantaneo()
+        _alterado = False
+    caminho = _caminho_processo(os.getpid())
+    tmp = f'{caminho}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(dados, f)
+        os.replace(tmp, caminho)
+    except OSError as e:
+        print(f'Erro ao gravar métricas: {e}')
+
+
+atexit.register(gravar)
+
+
+def limpar():
+    # Chamado no início do servidor: descarta os arquivos da execução anterior
+    if not os.path.isdir(METRICAS_DIR):
+        return
+    for nome in os.listdir(METRICAS_DIR):
+        try:
+            os.remove(os.path.join(METRICAS_DIR, nome))
+        except OSError:
+            pass
+
+
+def descartar_processo(pid):
+    # Chamado pelo master quando um worker termina: suas métricas deixam de ser somadas
+    try:
+        os.remove(_caminho_processo(pid))
+    except OSError:
+        pass
+
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Existe, mas pertence a outro usuário
+        return True
+    return True
+
+
+def _dados_processos():
+    if not _gravacao_habilitada:
+        # Fora do servidor: só o que este processo acumulou
+        with _lock:
+            _verificar_processo()
+            return [_instantaneo()]
+    todos = []
+    for arquivo in os.listdir(METRICAS_DIR):
+        pid, extensao = os.path.splitext(arquivo)
+        if extensao != '.json' or not pid.isdigit():
+            continue
+        if not _processo_vivo(int(pid)):
+            # Processo encerrado sem passar pelo child_exit (ex.: python app.py anterior)
+            descartar_processo(int(pid))
+            continue
+        try:
+            with open(os.path.join(METRICAS_DIR, arquivo), 'r', encoding='utf-8') as f:
+                todos.append(json.load(f))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return todos
+
+
+def _somar_processos():
+    contadores = {}
+    histogramas = {}
+    for dados in _dados_processos():
+        for nome, rotulos, valor in dados.get('contadores', []):
+            chave = _chave(nome, rotulos)
+            contadores[chave] = contadores.get(chave, 0) + valor
+        for nome, rotulos, baldes, soma, contagem in dados.get('histogramas', []):
+            chave = _chave(nome, rotulos)
+            atual = histogramas.setdefault(chave, {'baldes': [0] * len(_baldes(nome)), 'soma': 0.0, 'contagem': 0})
+            atual['baldes'] = [a + b for a, b in zip(atual['baldes'], baldes)]
+            atual['soma'] += soma
+            atual['contagem'] += contagem
+    return contadores, histogramas
+
+
+def _escapar(valor):
+    return valor.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _rotulos(rotulos, *extras):
+    pares = list(rotulos) + list(extras)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{k}="{_escapar(v)}"' for k, v in pares) + '}'
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exportar_prometheus():
+    """
+    Texto no formato de exposição do Prometheus com as métricas somadas de todos os processos.
+    """
+    gravar()
+    contadores, histogramas = _somar_processos()
+    por_nome = {}
+    for (nome, rotulos), valor in contadores.items():
+        por_nome.setdefault(nome, []).append((rotulos, valor))
+    for (nome, rotulos), h in histogramas.items():
+        por_nome.setdefault(nome, []).append((rotulos, h))
+    linhas = []
+    for nome in sorted(por_nome):
+        tipo, ajuda = DESCRICOES.get(nome, ('untyped', ''))
+        linhas.append(f'# HELP {nome} {ajuda}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for rotulos, valor in sorted(por_nome[nome], key=lambda item: item[0]):
+            if not isinstance(valor, dict):
+                linhas.append(f'{nome}{_rotulos(rotulos)} {_numero(valor)}')
+                continue
+            acumulado = 0
+            for limite, quantidade in zip(_baldes(nome), valor['baldes']):
+                acumulado += quantidade
+                linhas.append(f'{nome}_bucket{_rotulos(rotulos, ("le", _numero(float(limite))))} {acumulado}')
+            linhas.append(f'{nome}_bucket{_rotulos(rotulos, ("le", "+Inf"))} {valor["contagem"]}')
+            linhas.append(f'{nome}_sum{_rotulos(rotulos)} {_numero(valor["soma"])}')
+            linhas.append(f'{nome}_count{_rotulos(rotulos)} {valor["contagem"]}')
+    return '\n'.join(linhas) + '\n'
@@ -0,0 +1,75 @@
+import os
+import time
+import threading
+
+# Motor de OCR do processo: o easyocr.Reader é carregado uma única vez por processo
+# (sob demanda ou no post_fork do gunicorn) e reaproveitado entre requisições.
+OCR_IDIOMAS = os.environ.get('OCR_IDIOMAS', 'pt').split(',')
+OCR_GPU = os.environ.get('OCR_GPU', '0') == '1'
+
+_leitor = None
+_pid_leitor = None
+_lock_carga = threading.Lock()
+# O Reader (torch) não é garantidamente thread-safe: uma inferência por vez no processo
+_lock_inferencia = threading.Lock()
+
+_estatisticas = {
+    'tempo_carga': None,
+    'chamadas': 0,
+    'tempo_inferencia_total': 0.0,
+    'tempo_inferencia_ultima': None,
+}
+
+
+def get_leitor():
+    """
+    Retorna o easyocr.Reader do processo atual, carregando os modelos na primeira chamada.
+    Um processo filho criado por fork não reaproveita o leitor do pai.
+    """
+    global _leitor, _pid_leitor
+    if _leitor is not None and _pid_leitor == os.getpid():
+        return _leitor
+    with _lock_carga:
+        if _leitor is None or _pid_leitor != os.getpid():
+            import easyocr
+            inicio = time.perf_counter()
+            _leitor = easyocr.Reader(OCR_IDIOMAS, gpu=OCR_GPU)
+            _pid_leitor = os.getpid()
+            _estatisticas['tempo_carga'] = time.perf_counter() - inicio
+            print(f"Motor OCR carregado em {_estatisticas['tempo_carga']:.2f}s (pid {_pid_leitor})")
+    return _leitor
+
+
+def aquecer():
+    # Carrega os modelos antecipadamente (post_fork do gunicorn, inicializador do pool de OCR)
+    try:
+        get_leitor()
+    except Exception as e:
+        print(f'Erro ao carregar o motor OCR: {e}')
+
+
+def ler_texto(imagem):
+    """
+    Executa o OCR de uma imagem (caminho ou array numpy) e retorna o texto em parágrafos.
+    """
+    leitor = get_leitor()
+    with _lock_inferencia:
+        inicio = time.perf_counter()
+        resultado = leitor.readtext(imagem, detail=0, paragraph=True)
+        duracao = time.perf_counter() - inicio
+        _estatisticas['chamadas'] += 1
+        _estatisticas['tempo_inferencia_total'] += duracao
+        _estatisticas['tempo_inferencia_ultima'] = duracao
+    return '\n'.join(resultado)
+
+
+def estatisticas():
+    """
+    Tempo de carga dos modelos e tempos de inferência acumulados no processo atual.
+    """
+    dados = dict(_estatisticas)
+    dados['pid'] = os.getpid()
+    dados['carregado'] = _leitor is not None and _pid_leitor == os.getpid()
+    chamadas = dados['chamadas']
+    dados['tempo_inferencia_medio'] = dados['tempo_inferencia_total'] / chamadas if chamadas else None
+    return dados
@@ -0,0 +1,362 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import zipfile
+import threading
+from contextlib import contextmanager
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Epilogue, NeedData
+import cache_extracao
+
+# Recebimento dos uploads em /notas, sem passar pelo request.files do Flask (que guarda o
+# formulário inteiro antes da view começar):
+#   - o corpo multipart é lido em blocos e cada arquivo é gravado e tem o SHA-256 calculado
+#     à medida que os bytes chegam;
+#   - arquivos .zip são expandidos no servidor, entrada por entrada, e cada nota é entregue
+#     a `ao_salvar` (que a enfileira) assim que é extraída, sem esperar o resto do pacote;
+#   - uploads grandes podem ser enviados em partes (PUT com Content-Range) e retomados do
+#     ponto em que pararam após uma queda de conexão.
+# Os arquivos em trânsito e as partes ficam em UPLOAD_PARCIAIS_DIR (relativo como o
+# UPLOAD_FOLDER do app, para que o rename final fique no mesmo sistema de arquivos).
+UPLOAD_PARCIAIS_DIR = os.environ.get('UPLOAD_PARCIAIS_DIR', 'uploads_parciais')
+# Tamanho máximo de um arquivo enviado (inclusive .zip)
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 1024 * 1024 * 1024))
+# Limites da expansão de .zip, verificados sobre os bytes descomprimidos (não sobre o cabeçalho)
+ZIP_ENTRADA_MAX_BYTES = int(os.environ.get('ZIP_ENTRADA_MAX_BYTES', 100 * 1024 * 1024))
+ZIP_MAX_ENTRADAS = int(os.environ.get('ZIP_MAX_ENTRADAS', 5000))
+# Soma dos bytes descomprimidos do pacote: muitas entradas logo abaixo do limite individual
+# ainda encheriam o disco
+ZIP_TOTAL_MAX_BYTES = int(os.environ.get('ZIP_TOTAL_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+# Uploads em partes sem atividade há mais tempo que isso são descartados
+UPLOAD_PARCIAL_VALIDADE = int(os.environ.get('UPLOAD_PARCIAL_VALIDADE', 24 * 60 * 60))
+# Uma trava de upload em partes mais antiga que isso é de uma requisição que não terminou
+TRAVA_VALIDADE = 5 * 60
+TAMANHO_BLOCO = cache_extracao.TAMANHO_BLOCO
+
+# Extensões extraídas de um .zip; o restante (Thumbs.db, __MACOSX, planilhas) é ignorado
+EXTENSOES_NOTAS = ('.pdf', '.xml', '.jpg', '.jpeg', '.png')
+ID_PARCIAL = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+os.makedirs(UPLOAD_PARCIAIS_DIR, exist_ok=True)
+
+_lock = threading.Lock()
+# id do upload em partes -> (bytes já somados ao hash, objeto sha256), evita reler a parte
+# gravada a cada bloco. Outro worker (ou um reinício) recalcula a partir do disco.
+_hashes_parciais = {}
+
+
+class UploadInvalido(Exception):
+    status = 400
+
+
+class UploadMuitoGrande(UploadInvalido):
+    status = 413
+
+
+class PosicaoIncorreta(UploadInvalido):
+    # A parte não começa onde o servidor parou (ou outra requisição está gravando o mesmo upload)
+    status = 409
+
+    def __init__(self, mensagem, recebido):
+        super().__init__(mensagem)
+        self.recebido = recebido
+
+
+def nome_seguro(nome):
+    """
+    Nome do arquivo sem diretórios (do cliente ou de dentro do .zip), para não gravar fora da pasta.
+    """
+    nome = os.path.basename((nome or '').replace('\\', '/')).strip()
+    if nome in ('', '.', '..') or nome.startswith('.'):
+        raise UploadInvalido(f'Nome de arquivo inválido: {nome!r}')
+    return nome
+
+
+def eh_zip(nome):
+    return nome.lower().endswith('.zip')
+
+
+def _caminho_temporario():
+    return os.path.join(UPLOAD_PARCIAIS_DIR, f'{uuid.uuid4().hex}.tmp')
+
+
+def gravar_blocos(blocos, caminho, limite=UPLOAD_MAX_BYTES, sha=None, modo='wb'):
+    """
+    Grava os blocos em `caminho` calculando o SHA-256 enquanto escreve. Retorna (bytes gravados, sha).
+    Passa de `limite` -> UploadMuitoGrande (o arquivo parcial fica para quem chamou remover).
+    """
+    sha = sha or hashlib.sha256()
+    tamanho = os.path.getsize(caminho) if modo == 'ab' and os.path.exists(caminho) else 0
+    with open(caminho, modo) as destino:
+        for bloco in blocos:
+            tamanho += len(bloco)
+            if tamanho > limite:
+                raise UploadMuitoGrande(f'Arquivo maior que o limite de {limite} bytes')
+            sha.update(bloco)
+            destino.write(bloco)
+    return tamanho, sha
+
+
+def _blocos_da_parte(blocos, tamanho_parte):
+    # O corpo não pode passar do intervalo declarado no Content-Range (menor é conexão interrompida)
+    recebidos = 0
+    for bloco in blocos:
+        recebidos += len(bloco)
+        if recebidos > tamanho_parte:
+            raise UploadInvalido(f'O corpo da parte passa dos {tamanho_parte} bytes do Content-Range')
+        yield bloco
+
+
+def _remover(caminho):
+    try:
+        os.remove(caminho)
+    except OSError:
+        pass
+
+
+def _blocos_stream(stream, tamanho=TAMANHO_BLOCO):
+    return iter(lambda: stream.read(tamanho), b'')
+
+
+def registrar(caminho, nome, digest, pasta, ao_salvar):
+    """
+    Move o arquivo recebido para a pasta de uploads e chama `ao_salvar(nome, caminho, digest)`.
+    Um .zip é expandido (e apagado) no lugar. Retorna a lista de nomes gravados.
+    """
+    if eh_zip(nome):
+        try:
+            return expandir_zip(caminho, pasta, ao_salvar)
+        finally:
+            _remover(caminho)
+    destino = os.path.join(pasta, nome)
+    os.replace(caminho, destino)
+    cache_extracao.registrar_hash_arquivo(destino, digest)
+    ao_salvar(nome, destino, digest)
+    return [nome]
+
+
+def expandir_zip(caminho_zip, pasta, ao_salvar):
+    """
+    Descomprime as notas do .zip uma a uma, em blocos, e entrega cada uma a `ao_salvar`
+    logo após gravá-la; o processamento das primeiras começa enquanto o resto é extraído.
+    O diretório central do zip fica no fim do arquivo, por isso o pacote precisa estar todo
+    em disco antes da primeira entrada.
+    Passando de ZIP_TOTAL_MAX_BYTES descomprimidos o pacote é recusado e as notas já
+    extraídas dele são apagadas.
+    """
+    try:
+        arquivo_zip = zipfile.ZipFile(caminho_zip)
+    except zipfile.BadZipFile:
+        raise UploadInvalido('Arquivo .zip inválido ou incompleto')
+    salvos = []
+    total = 0
+    with arquivo_zip:
+        entradas = [info for info in arquivo_zip.infolist() if not info.is_dir()]
+        if len(entradas) > ZIP_MAX_ENTRADAS:
+            raise UploadInvalido(f'O .zip tem {len(entradas)} arquivos (máximo {ZIP_MAX_ENTRADAS})')
+        for info in entradas:
+            partes = info.filename.replace('\\', '/').split('/')
+            nome = partes[-1]
+            if '__MACOSX' in partes or nome.startswith('.') or not nome.lower().endswith(EXTENSOES_NOTAS):
+                continue
+            # Pastas diferentes do zip com o mesmo nome de arquivo: "nota (2).pdf"
+            base, extensao = os.path.splitext(nome)
+            sufixo = 2
+            while nome in salvos:
+                nome = f'{base} ({sufixo}){extensao}'
+                sufixo += 1
+            tmp = _caminho_temporario()
+            limite = min(ZIP_ENTRADA_MAX_BYTES, ZIP_TOTAL_MAX_BYTES - total)
+            try:
+                with arquivo_zip.open(info) as entrada:
+                    tamanho, sha = gravar_blocos(_blocos_stream(entrada), tmp, limite)
+                total += tamanho
+                salvos.extend(registrar(tmp, nome, sha.hexdigest(), pasta, ao_salvar))
+            except UploadMuitoGrande as e:
+                _remover(tmp)
+                if limite < ZIP_ENTRADA_MAX_BYTES:
+                    for salvo in salvos:
+                        _remover(os.path.join(pasta, salvo))
+                    raise UploadMuitoGrande(f'O .zip descomprimido passa de {ZIP_TOTAL_MAX_BYTES} bytes')
+                # Os bytes descomprimidos da entrada recusada também contam para o total
+                total += limite
+                print(f'Entrada {info.filename} do zip ignorada: {e}')
+            except (RuntimeError, NotImplementedError, zipfile.BadZipFile, OSError) as e:
+                # Entrada criptografada ou corrompida: segue com as demais
+                print(f'Entrada {info.filename} do zip ignorada: {e}')
+                _remover(tmp)
+    return salvos
+
+
+def _eventos_multipart(stream, boundary):
+    decoder = MultipartDecoder(boundary)
+    while True:
+        try:
+            evento = decoder.next_event()
+        except ValueError as e:
+            raise UploadInvalido(f'Formulário multipart inválido: {e}')
+        if isinstance(evento, NeedData):
+            bloco = stream.read(TAMANHO_BLOCO)
+            decoder.receive_data(bloco or None)
+        elif isinstance(evento, Epilogue):
+            return
+        else:
+            yield evento
+
+
+def partes_multipart(stream, boundary, campo='files'):
+    """
+    Percorre o corpo multipart sem guardá-lo: gera (nome do arquivo, iterador dos blocos)
+    para cada arquivo do `campo`. Os blocos não consumidos são descartados ao avançar.
+    """
+    eventos = _eventos_multipart(stream, boundary)
+    for evento in eventos:
+        # Preâmbulo e dados soltos não abrem uma parte
+        if not isinstance(evento, (Field, File)):
+            continue
+
+        def blocos():
+            for dado in eventos:
+                yield dado.data
+                if not dado.more_data:
+                    return
+
+        conteudo = blocos()
+        if isinstance(evento, File) and evento.name == campo and evento.filename:
+            yield evento.filename, conteudo
+        for _ in conteudo:
+            pass
+
+
+def receber_formulario(stream, boundary, pasta, ao_salvar):
+    """
+    Grava os arquivos do formulário multipart (campo 'files') em `pasta` à medida que chegam.
+    Retorna a lista de nomes gravados (as notas extraídas, no caso de .zip).
+    """
+    salvos = []
+    for nome, blocos in partes_multipart(stream, boundary):
+        nome = nome_seguro(nome)
+        tmp = _caminho_temporario()
+        try:
+            _, sha = gravar_blocos(blocos, tmp)
+            salvos.extend(registrar(tmp, nome, sha.hexdigest(), pasta, ao_salvar))
+        finally:
+            _remover(tmp)
+    return salvos
+
+
+def _caminhos_parcial(upload_id):
+    base = os.path.join(UPLOAD_PARCIAIS_DIR, upload_id)
+    return base + '.parcial', base + '.json', base + '.trava'
+
+
+def _validar_id(upload_id):
+    if not ID_PARCIAL.match(upload_id or ''):
+        raise UploadInvalido('Identificador de upload inválido (8 a 64 letras, números, _ ou -)')
+
+
+def recebido(upload_id):
+    """
+    Quantos bytes do upload em partes o servidor já tem (0 se desconhecido): o cliente retoma daí.
+    """
+    _validar_id(upload_id)
+    try:
+        return os.path.getsize(_caminhos_parcial(upload_id)[0])
+    except OSError:
+        return 0
+
+
+@contextmanager
+def _travar(upload_id):
+    # Trava entre processos: uma repetição do cliente não grava por cima de uma parte em andamento
+    trava = _caminhos_parcial(upload_id)[2]
+    try:
+        descritor = os.open(trava, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            antiga = time.time() - os.path.getmtime(trava) > TRAVA_VALIDADE
+        except OSError:
+            antiga = True
+        if not antiga:
+            raise PosicaoIncorreta('Outra parte deste upload está sendo gravada', recebido(upload_id))
+        _remover(trava)
+        descritor = os.open(trava, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    os.close(descritor)
+    try:
+        yield
+    finally:
+        _remover(trava)
+
+
+def limpar_parciais():
+    # Descarta uploads em partes abandonados (e temporários de requisições interrompidas)
+    limite = time.time() - UPLOAD_PARCIAL_VALIDADE
+    for nome in os.listdir(UPLOAD_PARCIAIS_DIR):
+        caminho = os.path.join(UPLOAD_PARCIAIS_DIR, nome)
+        try:
+            if os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+        except OSError:
+            pass
+
+
+def receber_parte(upload_id, nome, content_range, stream, pasta, ao_salvar):
+    """
+    Acrescenta uma parte (Content-Range: bytes inicio-fim/total) ao upload `upload_id`.
+    Retorna {'recebido': n} ou, com a última parte, também {'files': [...]} após registrar o arquivo.
+    Uma parte fora de posição levanta PosicaoIncorreta com o total já recebido.
+    """
+    _validar_id(upload_id)
+    encontrado = CONTENT_RANGE.match(content_range or '')
+    if not encontrado:
+        raise UploadInvalido('Cabeçalho Content-Range ausente ou inválido (bytes inicio-fim/total)')
+    inicio, fim, total = (int(valor) for valor in encontrado.groups())
+    if fim < inicio or fim >= total:
+        raise UploadInvalido(f'Content-Range inconsistente: {content_range}')
+    if total > UPLOAD_MAX_BYTES:
+        raise UploadMuitoGrande(f'Arquivo maior que o limite de {UPLOAD_MAX_BYTES} bytes')
+    caminho, caminho_meta, _ = _caminhos_parcial(upload_id)
+    with _travar(upload_id):
+        try:
+            with open(caminho_meta, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            limpar_parciais()
+            meta = {'nome': nome_seguro(nome), 'total': total, 'criado_em': time.time()}
+            with open(caminho_meta, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            _remover(caminho)
+        if meta['total'] != total:
+            raise UploadInvalido(f"Tamanho total diferente do informado no início ({meta['total']})")
+        atual = recebido(upload_id)
+        if inicio != atual:
+            raise PosicaoIncorreta(f'A parte começa em {inicio}, mas o servidor tem {atual} bytes', atual)
+
+        with _lock:
+            estado = _hashes_parciais.pop(upload_id, None)
+        if estado is None or estado[0] != atual:
+            # Parte anterior recebida por outro worker: refaz o hash do que já está em disco
+            sha = hashlib.sha256()
+            if atual:
+                with open(caminho, 'rb') as f:
+                    for bloco in _blocos_stream(f):
+                        sha.update(bloco)
+        else:
+            sha = estado[1]
+        blocos = _blocos_da_parte(_blocos_stream(stream), fim - inicio + 1)
+        try:
+            tamanho, sha = gravar_blocos(blocos, caminho, total, sha, modo='ab')
+        except UploadInvalido:
+            # Descarta o que a parte rejeitada chegou a gravar: o cliente reenvia a partir de `inicio`
+            if os.path.exists(caminho):
+                os.truncate(caminho, inicio)
+            raise
+        if tamanho < total:
+            with _lock:
+                _hashes_parciais[upload_id] = (tamanho, sha)
+            return {'recebido': tamanho}
+        _remover(caminho_meta)
+        return {'recebido': tamanho, 'files': registrar(caminho, meta['nome'], sha.hexdigest(), pasta, ao_salvar)}
@@ -0,0 +1,172 @@
+import os
+import re
+import unicodedata
+
+# Redução do texto lido antes de enviá-lo à OpenAI. Em XML remove a assinatura, namespaces
+# e marcação, deixando "tag: valor". Em texto (DANFE, boletos, OCR) pontua cada linha pela
+# relevância (CNPJs, datas, valores, linhas de produto, rótulos dos campos), descarta canhoto,
+# boilerplate legal e a cauda de informações complementares, e corta as linhas menos
+# relevantes até caber em PROMPT_MAX_TOKENS_TEXTO.
+PROMPT_MAX_TOKENS_TEXTO = int(os.environ.get('PROMPT_MAX_TOKENS_TEXTO', 2500))
+
+RE_CNPJ = re.compile(r'\b\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}\b|\b\d{3}\.\d{3}\.\d{3}-\d{2}\b')
+RE_DATA = re.compile(r'\b\d{2}[./-]\d{2}[./-]\d{2,4}\b')
+RE_VALOR = re.compile(r'\b\d{1,3}(?:\.\d{3})*,\d{2,4}\b')
+RE_NUMERO = re.compile(r'\b\d+(?:[.,]\d+)*\b')
+RE_ESPACOS = re.compile(r'[ \t\xa0]+')
+
+# Rótulos dos campos pedidos no prompt (comparados sem acentos e em minúsculas)
+RE_ROTULOS = re.compile(
+    r'emitente|destinat|tomador|prestador|fornecedor|cliente|sacado|cnpj|cpf|'
+    r'emissao|vencimento|fatura|duplicata|parcela|pagamento|prazo|'
+    r'\bn[o°º]\b|numero|nota fiscal|nfs-?e|danfe|serie|'
+    r'valor|total|desconto|produto|servico|descricao|qtd|quant|unit|cfop|ncm'
+)
+# Canhoto, avisos legais e rodapés que se repetem em toda DANFE/NFS-e
+RE_BOILERPLATE = re.compile(
+    r'recebemos de|data de recebimento|identificacao e assinatura|assinatura do recebedor|'
+    r'documento auxiliar da nota|consulte a autenticidade|www\.|http|'
+    r'documento emitido por me ou epp|nao gera direito a credito|simples nacional|'
+    r'valor aproximado dos tributos|lei 12\.741|reservado ao fisco|protocolo de autorizacao'
+)
+# Início da cauda da DANFE: daqui em diante só interessam vencimentos e condições de pagamento
+RE_INICIO_CAUDA = re.compile(r'dados adicionais|informacoes complementares|informacoes adicionais')
+RE_RELEVANTE_CAUDA = re.compile(r'vencimento|venc\.|duplicata|fatura|parcela|pagamento|boleto|desconto')
+# Cabeçalho de página ("FOLHA 2/3", "Página 2 de 3"): a cauda da página anterior terminou.
+# No texto dos PDFs as páginas também vêm separadas por \f (ver Identificador.extrair_dados_pdf)
+RE_NOVA_PAGINA = re.compile(r'\bfolha \d+ ?(?:/|de) ?\d+|\bpagina \d+ ?(?:/|de) ?\d+')
+
+RE_XML_ASSINATURA = re.compile(r'<(?:\w+:)?Signature\b.*?</(?:\w+:)?Signature>', re.DOTALL)
+RE_XML_DECLARACAO = re.compile(r'<\?xml[^>]*\?>|<!--.*?-->', re.DOTALL)
+RE_XML_ELEMENTO = re.compile(r'<(/?)(?:[\w.-]+:)?([\w.-]+)[^>]*?(/?)>|([^<]+)')
+
+
+def _estimar_tokens_padrao(texto):
+    return len(texto) // 3 + 1
+
+
+def _sem_acentos(texto):
+    return ''.join(c for c in unicodedata.normalize('NFD', texto.lower()) if unicodedata.category(c) != 'Mn')
+
+
+def _eh_xml(texto):
+    inicio = texto.lstrip()[:200]
+    return inicio.startswith('<?xml') or (inicio.startswith('<') and '</' in texto)
+
+
+def _achatar_xml(texto):
+    """
+    XML -> linhas 'tag: valor', com '[tag]' ao abrir cada grupo. Sem assinatura, namespaces
+    nem atributos (a chave de acesso no Id do infNFe não é campo do prompt).
+    """
+    texto = RE_XML_DECLARACAO.sub('', RE_XML_ASSINATURA.sub('', texto))
+    linhas = []
+    aberta = None
+    for fechamento, tag, vazia, conteudo in RE_XML_ELEMENTO.findall(texto):
+        if conteudo:
+            valor = RE_ESPACOS.sub(' ', conteudo).strip()
+            if valor and aberta:
+                linhas.append(f'{aberta}: {valor}')
+                aberta = None
+            continue
+        if fechamento or vazia:
+            aberta = None
+            continue
+        if aberta:
+            linhas.append(f'[{aberta}]')
+        aberta = tag
+    return linhas
+
+
+def _pontuar(linha_normalizada, linha):
+    if RE_BOILERPLATE.search(linha_normalizada):
+        return -1
+    pontos = 0
+    if RE_CNPJ.search(linha):
+        pontos += 5
+    if RE_DATA.search(linha):
+        pontos += 4
+    valores = len(RE_VALOR.findall(linha))
+    if valores:
+        pontos += 3
+    # Linha de tabela de produtos: descrição seguida de quantidade/valores
+    if valores >= 2 or (valores and len(RE_NUMERO.findall(linha)) >= 3 and re.search(r'[A-Za-z]{3}', linha)):
+        pontos += 3
+    if RE_ROTULOS.search(linha_normalizada):
+        pontos += 2
+    return pontos
+
+
+def _linhas_texto(texto):
+    linhas = []
+    vistas = set()
+    na_cauda = False
+    # splitlines também quebra em \f; a divisão por página vem antes para zerar a cauda
+    brutas = [(numero, bruta) for numero, pagina in enumerate(texto.split('\f')) for bruta in pagina.splitlines()]
+    pagina_atual = 0
+    for numero, bruta in brutas:
+        linha = RE_ESPACOS.sub(' ', bruta).strip()
+        if not linha:
+            continue
+        normalizada = _sem_acentos(linha)
+        # A cauda vale só até o fim da página: na seguinte voltam produtos e totais
+        if numero != pagina_atual or RE_NOVA_PAGINA.search(normalizada):
+            pagina_atual = numero
+            na_cauda = False
+        if RE_INICIO_CAUDA.search(normalizada):
+            na_cauda = True
+        pontos = _pontuar(normalizada, linha)
+        if na_cauda and not RE_RELEVANTE_CAUDA.search(normalizada):
+            pontos = -1
+        # Linhas repetidas (canhoto, cabeçalho de cada página) ficam só na primeira ocorrência,
+        # exceto as de produto, que podem se repetir legitimamente
+        if pontos < 6:
+            if normalizada in vistas:
+                continue
+            vistas.add(normalizada)
+        linhas.append([linha, pontos])
+    # Contexto: rótulo em uma linha e valor na seguinte (comum no OCR; a linha só com o
+    # rótulo vale 2) ou descrição de produto quebrada em duas linhas
+    for i, (linha, pontos) in enumerate(linhas):
+        if pontos == 0 and any(0 <= j < len(linhas) and linhas[j][1] >= 2 for j in (i - 1, i + 1)):
+            linhas[i][1] = 1
+    if not any(pontos > 0 for _, pontos in linhas):
+        # Nada reconhecível (OCR ruim): mantém o texto e deixa só o corte por tamanho
+        return [(linha, 1) for linha, pontos in linhas if pontos >= 0] or [(linha, 1) for linha, _ in linhas]
+    return [(linha, pontos) for linha, pontos in linhas if pontos > 0]
+
+
+def _limitar(linhas, max_tokens, estimar):
+    # Mantém as linhas mais pontuadas (em empate, as primeiras) até o limite, na ordem original
+    custos = [estimar(linha) for linha, _ in linhas]
+    if sum(custos) <= max_tokens:
+        return [linha for linha, _ in linhas]
+    ordem = sorted(range(len(linhas)), key=lambda i: (-linhas[i][1], i))
+    escolhidas = set()
+    total = 0
+    for i in ordem:
+        if total + custos[i] > max_tokens:
+            continue
+        escolhidas.add(i)
+        total += custos[i]
+    return [linhas[i][0] for i in sorted(escolhidas)]
+
+
+def reduzir_texto(texto, max_tokens=PROMPT_MAX_TOKENS_TEXTO, estimar=_estimar_tokens_padrao):
+    """
+    Retorna (texto_reduzido, estatisticas) com tokens antes/depois e a razão de redução.
+    `estimar(texto)` conta os tokens (o estimador usado para montar os lotes).
+    """
+    texto = texto or ''
+    tokens_originais = estimar(texto) if texto else 0
+    if _eh_xml(texto):
+        linhas = [(linha, 1) for linha in _achatar_xml(texto)]
+    else:
+        linhas = _linhas_texto(texto)
+    reduzido = '\n'.join(_limitar(linhas, max_tokens, estimar))
+    tokens_reduzidos = estimar(reduzido) if reduzido else 0
+    return reduzido, {
+        'tokens_originais': tokens_originais,
+        'tokens_reduzidos': tokens_reduzidos,
+        'reducao': 1 - tokens_reduzidos / tokens_originais if tokens_originais else 0.0,
+    }
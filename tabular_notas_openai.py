@@ -1,16 +1,26 @@
-import openai
 import json
-import time
 import re
 import os
+import threading
+import limitador_openai
+import backend_llm
+import reducao_texto
+import metricas
 
-# Pega a chave da OpenAI das variáveis de ambiente de forma segura
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# A chamada em si fica no backend_llm (LLM_MODO=live|record|replay|stub). No modo live a
+# OPENAI_API_KEY é exigida na primeira chamada, não no import: sem ela o app sobe e as notas
+# caem no fallback por regex.
 
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY não encontrada nas variáveis de ambiente!")
+MODELO = "gpt-3.5-turbo"
+SYSTEM_PROMPT = "Você é um extrator de informações fiscais que responde apenas em JSON."
 
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+# Modo em lote: várias notas curtas em uma única chamada, repetindo o prompt base uma vez só.
+# Orçamento total estimado por chamada (prompt + resposta reservada), abaixo da janela do modelo
+LOTE_MAX_TOKENS = int(os.environ.get('OPENAI_LOTE_MAX_TOKENS', 12000))
+LOTE_MAX_NOTAS = int(os.environ.get('OPENAI_LOTE_MAX_NOTAS', 6))
+# Tokens de resposta reservados por nota do lote (a resposta do modelo é limitada a 4096)
+TOKENS_RESPOSTA_POR_NOTA = int(os.environ.get('OPENAI_TOKENS_RESPOSTA_POR_NOTA', 600))
+LIMITE_TOKENS_RESPOSTA = 4096
 
 PROMPT_BASE = r'''Extraia os campos abaixo para cada nota fiscal do texto a seguir. Identifique também campos similares a: número da nota, data de emissão, data de vencimento, produtos ou serviços (mesmo que estejam com nomes diferentes ou variações).
 
@@ -89,20 +99,218 @@ def limpar_json_bruto(resposta):
     # Remove espaços extras no início/fim
     return resposta
 
-def tabular_nota(nota, arquivo):
+def estimar_tokens(texto):
+    return limitador_openai.estimar_tokens(texto, MODELO)
+
+def montar_prompt(itens):
+    """
+    Monta o prompt para uma lista de (arquivo, texto). Com uma nota só o prompt é o mesmo
+    do modo individual; com várias o modelo é instruído a devolver um objeto por arquivo.
+    """
     prompt = PROMPT_BASE
-    prompt += f"\nArquivo: {arquivo}\nTexto:\n{nota.get('texto_lido', '')}\n"
+    for arquivo, texto in itens:
+        prompt += f"\nArquivo: {arquivo}\nTexto:\n{texto}\n"
+    if len(itens) > 1:
+        prompt += (f"\nSão {len(itens)} notas fiscais. Retorne um objeto por nota, na mesma ordem, "
+                   "com o campo Arquivo exatamente igual ao informado.\n")
     prompt += EXEMPLO_JSON
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "Você é um extrator de informações fiscais que responde apenas em JSON."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.0,
-        max_tokens=1500
-    )
-    return response.choices[0].message.content
+    return prompt
+
+def _completar(prompt, max_tokens):
+    mensagens = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+    def chamada():
+        conteudo, cabecalhos, uso = backend_llm.completar(MODELO, mensagens, max_tokens, temperatura=0.0)
+        if uso:
+            metricas.contar('leitor_openai_tokens_total', uso['prompt_tokens'], tipo='prompt')
+            metricas.contar('leitor_openai_tokens_total', uso['completion_tokens'], tipo='completion')
+        return conteudo, cabecalhos
+
+    # A OpenAI conta o max_tokens pedido no limite de tokens/min, não só o que foi gerado
+    tokens = estimar_tokens(SYSTEM_PROMPT + prompt) + max_tokens
+    # Inclui a espera pelo limitador e as repetições após 429/erros transitórios
+    with metricas.cronometrar('openai'):
+        try:
+            resultado = limitador_openai.get_limitador().chamar(chamada, tokens)
+        except Exception:
+            metricas.contar('leitor_openai_chamadas_total', resultado='erro')
+            raise
+    metricas.contar('leitor_openai_chamadas_total', resultado='ok')
+    return resultado
+
+def reduzir_texto_nota(texto, arquivo):
+    """
+    Remove do texto o que não ajuda a extrair os campos (ver reducao_texto) e informa
+    a redução obtida para a nota (log e histograma leitor_reducao_razao).
+    """
+    with metricas.cronometrar('reducao_texto'):
+        reduzido, info = reducao_texto.reduzir_texto(texto, estimar=estimar_tokens)
+    if info['tokens_originais']:
+        metricas.observar('leitor_reducao_razao', info['reducao'])
+        print(f"{arquivo}: texto reduzido de {info['tokens_originais']} para {info['tokens_reduzidos']} tokens "
+              f"({info['reducao']:.0%} menor)")
+    return reduzido
+
+def tabular_nota(nota, arquivo, reduzir=True):
+    texto = nota.get('texto_lido', '')
+    if reduzir:
+        texto = reduzir_texto_nota(texto, arquivo)
+    prompt = montar_prompt([(arquivo, texto)])
+    return _completar(prompt, 1500)
+
+def agrupar_em_lotes(itens):
+    """
+    Agrupa (arquivo, texto) em lotes, na ordem recebida, até LOTE_MAX_TOKENS estimados
+    (prompt base + textos + resposta reservada) e LOTE_MAX_NOTAS por lote.
+    Notas que sozinhas passam do orçamento vão em um lote próprio.
+    """
+    custo_fixo = estimar_tokens(montar_prompt([]) + SYSTEM_PROMPT)
+    max_notas = max(1, min(LOTE_MAX_NOTAS, LIMITE_TOKENS_RESPOSTA // TOKENS_RESPOSTA_POR_NOTA))
+    lotes = []
+    lote, tokens_lote = [], custo_fixo
+    for arquivo, texto in itens:
+        tokens = estimar_tokens(f"\nArquivo: {arquivo}\nTexto:\n{texto}\n") + TOKENS_RESPOSTA_POR_NOTA
+        repetido = any(arquivo == existente for existente, _ in lote)
+        if lote and (tokens_lote + tokens > LOTE_MAX_TOKENS or len(lote) >= max_notas or repetido):
+            lotes.append(lote)
+            lote, tokens_lote = [], custo_fixo
+        lote.append((arquivo, texto))
+        tokens_lote += tokens
+    if lote:
+        lotes.append(lote)
+    return lotes
+
+def _objetos_json(texto):
+    # Recorta os objetos de primeiro nível do array, para aproveitar os que estiverem válidos
+    objetos = []
+    profundidade = 0
+    inicio = None
+    em_string = False
+    escape = False
+    for i, c in enumerate(texto):
+        if em_string:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                em_string = False
+        elif c == '"':
+            em_string = True
+        elif c == '{':
+            if profundidade == 0:
+                inicio = i
+            profundidade += 1
+        elif c == '}' and profundidade > 0:
+            profundidade -= 1
+            if profundidade == 0:
+                objetos.append(texto[inicio:i + 1])
+    return objetos
+
+def separar_resposta_lote(resposta, arquivos):
+    """
+    Divide a resposta de um lote por arquivo. Retorna {arquivo: dict} apenas para as notas
+    cujo objeto foi interpretado; as ausentes ou inválidas ficam de fora.
+    """
+    limpo = limpar_json_bruto(resposta)
+    try:
+        objetos = json.loads(limpo)
+        if isinstance(objetos, dict):
+            objetos = [objetos]
+    except json.JSONDecodeError:
+        objetos = []
+        for trecho in _objetos_json(limpo):
+            try:
+                objetos.append(json.loads(trecho))
+            except json.JSONDecodeError:
+                objetos.append(None)
+    if not isinstance(objetos, list):
+        return {}
+    resultados = {}
+    for obj in objetos:
+        if isinstance(obj, dict) and obj.get('Arquivo') in arquivos and obj['Arquivo'] not in resultados:
+            resultados[obj['Arquivo']] = obj
+    # Se o modelo alterou algum nome de arquivo, usa a posição quando a quantidade bate
+    if len(resultados) < len(arquivos) and len(objetos) == len(arquivos):
+        usados = {id(obj) for obj in resultados.values()}
+        for arquivo, obj in zip(arquivos, objetos):
+            if arquivo not in resultados and isinstance(obj, dict) and id(obj) not in usados:
+                resultados[arquivo] = dict(obj, Arquivo=arquivo)
+    return resultados
+
+def tabular_lote(itens):
+    """
+    Tabula um lote de (arquivo, texto) em uma única chamada.
+    Retorna ({arquivo: dict}, resposta_bruta).
+    """
+    max_tokens = min(LIMITE_TOKENS_RESPOSTA, max(1500, TOKENS_RESPOSTA_POR_NOTA * len(itens)))
+    resposta = _completar(montar_prompt(itens), max_tokens)
+    return separar_resposta_lote(resposta, [arquivo for arquivo, _ in itens]), resposta
+
+def tabular_notas_em_lote(notas, ao_responder=None):
+    """
+    Tabula uma lista de notas (dicts com 'arquivo' e 'texto_lido', como em resultado_notas.json)
+    agrupando-as em lotes enviados em paralelo dentro dos limites do limitador_openai.
+    Só as notas que não vierem interpretáveis no lote são refeitas, uma a uma.
+    `ao_responder(arquivos, resposta_bruta)` recebe cada resposta (log).
+    Retorna uma lista alinhada com `notas` de (arquivo, dict ou None, erro ou None).
+    """
+    itens = []
+    for idx, nota in enumerate(notas):
+        arquivo = nota.get('arquivo', f'nota_{idx+1}')
+        itens.append((arquivo, reduzir_texto_nota(nota.get('texto_lido', ''), arquivo)))
+    # Os lotes preservam a ordem das notas, então o índice de cada uma é a posição acumulada
+    lotes = []
+    inicio = 0
+    for lote in agrupar_em_lotes(itens):
+        lotes.append([(inicio + i, arquivo, texto) for i, (arquivo, texto) in enumerate(lote)])
+        inicio += len(lote)
+    limitador = limitador_openai.get_limitador()
+    lock_log = threading.Lock()
+
+    def responder(arquivos, resposta):
+        if ao_responder:
+            with lock_log:
+                ao_responder(arquivos, resposta)
+
+    def processar_lote(numero_lote):
+        n, lote = numero_lote
+        arquivos = [arquivo for _, arquivo, _ in lote]
+        print(f"Lote {n+1}/{len(lotes)}: {len(lote)} nota(s)")
+        try:
+            dados, resposta = tabular_lote([(arquivo, texto) for _, arquivo, texto in lote])
+            responder(arquivos, resposta)
+        except Exception as e:
+            print(f"Erro no lote {n+1}: {e}")
+            dados = {}
+        return [(idx, arquivo, texto, dados.get(arquivo)) for idx, arquivo, texto in lote]
+
+    def processar_individual(pendente):
+        idx, arquivo, texto = pendente
+        try:
+            resposta = tabular_nota({'texto_lido': texto}, arquivo, reduzir=False)
+            responder([arquivo], resposta)
+            return idx, (arquivo, json.loads(limpar_json_bruto(resposta))[0], None)
+        except Exception as e:
+            print(f"Erro ao processar {arquivo}: {e}")
+            return idx, (arquivo, None, str(e))
+
+    resultados = [None] * len(itens)
+    pendentes = []
+    for respostas_lote in limitador.mapear(processar_lote, enumerate(lotes)):
+        for idx, arquivo, texto, dado in respostas_lote:
+            if dado is not None:
+                resultados[idx] = (arquivo, dado, None)
+            else:
+                pendentes.append((idx, arquivo, texto))
+    if pendentes:
+        print(f"Refazendo individualmente {len(pendentes)} nota(s) sem resposta válida no lote")
+    for idx, resultado in limitador.mapear(processar_individual, pendentes):
+        resultados[idx] = resultado
+    return resultados
 
 def corrigir_produtos_e_contrato(dado):
     # Garante que Produtos é uma lista
@@ -123,24 +331,18 @@ def corrigir_produtos_e_contrato(dado):
 def main():
     with open('resultado_notas.json', 'r', encoding='utf-8') as f:
         notas = json.load(f)
+
+    def registrar_resposta(arquivos, resposta):
+        # Salva a resposta bruta em um arquivo de log
+        with open('openai_respostas_brutas.log', 'a', encoding='utf-8') as flog:
+            flog.write(f'Arquivo: {", ".join(arquivos)}\nResposta:\n{resposta}\n---\n')
+
     resultados = []
-    for idx, nota in enumerate(notas):
-        arquivo = nota.get('arquivo', f'nota_{idx+1}')
-        print(f"Processando {arquivo}...")
-        try:
-            resultado_bruto = tabular_nota(nota, arquivo)
-            # Salva a resposta bruta em um arquivo de log
-            with open('openai_respostas_brutas.log', 'a', encoding='utf-8') as flog:
-                flog.write(f'Arquivo: {arquivo}\nResposta:\n{resultado_bruto}\n---\n')
-            resultado_limpo = limpar_json_bruto(resultado_bruto)
-            dado = json.loads(resultado_limpo)[0]
-            dado = corrigir_produtos_e_contrato(dado)
-            resultados.append(dado)
-        except Exception as e:
-            print(f"Erro ao processar {arquivo}: {e}")
-            print(f"Resposta bruta da OpenAI:\n{resultado_bruto if 'resultado_bruto' in locals() else 'N/A'}")
-            resultados.append({"Arquivo": arquivo, "erro": str(e)})
-        time.sleep(1.5)  # Para evitar rate limit
+    for arquivo, dado, erro in tabular_notas_em_lote(notas, registrar_resposta):
+        if dado is not None and isinstance(dado, dict):
+            resultados.append(corrigir_produtos_e_contrato(dado))
+        else:
+            resultados.append({"Arquivo": arquivo, "erro": erro or "resposta inválida"})
     with open('resultado_notas_tabulado.json', 'w', encoding='utf-8') as f:
         json.dump(resultados, f, ensure_ascii=False, indent=2)
     print("Processamento concluído! Resultados salvos em 'resultado_notas_tabulado.json'.")
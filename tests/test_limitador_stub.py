@@ -0,0 +1,114 @@
+import os
+import sys
+
+import openai
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+
+import backend_llm
+import limitador_openai
+import tabular_notas_openai
+import stub_openai
+
+
+def _notas(quantidade):
+    return [{'arquivo': f'nota_{i:02d}.pdf',
+             'texto_lido': (f'NOTA FISCAL Nº {1000 + i}\nCNPJ 12.345.678/0001-95\n'
+                            f'Data de Emissão: 01/02/2024\nPARAFUSO SEXTAVADO {i},00\n'
+                            f'Valor Total da Nota Fiscal: R$ {i},00\n')}
+            for i in range(quantidade)]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """
+    Sobe o stub da OpenAI e aponta o backend (modo live) e um limitador novo para ele.
+    Retorna uma função (opções do stub, limites do limitador) -> (servidor, limitador).
+    """
+    servidores = []
+
+    def iniciar(rpm=500, tpm=200000, latencia=0, **opcoes):
+        servidor, base_url = stub_openai.iniciar_em_thread(porta=0, latencia=latencia, **opcoes)
+        servidores.append(servidor)
+        monkeypatch.setenv('OPENAI_BASE_URL', base_url)
+        monkeypatch.setenv('OPENAI_API_KEY', 'stub')
+        monkeypatch.setattr(backend_llm, 'LLM_MODO', backend_llm.LIVE)
+        backend_llm._cliente.cache_clear()
+        limitador = limitador_openai.LimitadorOpenAI(rpm=rpm, tpm=tpm, max_simultaneas=4)
+        monkeypatch.setattr(limitador_openai, '_limitador', limitador)
+        return servidor, limitador
+
+    yield iniciar
+    backend_llm._cliente.cache_clear()
+    for servidor in servidores:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+def test_lote_agrupa_notas_em_menos_chamadas(stub, monkeypatch):
+    monkeypatch.setattr(tabular_notas_openai, 'LOTE_MAX_NOTAS', 4)
+    servidor, limitador = stub()
+    notas = _notas(10)
+    resultados = tabular_notas_openai.tabular_notas_em_lote(notas)
+    assert [arquivo for arquivo, _, _ in resultados] == [nota['arquivo'] for nota in notas]
+    assert all(dado is not None and erro is None for _, dado, erro in resultados)
+    assert all(dado['Arquivo'] == arquivo for arquivo, dado, _ in resultados)
+    # 10 notas, até 4 por lote: 3 chamadas, nenhuma refeita individualmente
+    assert servidor.contadores['atendidas'] == 3
+    assert limitador.estatisticas()['chamadas'] == 3
+
+
+def test_lote_respeita_orcamento_de_tokens(monkeypatch):
+    monkeypatch.setattr(tabular_notas_openai, 'LOTE_MAX_TOKENS', 2000)
+    itens = [(nota['arquivo'], nota['texto_lido'] * 5) for nota in _notas(12)]
+    lotes = tabular_notas_openai.agrupar_em_lotes(itens)
+    assert len(lotes) > 1
+    assert [item for lote in lotes for item in lote] == itens
+    custo_fixo = tabular_notas_openai.estimar_tokens(tabular_notas_openai.montar_prompt([])
+                                                     + tabular_notas_openai.SYSTEM_PROMPT)
+    for lote in lotes:
+        custo = custo_fixo + sum(tabular_notas_openai.estimar_tokens(f"\nArquivo: {arquivo}\nTexto:\n{texto}\n")
+                                 + tabular_notas_openai.TOKENS_RESPOSTA_POR_NOTA for arquivo, texto in lote)
+        assert custo <= 2000
+
+
+def test_429_e_repetido_apos_retry_after(stub):
+    servidor, limitador = stub(recusas_iniciais=2)
+    resultados = tabular_notas_openai.tabular_notas_em_lote(_notas(3))
+    assert all(dado is not None for _, dado, _ in resultados)
+    assert servidor.contadores['recusadas_429'] == 2
+    estatisticas = limitador.estatisticas()
+    assert estatisticas['rate_limit_429'] == 2
+    assert estatisticas['tentativas_repetidas'] == 2
+    assert estatisticas['chamadas'] == servidor.contadores['atendidas']
+
+
+def test_limitador_espera_pelo_balde_de_tokens(stub, monkeypatch):
+    monkeypatch.setattr(tabular_notas_openai, 'LOTE_MAX_NOTAS', 1)
+    notas = _notas(4)
+    # Custo estimado de cada chamada, como em _completar (prompt + max_tokens reservado)
+    custos = []
+    for nota in notas:
+        texto = tabular_notas_openai.reduzir_texto_nota(nota['texto_lido'], nota['arquivo'])
+        prompt = tabular_notas_openai.montar_prompt([(nota['arquivo'], texto)])
+        custos.append(tabular_notas_openai.estimar_tokens(tabular_notas_openai.SYSTEM_PROMPT + prompt) + 1500)
+    # Balde um pouco menor que o total: a última chamada espera ~1,2s pelo reabastecimento.
+    # A latência do stub mantém as respostas (e seus cabeçalhos x-ratelimit-*, que ampliariam
+    # o balde para o limite do stub) para depois dessa espera.
+    servidor, limitador = stub(latencia=1.5)
+    limitador.tokens = limitador_openai.BaldeTokens(sum(custos) * 0.98)
+    resultados = tabular_notas_openai.tabular_notas_em_lote(notas)
+    assert all(dado is not None for _, dado, _ in resultados)
+    assert servidor.contadores['atendidas'] == 4
+    assert servidor.contadores['recusadas_429'] == 0
+    assert limitador.estatisticas()['espera_total'] >= 0.5
+
+
+def test_cota_esgotada_nao_e_repetida(stub):
+    servidor, limitador = stub(sem_cota=True)
+    with pytest.raises(openai.RateLimitError):
+        tabular_notas_openai.tabular_nota(_notas(1)[0], 'nota_00.pdf')
+    assert servidor.contadores['recusadas_429'] == 1
+    assert limitador.estatisticas()['tentativas_repetidas'] == 0
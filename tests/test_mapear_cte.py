@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import Identificador
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _ler(nome):
+    return Identificador.extrair_dados_xml(os.path.join(FIXTURES, nome))
+
+
+def test_cte_com_toma3_usa_o_papel_indicado():
+    registro = _ler('cte_toma3.xml')
+    # O infCte referencia NF-e (infDoc/infNFe), mas o documento é um CT-e
+    assert registro['tipo'] == 'cte'
+    dado = registro['dados_estruturados']
+    assert dado['Numero_Nota'] == '9876'
+    assert dado['Cnpj_Fornecedor'] == '11.222.333/0001-44'
+    # toma=3: o tomador é o destinatário
+    assert dado['Cnpj_Cliente'] == '04.019.475/0005-04'
+    assert dado['Data_Emissao'] == '03/06/2024'
+    assert dado['Data_Vencimento'] == '03/07/2024'
+    assert dado['Prazo'] == '30'
+    assert dado['Valor_Total'] == '1.500,00'
+    assert (dado['Base_ICMS'], dado['Aliquota_ICMS'], dado['Valor_ICMS']) == ('1.500,00', '12', '180,00')
+    assert dado['Chaves_NFe'] == ('43240632301241000167550070004547111000454711, '
+                                  '43240632301241000167550070004547121000454712')
+    assert dado['Produtos'] == [{'Produto': 'PRESTACAO DE SERVICO DE TRANSPORTE', 'Qtde': '1',
+                                 'Valor_Unitario': '1.500,00', 'Valor_Total_Produto': '1.500,00'}]
+
+
+def test_cte_com_toma4_sem_cobranca():
+    registro = _ler('cte_toma4.xml')
+    assert registro['tipo'] == 'cte'
+    dado = registro['dados_estruturados']
+    assert dado['Numero_Nota'] == '123'
+    assert dado['Cnpj_Cliente'] == '99.888.777/0001-66'
+    assert dado['Data_Vencimento'] == ''
+    assert dado['Prazo'] == ''
+    assert (dado['Base_ICMS'], dado['Aliquota_ICMS'], dado['Valor_ICMS']) == ('820,40', '7', '57,43')
+    assert dado['Chaves_NFe'] == '35240555666777000188550010000001231000001230'
+    # Sem natOp: descrição padrão do serviço
+    assert dado['Produtos'][0]['Produto'] == 'PRESTACAO DE SERVICO DE TRANSPORTE'
+
+
+@pytest.mark.parametrize('toma, cnpj', [('0', '32.301.241/0001-67'), ('3', '04.019.475/0005-04'), (None, '32.301.241/0001-67')])
+def test_tomador_do_toma3(toma, cnpj):
+    ide = {'nCT': '1'}
+    if toma is not None:
+        ide['toma3'] = {'toma': toma}
+    inf_cte = {'ide': ide, 'rem': {'CNPJ': '32301241000167'}, 'dest': {'CNPJ': '04019475000504'}}
+    assert Identificador.mapear_cte(inf_cte)['Cnpj_Cliente'] == cnpj
+
+
+@pytest.mark.parametrize('grupo, esperado', [
+    ({'ICMS20': {'vBC': '800.00', 'pICMS': '12.00', 'vICMS': '96.00'}}, ('800,00', '12', '96,00')),
+    ({'ICMS60': {'vBCSTRet': '500.00', 'pICMSSTRet': '17.00', 'vICMSSTRet': '85.00'}}, ('500,00', '17', '85,00')),
+    ({'ICMS45': {'CST': '40'}}, ('', '', '')),
+    ({'ICMSSN': {'CST': '90', 'indSN': '1'}}, ('', '', '')),
+    ('', ('', '', '')),
+])
+def test_grupos_de_icms(grupo, esperado):
+    inf_cte = {'ide': {'nCT': '1'}, 'imp': {'ICMS': grupo}}
+    dado = Identificador.mapear_cte(inf_cte)
+    assert (dado['Base_ICMS'], dado['Aliquota_ICMS'], dado['Valor_ICMS']) == esperado
@@ -0,0 +1,57 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import Identificador
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _ler(nome):
+    return Identificador.extrair_dados_xml(os.path.join(FIXTURES, nome))
+
+
+def test_nfe_autorizada_com_protocolo():
+    registro = _ler('nfe_proc.xml')
+    assert registro['tipo'] == 'nfe'
+    dado = registro['dados_estruturados']
+    assert dado['Arquivo'] == 'nfe_proc.xml'
+    assert dado['Numero_Nota'] == '454711'
+    assert dado['Cnpj_Fornecedor'] == '32.301.241/0001-67'
+    assert dado['Cnpj_Cliente'] == '04.019.475/0005-04'
+    assert dado['Data_Emissao'] == '14/06/2024'
+    # Primeira duplicata
+    assert dado['Data_Vencimento'] == '14/07/2024'
+    assert dado['Prazo'] == '30'
+    assert dado['Valor_Total'] == '12.109,50'
+    assert dado['Desconto'] == '15,50'
+    assert dado['Contrato_de_Parceria?'] == 'SIM'
+    assert dado['Produtos'] == [
+        {'Produto': 'PALLET PBR', 'Qtde': '10', 'Valor_Unitario': '1.187,50', 'Valor_Total_Produto': '11.875,00'},
+        {'Produto': 'FILME STRETCH 500MM', 'Qtde': '2,5', 'Valor_Unitario': '100,00', 'Valor_Total_Produto': '250,00'},
+    ]
+
+
+def test_nfe_sem_protocolo_sem_cobranca_e_desconto_vazio():
+    registro = _ler('nfe_sem_protocolo.xml')
+    assert registro['tipo'] == 'nfe'
+    dado = registro['dados_estruturados']
+    assert dado['Numero_Nota'] == '1234'
+    assert dado['Cnpj_Fornecedor'] == '12.345.678/0001-95'
+    # Destinatário pessoa física: CPF sem máscara de CNPJ
+    assert dado['Cnpj_Cliente'] == '12345678909'
+    assert dado['Data_Emissao'] == '05/01/2010'
+    assert dado['Data_Vencimento'] == ''
+    assert dado['Prazo'] == ''
+    assert dado['Desconto'] == ''
+    assert dado['Valor_Total'] == '980,00'
+    assert dado['Contrato_de_Parceria?'] == 'NÃO'
+    assert len(dado['Produtos']) == 1
+
+
+def test_desconto_malformado_vale_zero():
+    dado = Identificador.mapear_nfe({'ide': {'nNF': '1'}, 'total': {'ICMSTot': {'vDesc': 'abc', 'vNF': '10.00'}}})
+    assert dado['Desconto'] == ''
+    assert dado['Valor_Total'] == '10,00'
+    assert dado['Produtos'] == []
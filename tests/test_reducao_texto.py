@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import reducao_texto
+
+PAGINA_1 = """DANFE
+FOLHA 1/2
+NOTA FISCAL Nº 000.004.521
+CNPJ 12.345.678/0001-95
+PARAFUSO SEXTAVADO 10,0000 1,50 15,00
+DADOS ADICIONAIS
+INFORMAÇÕES COMPLEMENTARES
+Pedido interno 8812 conferido pelo almoxarifado
+"""
+
+PAGINA_2 = """DANFE
+FOLHA 2/2
+PORCA M8 ZINCADA 20,0000 0,75 15,00
+VALOR TOTAL DA NOTA 30,00
+"""
+
+
+def _reduzido(texto):
+    return reducao_texto.reduzir_texto(texto)[0]
+
+
+def test_cauda_da_primeira_pagina_nao_apaga_a_segunda_com_form_feed():
+    reduzido = _reduzido(PAGINA_1 + '\f' + PAGINA_2)
+    assert 'PORCA M8 ZINCADA 20,0000 0,75 15,00' in reduzido
+    assert 'VALOR TOTAL DA NOTA 30,00' in reduzido
+    assert 'almoxarifado' not in reduzido
+
+
+def test_cauda_termina_no_cabecalho_da_pagina_seguinte():
+    # Texto de OCR ou de cache antigo, sem \f entre as páginas
+    reduzido = _reduzido(PAGINA_1 + PAGINA_2)
+    assert 'PORCA M8 ZINCADA 20,0000 0,75 15,00' in reduzido
+    assert 'VALOR TOTAL DA NOTA 30,00' in reduzido
+
+
+def test_valor_na_linha_seguinte_ao_rotulo_e_mantido():
+    reduzido = _reduzido('Prefeitura do Município\nNúmero da Nota\n00004521\nRua das Flores 100\n')
+    assert 'Número da Nota\n00004521' in reduzido
@@ -0,0 +1,30 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils
+
+
+def test_campos_extraidos_de_uma_vez():
+    texto = ('ACME COMERCIO LTDA\nCNPJ: 12.345.678/0001-95\nData de Emissão: 01/02/2024\n'
+             'Vencimento: 03/03/2024\nValor Total da Nota Fiscal: R$ 1.234,56\n')
+    campos = utils.extrair_campos_regex(texto, ['Nome_Fornecedor', 'Cnpj_Fornecedor', 'Data_Emissao',
+                                                'Data_Vencimento', 'Valor_Total', 'Placa_Veiculo'])
+    assert campos == {
+        'Nome_Fornecedor': 'ACME COMERCIO LTDA',
+        'Cnpj_Fornecedor': '12.345.678/0001-95',
+        'Data_Emissao': '01/02/2024',
+        'Data_Vencimento': '03/03/2024',
+        'Valor_Total': '1.234,56',
+        'Placa_Veiculo': '',
+    }
+
+
+def test_texto_longo_sem_digitos_nao_e_quadratico():
+    # Sem o limite em Nome_Fornecedor isto levava dezenas de segundos
+    texto = '\n'.join(['PARAFUSO SEXTAVADO ZINCADO CAIXA COM CEM UNIDADES'] * 2000)
+    inicio = time.perf_counter()
+    assert utils.extrair_por_regex(texto, 'Nome_Fornecedor') == ''
+    assert time.perf_counter() - inicio < 2
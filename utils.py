@@ -1,35 +1,34 @@
 import os
 import re
 import json
+import time
+import heapq
 import sqlite3
+import threading
+import unicodedata
 from typing import Dict
 import pandas as pd
 
-# Carrega apenas a planilha FILIAIS.csv em memória ao iniciar o módulo
-CAMINHO_CSV = os.path.join(os.path.dirname(__file__), 'TABELAS_PROTHEUS', 'FILIAIS.csv')
-FILIAIS_DF = None
-if os.path.exists(CAMINHO_CSV):
-    # Detecta separador automaticamente
-    with open(CAMINHO_CSV, 'r', encoding='utf-8') as f:
-        primeira_linha = f.readline()
-        sep = ';' if ';' in primeira_linha else ','
-    FILIAIS_DF = pd.read_csv(CAMINHO_CSV, dtype=str, sep=sep)
-    # Corrige coluna com BOM se necessário
-    if '\ufeffCNPJ' in FILIAIS_DF.columns:
-        FILIAIS_DF = FILIAIS_DF.rename(columns={'\ufeffCNPJ': 'CNPJ'})
-else:
-    print('Arquivo de filiais não encontrado!')
-    FILIAIS_DF = pd.DataFrame()
-
-# Carrega a planilha COND PAGAMENTOS.csv em memória ao iniciar o módulo
-CAMINHO_COND_PAGAMENTOS = os.path.join(os.path.dirname(__file__), 'TABELAS_PROTHEUS', 'COND PAGAMENTOS.csv')
-COND_PAGAMENTOS_DF = None
-if os.path.exists(CAMINHO_COND_PAGAMENTOS):
-    import pandas as pd
-    COND_PAGAMENTOS_DF = pd.read_csv(CAMINHO_COND_PAGAMENTOS, dtype=str, sep=';', encoding='utf-8')
+# ---------------------------------------------------
+#  CATÁLOGO DAS TABELAS DO PROTHEUS
+# ---------------------------------------------------
+# Cada tabela de TABELAS_PROTHEUS é lida uma vez para estruturas já normalizadas (DataFrame,
+# registros prontos para JSON e índices). Quando o mtime do CSV muda a tabela é recarregada
+# e trocada de uma vez, sem reiniciar os workers.
+
+PASTA_TABELAS = os.path.join(os.path.dirname(__file__), 'TABELAS_PROTHEUS')
+# Intervalo mínimo (segundos) entre duas verificações do mtime de uma mesma tabela
+INTERVALO_VERIFICACAO_TABELAS = float(os.environ.get('INTERVALO_VERIFICACAO_TABELAS', 2))
+
+
+def _ler_csv(caminho, sep=';'):
+    return pd.read_csv(caminho, dtype=str, sep=sep, encoding='utf-8-sig')
+
+
+def _normalizar_colunas(df, mapeamento):
     # Padroniza nomes das colunas: maiúsculo, sem acentos, sem espaços
-    COND_PAGAMENTOS_DF.columns = (
-        COND_PAGAMENTOS_DF.columns
+    df.columns = (
+        df.columns
         .str.strip()
         .str.upper()
         .str.normalize('NFKD')
@@ -37,49 +36,257 @@ if os.path.exists(CAMINHO_COND_PAGAMENTOS):
         .str.decode('utf-8')
     )
     # Renomeia para os nomes esperados
-    mapeamento = {
-        'CODIGO': 'CODIGO',
-        'CÓDIGO': 'CODIGO',
-        'CDIGO': 'CODIGO',
+    return df.rename(columns={k: v for k, v in mapeamento.items() if k in df.columns})
+
+
+def _registros(df, colunas, sem_duplicatas=True):
+    if df.empty or not set(colunas).issubset(df.columns):
+        return []
+    df = df[colunas]
+    if sem_duplicatas:
+        df = df.drop_duplicates()
+    return df.fillna('').to_dict(orient='records')
+
+
+def _primeiro_por_chave(df, chave, valor):
+    # {chave: valor} da primeira linha de cada chave (mesma regra do antigo .iloc[0])
+    indice = {}
+    if df.empty or chave not in df.columns or valor not in df.columns:
+        return indice
+    for k, v in zip(df[chave], df[valor]):
+        if isinstance(k, str):
+            indice.setdefault(k, v if isinstance(v, str) else '')
+    return indice
+
+
+def _carregar_filiais(caminho):
+    # Detecta separador automaticamente
+    with open(caminho, 'r', encoding='utf-8-sig') as f:
+        primeira_linha = f.readline()
+        sep = ';' if ';' in primeira_linha else ','
+    df = _ler_csv(caminho, sep)
+    # Corrige coluna com BOM se necessário
+    if '\ufeffCNPJ' in df.columns:
+        df = df.rename(columns={'\ufeffCNPJ': 'CNPJ'})
+    por_grupo = {}
+    if {'GRUPO', 'Cod. Filial', 'Filial'}.issubset(df.columns):
+        for grupo, filiais in df.groupby('GRUPO', sort=False):
+            por_grupo[grupo] = filiais[['Cod. Filial', 'Filial']].drop_duplicates().fillna('').to_dict(orient='records')
+    return {'df': df, 'por_cnpj': _indexar_filiais(df), 'por_grupo': por_grupo}
+
+
+def _carregar_cond_pagamentos(caminho):
+    df = _normalizar_colunas(_ler_csv(caminho), {
         'CODIGO': 'CODIGO',
+        'CDIGO': 'CODIGO',
         'COND. PAGTO': 'COND_PAGTO',
         'COND PAGTO': 'COND_PAGTO',
         'DESCRICAO': 'DESCRICAO',
-        'DESCRIÇÃO': 'DESCRICAO',
-        'DESCRICAO': 'DESCRICAO',
+    })
+    return {
+        'df': df,
+        'registros': _registros(df, ['CODIGO', 'DESCRICAO']),
+        'por_codigo': _primeiro_por_chave(df, 'CODIGO', 'DESCRICAO'),
     }
-    COND_PAGAMENTOS_DF = COND_PAGAMENTOS_DF.rename(columns=mapeamento)
-else:
-    COND_PAGAMENTOS_DF = pd.DataFrame()
-
-# Carrega a planilha PRODUTOS.csv em memória ao iniciar o módulo
-CAMINHO_PRODUTOS = os.path.join(os.path.dirname(__file__), 'TABELAS_PROTHEUS', 'PRODUTOS.csv')
-PRODUTOS_DF = None
-if os.path.exists(CAMINHO_PRODUTOS):
-    PRODUTOS_DF = pd.read_csv(CAMINHO_PRODUTOS, dtype=str, sep=';', encoding='utf-8')
-    # Padroniza nomes das colunas: maiúsculo, sem acentos, sem espaços
-    PRODUTOS_DF.columns = (
-        PRODUTOS_DF.columns
-        .str.strip()
-        .str.upper()
-        .str.normalize('NFKD')
-        .str.encode('ascii', errors='ignore')
-        .str.decode('utf-8')
-    )
-    # Renomeia para os nomes esperados
-    mapeamento_prod = {
+
+
+def _carregar_produtos(caminho):
+    df = _normalizar_colunas(_ler_csv(caminho), {
         'COD PRODUTO': 'COD_PRODUTO',
-        'CÓD PRODUTO': 'COD_PRODUTO',
-        'CÓDIGO PRODUTO': 'COD_PRODUTO',
-        'CÓDIGO': 'COD_PRODUTO',
+        'CODIGO PRODUTO': 'COD_PRODUTO',
         'CODIGO': 'COD_PRODUTO',
         'DESCRICAO': 'DESCRICAO',
-        'DESCRIÇÃO': 'DESCRICAO',
         'CORRIGIDO': 'CORRIGIDO',
+    })
+    return {
+        'df': df,
+        'registros': _registros(df, ['COD_PRODUTO', 'DESCRICAO']),
+        'por_codigo': _primeiro_por_chave(df, 'COD_PRODUTO', 'DESCRICAO'),
+        'indice': _indexar_produtos(df),
     }
-    PRODUTOS_DF = PRODUTOS_DF.rename(columns={k: v for k, v in mapeamento_prod.items() if k in PRODUTOS_DF.columns})
-else:
-    PRODUTOS_DF = pd.DataFrame()
+
+
+def _carregar_contas_contabeis(caminho):
+    df = _normalizar_colunas(_ler_csv(caminho), {'DESCRICAO CONTA CONTABIL': 'DESCRICAO'})
+    return {'df': df, 'registros': [r for r in _registros(df, ['CODIGO', 'DESCRICAO'], False) if r['CODIGO']]}
+
+
+def _carregar_cc_reduzido(caminho):
+    df = _normalizar_colunas(_ler_csv(caminho), {'C. CUSTO': 'CCUSTO'})
+    return {'df': df, 'registros': [r for r in _registros(df, ['CCUSTO', 'DESCRICAO'], False) if r['CCUSTO']]}
+
+
+def _carregar_itens_conta(caminho):
+    df = _normalizar_colunas(_ler_csv(caminho), {'ITEM CONTA': 'ITEM', 'OPERACAO': 'OPERACAO'})
+    return {'df': df, 'registros': [r for r in _registros(df, ['ITEM', 'OPERACAO'], False) if r['ITEM']]}
+
+
+def _carregar_simples(caminho):
+    df = _normalizar_colunas(_ler_csv(caminho), {})
+    return {'df': df, 'registros': df.fillna('').to_dict(orient='records')}
+
+
+TABELAS_PROTHEUS = {
+    'FILIAIS': ('FILIAIS.csv', _carregar_filiais),
+    'COND_PAGAMENTOS': ('COND PAGAMENTOS.csv', _carregar_cond_pagamentos),
+    'PRODUTOS': ('PRODUTOS.csv', _carregar_produtos),
+    'CONTA_CONTABIL': ('CONTA CONTABIL.csv', _carregar_contas_contabeis),
+    'CC_REDUZIDO': ('CC REDUZIDO.csv', _carregar_cc_reduzido),
+    'ITEM_CONTA': ('ITEM CONTA.csv', _carregar_itens_conta),
+    'GRUPOS': ('GRUPOS.csv', _carregar_simples),
+    'AMBIENTE': ('AMBIENTE.csv', _carregar_simples),
+}
+
+# nome -> {'mtime', 'verificado_em', 'dados'}
+_CATALOGO = {}
+_lock_catalogo = threading.Lock()
+
+
+def _tabela_vazia():
+    return {'df': pd.DataFrame(), 'registros': [], 'por_codigo': {}, 'por_cnpj': {}, 'por_grupo': {},
+            'indice': _indexar_produtos(None), 'versao': None}
+
+
+def _recarregar(nome):
+    arquivo, carregador = TABELAS_PROTHEUS[nome]
+    caminho = os.path.join(PASTA_TABELAS, arquivo)
+    entrada = _CATALOGO.get(nome)
+    try:
+        mtime = os.stat(caminho).st_mtime_ns
+    except OSError:
+        if entrada is None:
+            print(f'Arquivo {arquivo} não encontrado!')
+            _CATALOGO[nome] = {'mtime': None, 'verificado_em': time.monotonic(), 'dados': _tabela_vazia()}
+        else:
+            entrada['verificado_em'] = time.monotonic()
+        return
+    if entrada is not None and entrada['mtime'] == mtime:
+        entrada['verificado_em'] = time.monotonic()
+        return
+    try:
+        # 'versao' (mtime do CSV) identifica o snapshot para os caches de resposta (ETag)
+        dados = dict(_tabela_vazia(), **carregador(caminho), versao=mtime)
+    except Exception as e:
+        # Arquivo sendo gravado ou inválido: mantém a versão anterior e tenta de novo depois
+        print(f'Erro ao carregar {arquivo}: {e}')
+        if entrada is None:
+            _CATALOGO[nome] = {'mtime': None, 'verificado_em': time.monotonic(), 'dados': _tabela_vazia()}
+        else:
+            entrada['verificado_em'] = time.monotonic()
+        return
+    # Troca atômica: quem já pegou a versão anterior continua usando-a até terminar
+    _CATALOGO[nome] = {'mtime': mtime, 'verificado_em': time.monotonic(), 'dados': dados}
+    if entrada is not None:
+        print(f'Tabela {arquivo} recarregada')
+
+
+def tabela(nome):
+    """
+    Retorna as estruturas da tabela do Protheus (df, registros, índices, versao), recarregando-a
+    se o CSV foi alterado desde a última leitura.
+    """
+    entrada = _CATALOGO.get(nome)
+    if entrada is None or time.monotonic() - entrada['verificado_em'] >= INTERVALO_VERIFICACAO_TABELAS:
+        with _lock_catalogo:
+            entrada = _CATALOGO.get(nome)
+            if entrada is None or time.monotonic() - entrada['verificado_em'] >= INTERVALO_VERIFICACAO_TABELAS:
+                _recarregar(nome)
+            entrada = _CATALOGO[nome]
+    return entrada['dados']
+
+
+def carregar_catalogo():
+    for nome in TABELAS_PROTHEUS:
+        tabela(nome)
+
+
+# Compatibilidade: utils.FILIAIS_DF, utils.PRODUTOS_DF etc. sempre refletem a versão atual
+_ATRIBUTOS_CATALOGO = {
+    'FILIAIS_DF': ('FILIAIS', 'df'),
+    'FILIAIS_POR_CNPJ': ('FILIAIS', 'por_cnpj'),
+    'COND_PAGAMENTOS_DF': ('COND_PAGAMENTOS', 'df'),
+    'PRODUTOS_DF': ('PRODUTOS', 'df'),
+    'INDICE_PRODUTOS': ('PRODUTOS', 'indice'),
+}
+
+
+def __getattr__(nome):
+    if nome in _ATRIBUTOS_CATALOGO:
+        nome_tabela, campo = _ATRIBUTOS_CATALOGO[nome]
+        return tabela(nome_tabela)[campo]
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+
+
+def dobrar_acentos(texto):
+    """
+    Remove acentos e coloca em minúsculas: 'Manutenção' -> 'manutencao'.
+    """
+    return unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _indexar_produtos(df):
+    """
+    Índice de busca dos produtos, montado uma vez ao carregar a tabela:
+      - prefixos de COD_PRODUTO
+      - prefixos de cada palavra da DESCRICAO sem acentos
+      - trigramas de código + descrição (busca por trecho no meio do texto)
+    """
+    indice = {'itens': [], 'codigo': {}, 'palavras': {}, 'trigramas': {}}
+    if df is None or df.empty or 'COD_PRODUTO' not in df.columns:
+        return indice
+    produtos = df[['COD_PRODUTO', 'DESCRICAO']].drop_duplicates().fillna('')
+    for i, (codigo, descricao) in enumerate(zip(produtos['COD_PRODUTO'], produtos['DESCRICAO'])):
+        codigo = str(codigo).strip()
+        descricao_dobrada = dobrar_acentos(descricao)
+        indice['itens'].append((codigo, descricao, codigo.lower(), descricao_dobrada))
+        for n in range(1, len(codigo) + 1):
+            indice['codigo'].setdefault(codigo[:n].lower(), []).append(i)
+        for palavra in set(re.findall(r'\w+', descricao_dobrada)):
+            for n in range(1, len(palavra) + 1):
+                indice['palavras'].setdefault(palavra[:n], set()).add(i)
+        for trigrama in _trigramas(f'{codigo.lower()} {descricao_dobrada}'):
+            indice['trigramas'].setdefault(trigrama, set()).add(i)
+    return indice
+
+
+def buscar_produtos(consulta, limite=10, indice=None):
+    """
+    Busca produtos por código ou descrição (sem diferenciar acentos e maiúsculas) e devolve
+    até `limite` itens {'COD_PRODUTO', 'DESCRICAO'} ordenados por relevância:
+    código exato, prefixo do código, descrição começando pela consulta, todas as palavras
+    com prefixo na descrição e, por fim, trecho em qualquer posição.
+    """
+    indice = indice or tabela('PRODUTOS')['indice']
+    termo = dobrar_acentos(consulta).strip()
+    if not termo or not indice['itens']:
+        return []
+    itens = indice['itens']
+    pontuacao = {}
+
+    def pontuar(ids, nota):
+        for i in ids:
+            if nota < pontuacao.get(i, 99):
+                pontuacao[i] = nota
+
+    pontuar(indice['codigo'].get(termo, []), 1)
+    palavras = re.findall(r'\w+', termo)
+    if palavras:
+        candidatos = set.intersection(*(indice['palavras'].get(p, set()) for p in palavras))
+        pontuar((i for i in candidatos if itens[i][3].startswith(termo)), 2)
+        pontuar(candidatos, 3)
+    if len(termo) >= 3:
+        grupos = [indice['trigramas'].get(t, set()) for t in _trigramas(termo)]
+        candidatos = set.intersection(*grupos) if grupos else set()
+        pontuar((i for i in candidatos if termo in itens[i][2] or termo in itens[i][3]), 4)
+    for i in pontuacao:
+        if itens[i][2] == termo:
+            pontuacao[i] = 0
+    melhores = heapq.nsmallest(limite, pontuacao, key=lambda i: (pontuacao[i], len(itens[i][3]), itens[i][0]))
+    return [{'COD_PRODUTO': itens[i][0], 'DESCRICAO': itens[i][1]} for i in melhores]
 
 # ---------------------------------------------------
 #  EXTRAÇÃO (“heurísticas básicas”)
@@ -378,10 +585,12 @@ REGEXS_ESPECIFICOS = {
         r'\b\d{2}\.\d{3}\.\d{3}/\d{6}\b',
         r'\b\d{14}\b'
     ],
+    # [A-Z\s&\.] atravessa linhas (\s) e, com IGNORECASE, casa qualquer texto sem dígitos: sem o
+    # limite {1,200} cada início de linha percorria o resto do documento (tempo quadrático no OCR)
     "Nome_Fornecedor": [
-        r'^[A-Z][A-Z\s&\.]+(?:LTDA|EIRELI|S/A|S\.A\.|S\.A)',
+        r'^[A-Z][A-Z\s&\.]{1,200}(?:LTDA|EIRELI|S/A|S\.A\.|S\.A)',
         r'(?<=DANFE\s+DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRÔNICA\n)[A-Z][A-Z\s&\.]+',
-        r'(?<=\n)[A-Z][A-Z\s&\.]+(?=\nROD|\nCEP|\nFone|\nCNPJ|\nINSCRI[ÇC][ÃA]O)',
+        r'(?<=\n)[A-Z][A-Z\s&\.]{1,200}(?=\nROD|\nCEP|\nFone|\nCNPJ|\nINSCRI[ÇC][ÃA]O)',
         r'(?i)(?:prestador|emitente|fornecedor).*?:\s*([A-Z][A-Z\s&\.]+)'
     ],
     "Cnpj_Cliente": [
@@ -442,42 +651,141 @@ REGEXS_ESPECIFICOS = {
     ]
 }
 
+FLAGS_REGEX = re.MULTILINE | re.IGNORECASE
+
+
+def _compilar_regexs(regexs):
+    """
+    Compila uma única vez todos os padrões de REGEXS_ESPECIFICOS, mantendo a ordem de prioridade.
+    Padrões idênticos entre campos (ex.: CNPJ e datas genéricas) compartilham o mesmo objeto,
+    o que permite avaliá-los uma vez só por texto. Padrões inválidos são ignorados com aviso.
+    """
+    compilados = {}
+    por_texto = {}
+    for campo, padroes in regexs.items():
+        compilados[campo] = []
+        for padrao in padroes:
+            if padrao not in por_texto:
+                try:
+                    por_texto[padrao] = re.compile(padrao, FLAGS_REGEX)
+                except re.error as e:
+                    print(f'Regex inválida em {campo} ignorada ({e}): {padrao}')
+                    por_texto[padrao] = None
+            if por_texto[padrao] is not None:
+                compilados[campo].append(por_texto[padrao])
+    return compilados
+
+
+REGEXS_COMPILADOS = _compilar_regexs(REGEXS_ESPECIFICOS)
+
+# Contadores por padrão: {padrão: [buscas, acertos, segundos]}
+ESTATISTICAS_REGEX = {}
+# A extração roda em várias threads ao mesmo tempo (fila de extração)
+_lock_estatisticas = threading.Lock()
+
+
+def _buscar_padrao(regex, texto):
+    inicio = time.perf_counter()
+    m = regex.search(texto)
+    duracao = time.perf_counter() - inicio
+    with _lock_estatisticas:
+        contador = ESTATISTICAS_REGEX.setdefault(regex.pattern, [0, 0, 0.0])
+        contador[0] += 1
+        contador[1] += 1 if m else 0
+        contador[2] += duracao
+    if not m:
+        return None
+    if m.lastindex:
+        return m.group(1).strip()
+    return m.group(0).strip()
+
+
+def extrair_campos_regex(texto, campos):
+    """
+    Extrai vários campos de uma vez. Cada campo devolve o resultado do primeiro padrão que casar
+    (mesma regra de extrair_por_regex); um padrão compartilhado por vários campos é executado
+    uma única vez sobre o texto. Retorna {campo: valor ou ''}.
+    """
+    resultados_padroes = {}
+    resultado = {}
+    for campo in campos:
+        resultado[campo] = ""
+        for regex in REGEXS_COMPILADOS.get(campo, []):
+            if regex not in resultados_padroes:
+                resultados_padroes[regex] = _buscar_padrao(regex, texto)
+            if resultados_padroes[regex] is not None:
+                resultado[campo] = resultados_padroes[regex]
+                break
+    return resultado
+
+
 def extrair_por_regex(texto, campo):
     """
     Tenta extrair o campo usando os regexs específicos. Retorna o primeiro valor encontrado ou ''.
     """
-    if campo not in REGEXS_ESPECIFICOS:
-        return ""
-    for padrao in REGEXS_ESPECIFICOS[campo]:
-        m = re.search(padrao, texto, re.MULTILINE | re.IGNORECASE)
-        if m:
-            if m.lastindex:
-                return m.group(1).strip()
-            else:
-                return m.group(0).strip()
-    return ""
+    return extrair_campos_regex(texto, [campo])[campo]
+
+
+def estatisticas_regex():
+    """
+    Retorna os contadores de cada padrão (buscas, acertos, tempo total e médio em ms),
+    do mais lento para o mais rápido, para encontrar padrões problemáticos.
+    """
+    linhas = []
+    with _lock_estatisticas:
+        contadores = [(padrao, tuple(valores)) for padrao, valores in ESTATISTICAS_REGEX.items()]
+    for padrao, (buscas, acertos, segundos) in contadores:
+        linhas.append({
+            'padrao': padrao,
+            'buscas': buscas,
+            'acertos': acertos,
+            'tempo_total_ms': segundos * 1000,
+            'tempo_medio_ms': segundos * 1000 / buscas if buscas else 0.0,
+        })
+    return sorted(linhas, key=lambda l: l['tempo_total_ms'], reverse=True)
+
+
+def _indexar_filiais(df):
+    """
+    Monta o índice CNPJ (14 dígitos, com zeros à esquerda) -> (grupo, cod_filial, filial).
+    Em CNPJs repetidos vale a primeira linha da planilha.
+    """
+    indice = {}
+    if df is None or df.empty or 'CNPJ' not in df.columns:
+        return indice
+    for cnpj, grupo, cod_filial, filial in zip(df['CNPJ'], df['GRUPO'], df['Cod. Filial'], df['Filial']):
+        if not isinstance(cnpj, str):
+            continue
+        indice.setdefault(''.join(filter(str.isdigit, cnpj)).zfill(14), (grupo, cod_filial, filial))
+    return indice
 
 
 def buscar_filial_por_cnpj(cnpj_cliente):
     """
-    Busca Grupo, Cod Filial e Filial no DataFrame FILIAIS_DF pelo CNPJ do cliente.
+    Busca Grupo, Cod Filial e Filial pelo CNPJ do cliente no índice por CNPJ da tabela FILIAIS.
     O CNPJ pode vir mascarado ou não, então remove qualquer máscara antes de buscar.
     Considera CNPJs com 13 dígitos na planilha, adicionando zero à esquerda para comparar.
     Retorna (grupo, cod_filial, filial) ou (None, None, None) se não encontrar.
     """
-    try:
-        cnpj_limpo = ''.join(filter(str.isdigit, str(cnpj_cliente)))
-        # Garante que todos os CNPJs da planilha tenham 14 dígitos (adiciona zero à esquerda se necessário)
-        cnpjs_planilha = FILIAIS_DF['CNPJ'].astype(str).apply(lambda x: x.zfill(14))
-        linha = FILIAIS_DF[cnpjs_planilha == cnpj_limpo]
-        if not linha.empty:
-            grupo = linha.iloc[0]['GRUPO']
-            cod_filial = linha.iloc[0]['Cod. Filial']
-            filial = linha.iloc[0]['Filial']
-            return grupo, cod_filial, filial
-    except Exception as e:
-        print(f'Erro ao buscar filial por CNPJ: {e}')
-    return None, None, None
+    cnpj_limpo = ''.join(filter(str.isdigit, str(cnpj_cliente)))
+    return tabela('FILIAIS')['por_cnpj'].get(cnpj_limpo, (None, None, None))
+
+
+def buscar_filiais_por_cnpjs(cnpjs):
+    """
+    Resolve vários CNPJs de uma vez. Retorna {cnpj_informado: (grupo, cod_filial, filial)}.
+    """
+    return {cnpj: buscar_filial_por_cnpj(cnpj) for cnpj in cnpjs}
+
+
+def format_cnpj(cnpj):
+    """
+    Formata um CNPJ de 14 dígitos como xx.xxx.xxx/xxxx-xx. Outros valores voltam apenas com os dígitos.
+    """
+    cnpj = re.sub(r'\D', '', cnpj or '')
+    if len(cnpj) == 14:
+        return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
+    return cnpj
 
 
 def compute_prazo(data_emissao: str, data_vencimento: str):
@@ -493,3 +801,6 @@ def compute_prazo(data_emissao: str, data_vencimento: str):
         return str(delta)
     except Exception:
         return ""
+
+
+carregar_catalogo()